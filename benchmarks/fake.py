@@ -0,0 +1,123 @@
+"""
+
+an in-process stand-in for a pymongo collection. Documents are kept BSON encoded and decoded on
+every read like the driver does, so the benchmarks measure mongogogo and not the network or a server.
+Only the queries and updates needed by the benchmarks are supported.
+
+"""
+
+from bson import BSON, ObjectId
+from bson.codec_options import CodecOptions
+
+class FakeCursor(object):
+    """a cursor over a list of encoded documents"""
+
+    def __init__(self, docs):
+        self._docs = docs
+        self._skip = 0
+        self._limit = 0
+        self._iter = None
+
+    def _started(self):
+        if self._iter is None:
+            docs = self._docs[self._skip:]
+            if self._limit:
+                docs = docs[:self._limit]
+            self._iter = iter(docs)
+        return self._iter
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = abs(n)
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def rewind(self):
+        self._iter = None
+        return self
+
+    def clone(self):
+        clone = FakeCursor(self._docs)
+        clone._skip = self._skip
+        clone._limit = self._limit
+        return clone
+
+    def close(self):
+        self._iter = iter(())
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return BSON(next(self._started())).decode()
+
+    __next__ = next
+
+
+class FakeCollection(object):
+    """a collection keeping BSON documents in a dictionary by ``_id``"""
+
+    codec_options = CodecOptions()
+
+    def __init__(self, name = "benchmark"):
+        self.name = name
+        self.full_name = "benchmark.%s" %name
+        self.docs = {}
+
+    def _matching(self, spec):
+        """return the encoded documents matching a spec of ``_id`` or ``$in`` queries"""
+        if not spec:
+            return self.docs.values()
+        _id = spec.get('_id')
+        if isinstance(_id, dict):
+            return [self.docs[i] for i in _id['$in'] if i in self.docs]
+        return [self.docs[_id]] if _id in self.docs else []
+
+    def find(self, filter = None, projection = None, **kwargs):
+        return FakeCursor(self._matching(filter))
+
+    def find_one(self, filter = None, *args, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id' : filter}
+        for doc in self.find(filter).limit(1):
+            return doc
+        return None
+
+    def save(self, doc, manipulate = True):
+        if doc.get('_id') is None:
+            doc['_id'] = ObjectId()
+        self.docs[doc['_id']] = BSON.encode(doc)
+        return doc['_id']
+
+    def insert_many(self, docs, ordered = True):
+        for doc in docs:
+            self.save(doc)
+
+    def update_one(self, filter, update, upsert = False):
+        for data in self._matching(filter):
+            doc = BSON(data).decode()
+            for path, value in update.get('$set', {}).items():
+                target = doc
+                parts = path.split(".")
+                for part in parts[:-1]:
+                    target = target[int(part)] if isinstance(target, list) else target.setdefault(part, {})
+                target[parts[-1]] = value
+            for path in update.get('$unset', {}):
+                doc.pop(path, None)
+            self.save(doc)
+            return
+
+    def count_documents(self, filter, **kwargs):
+        return len(self._matching(filter))
+
+    def remove(self, spec = None):
+        for data in list(self._matching(spec)):
+            del self.docs[BSON(data).decode()['_id']]
@@ -0,0 +1,276 @@
+"""
+
+benchmarks for schema serialization, record construction, storing and loading records and cursor
+iteration. Run them from the repository root with::
+
+    python benchmarks/run.py                        # run all benchmarks
+    python benchmarks/run.py schema.barcamp         # only those with a name containing one of the arguments
+    python benchmarks/run.py --save baseline.json   # store the results as a baseline
+    python benchmarks/run.py --compare baseline.json
+
+For each benchmark the number of operations per second and the number of objects per operation
+are reported. The latter is the number of objects tracked by the garbage collector which are
+allocated by an operation and still alive afterwards, i.e. the objects making up the result.
+Temporary objects are not counted.
+
+With ``--compare`` each result is compared to the baseline and the exit status is 1 if a benchmark
+got slower than ``--threshold`` or allocates more objects than before.
+
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake import FakeCollection
+from schemas import *
+
+class Benchmark(object):
+    """a named operation to measure
+
+    :param name: the dotted name of the benchmark
+    :param func: the function running one operation. It's return value is kept while objects are counted.
+    :param setup: an optional function called before each timing run, e.g. to reset the fake collection
+    :param number: the number of operations whose results are kept alive while objects are counted.
+        Use a small one for operations with large results like iterating over a whole cursor.
+    """
+
+    def __init__(self, name, func, setup = None, number = 100):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.number = number
+
+    def _time(self, number):
+        """return the seconds needed for ``number`` operations"""
+        func = self.func
+        if self.setup is not None:
+            self.setup()
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.time()
+            for i in xrange(number):
+                func()
+            return time.time() - start
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def ops(self, min_time = 0.2, repeat = 3):
+        """return the number of operations per second of the fastest of ``repeat`` runs which each take
+        at least ``min_time`` seconds"""
+        number = 1
+        while True:
+            elapsed = self._time(number)
+            if elapsed >= min_time:
+                break
+            number *= 2 if elapsed < min_time / 10 else 10
+            number = int(number)
+        best = elapsed
+        for i in range(repeat - 1):
+            best = min(best, self._time(number))
+        return number / best
+
+    def objects(self, number = None):
+        """return the number of objects per operation which are alive after the operation
+
+        :param number: the number of operations to count, by default the ``number`` of the benchmark
+        """
+        number = number or self.number
+        func = self.func
+        if self.setup is not None:
+            self.setup()
+        func() # warm up caches like compiled schemas
+        results = []
+        gc_enabled = gc.isenabled()
+        gc.collect()
+        gc.disable()
+        try:
+            before = gc.get_count()[0]
+            for i in xrange(number):
+                results.append(func())
+            after = gc.get_count()[0]
+        finally:
+            if gc_enabled:
+                gc.enable()
+        # free the results before the next benchmark runs
+        del results
+        gc.collect()
+        # the list of results itself is not counted
+        return (after - before - 1) / float(number)
+
+    def run(self, min_time = 0.2):
+        """return a dictionary with the results of this benchmark"""
+        return {'ops' : self.ops(min_time), 'objects' : self.objects()}
+
+
+def schema_benchmarks():
+    """serialization and deserialization of the schemas in their interpreted and compiled form"""
+    shapes = [
+        ("flat", PersonSchema(), person()),
+        ("nested", OrganisationSchema(), organisation()),
+        ("barcamp", BarcampSchema(), barcamp()),
+    ]
+    result = []
+    for name, schema, data in shapes:
+        raw = schema.serialize(data)
+        compiled = schema.compile()
+        result.extend([
+            Benchmark("schema.%s.serialize" %name, lambda compiled = compiled, data = data: compiled.serialize(data)),
+            Benchmark("schema.%s.deserialize" %name, lambda compiled = compiled, raw = raw: compiled.deserialize(raw)),
+            Benchmark("schema.%s.serialize.interpreted" %name, lambda schema = schema, data = data: schema.serialize(data)),
+            Benchmark("schema.%s.deserialize.interpreted" %name, lambda schema = schema, raw = raw: schema.deserialize(raw)),
+        ])
+    return result
+
+def datetime_benchmarks():
+    """parsing datetime strings with the ISO-8601 fast path, strptime formats, dateutil and the cache"""
+    iso = DateTime()
+    formats = DateTime(formats = ["%d.%m.%Y %H:%M"])
+    cached = DateTime(cache_size = 100)
+    return [
+        Benchmark("datetime.iso8601", lambda: iso.serialize(u"2012-05-01T12:30:15.250+02:00")),
+        Benchmark("datetime.formats", lambda: formats.serialize(u"01.05.2012 12:30")),
+        Benchmark("datetime.dateutil", lambda: iso.serialize(u"May 1 2012 12:30")),
+        Benchmark("datetime.cached", lambda: cached.serialize(u"May 1 2012 12:30")),
+    ]
+
+def record_benchmarks():
+    """constructing records as new ones and from the database"""
+    result = []
+    for name, cls, data in [("person", Person, person()), ("organisation", Organisation, organisation()),
+            ("barcamp", Barcamp, barcamp())]:
+        raw = cls.schema.serialize(data)
+        raw['_id'] = u"1"
+        obj = cls(data)
+        batch = [dict(raw, _id = i) for i in range(100)]
+        result.extend([
+            Benchmark("record.%s.new" %name, lambda cls = cls, data = data: cls(data)),
+            Benchmark("record.%s.from_db" %name, lambda cls = cls, raw = raw: cls(from_db = raw)),
+            Benchmark("record.%s.from_db.lazy" %name, lambda cls = cls, raw = raw: cls(from_db = raw, lazy = True)),
+            Benchmark("record.%s.from_db_batch" %name, lambda cls = cls, batch = batch: cls.from_db_batch(batch)),
+            Benchmark("record.%s.initialize_defaults" %name, lambda obj = obj: obj._initialize_defaults()),
+        ])
+    return result
+
+def collection_benchmarks():
+    """storing and loading records with a fake pymongo collection"""
+    result = []
+    for name, collection_class, data_class, data in [
+            ("person", Persons, Person, person()),
+            ("barcamp", Barcamps, Barcamp, barcamp())]:
+        collection = collection_class(FakeCollection(name))
+        loaded = {}
+
+        def setup(collection = collection, data_class = data_class, data = data, loaded = loaded):
+            collection.collection.docs.clear()
+            obj = collection.put(data_class(data))
+            loaded['obj'] = collection.get(obj._id)
+            loaded['_id'] = obj._id
+
+        def put_changes(collection = collection, loaded = loaded):
+            obj = loaded['obj']
+            obj['name' if 'name' in obj else 'firstname'] = u"changed"
+            return collection.put(obj)
+
+        result.extend([
+            Benchmark("collection.%s.put.new" %name,
+                lambda collection = collection, data_class = data_class, data = data: collection.put(data_class(data)),
+                setup = setup),
+            Benchmark("collection.%s.put.changes" %name, put_changes, setup = setup),
+            Benchmark("collection.%s.get" %name,
+                lambda collection = collection, loaded = loaded: collection.get(loaded['_id']), setup = setup),
+        ])
+    return result
+
+def cursor_benchmarks():
+    """iterating over records of a cursor. One operation is a complete iteration over 1000 records."""
+    result = []
+    for name, collection_class, data in [("person", Persons, person), ("barcamp", Barcamps, barcamp)]:
+        collection = collection_class(FakeCollection(name))
+        for i in range(1000):
+            doc = collection.data_class.schema.serialize(data(i))
+            collection.collection.save(doc)
+        result.extend([
+            Benchmark("cursor.%s.iterate" %name, lambda collection = collection: list(collection.find()),
+                number = 3),
+            Benchmark("cursor.%s.iterate.lazy" %name, lambda collection = collection: list(collection.find(lazy = True)),
+                number = 3),
+            Benchmark("cursor.%s.iterate.raw" %name, lambda collection = collection: list(collection.collection.find()),
+                number = 3),
+        ])
+    return result
+
+def benchmarks():
+    """return all benchmarks"""
+    return schema_benchmarks() + datetime_benchmarks() + record_benchmarks() + collection_benchmarks() + cursor_benchmarks()
+
+def compare(name, result, baseline, threshold):
+    """compare a result to the baseline
+
+    :return: a tuple of a description of the difference and whether it is a regression
+    """
+    old = baseline.get(name)
+    if old is None:
+        return "new", False
+    change = result['ops'] / old['ops'] - 1
+    regression = change < -threshold
+    notes = "%+.1f%%" %(change * 100)
+    if result['objects'] > old['objects'] + 0.5:
+        notes += ", %+.1f objects" %(result['objects'] - old['objects'])
+        regression = True
+    if regression:
+        notes += " REGRESSION"
+    return notes, regression
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "run the mongogogo benchmarks")
+    parser.add_argument("names", nargs = "*", help = "only run benchmarks whose name contains one of these")
+    parser.add_argument("--save", metavar = "FILE", help = "store the results as baseline in FILE")
+    parser.add_argument("--compare", metavar = "FILE", help = "compare the results to the baseline in FILE")
+    parser.add_argument("--threshold", type = float, default = 0.1,
+        help = "the relative slowdown counting as regression (default 0.1)")
+    parser.add_argument("--min-time", type = float, default = 0.2,
+        help = "the minimal duration of a timing run in seconds (default 0.2)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            stored = json.load(f)
+        baseline = stored['results']
+        if stored.get('python') != platform.python_version():
+            print "warning: the baseline was made with python %s" %stored.get('python')
+
+    results = {}
+    regressions = []
+    print "%-42s %12s %12s  %s" %("benchmark", "ops/sec", "objects/op", "baseline" if baseline is not None else "")
+    for benchmark in benchmarks():
+        if args.names and not [n for n in args.names if n in benchmark.name]:
+            continue
+        result = results[benchmark.name] = benchmark.run(args.min_time)
+        notes = ""
+        if baseline is not None:
+            notes, regression = compare(benchmark.name, result, baseline, args.threshold)
+            if regression:
+                regressions.append(benchmark.name)
+        print "%-42s %12.1f %12.1f  %s" %(benchmark.name, result['ops'], result['objects'], notes)
+        sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({'python' : platform.python_version(), 'results' : results}, f, indent = 2, sort_keys = True)
+    if regressions:
+        print "%s regressions: %s" %(len(regressions), ", ".join(regressions))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+
+schemas, records and documents used by the benchmarks. They follow the shapes of the test fixtures:
+a flat person, a barcamp with sub documents and lists of them, and a deeply nested organisation
+with ``Dict`` fields.
+
+"""
+
+import datetime
+from mongogogo import *
+
+class PersonSchema(Schema):
+    firstname = String(required = True)
+    lastname = String(default = "foobar", required = True)
+    email = String()
+    creation = DateTime(required = True, default = datetime.datetime.utcnow)
+    age = Integer(default = 24)
+    score = Float()
+    active = Boolean()
+    tags = List(String())
+
+class Person(Record):
+    schema = PersonSchema()
+    default_values = {
+        'lastname' : 'foobar',
+        'creation' : datetime.datetime.utcnow,
+        'age' : 24,
+        'tags' : [],
+    }
+
+class Persons(Collection):
+    data_class = Person
+
+class Location(Schema):
+    name = String()
+    street = String()
+    city = String()
+    zip = String()
+    lat = Float()
+    lng = Float()
+
+class Session(Schema):
+    title = String()
+    speaker = String()
+    day = Date()
+    room = String()
+    attendees = List(String())
+
+class BarcampSchema(Schema):
+    name = String(required = True)
+    description = String()
+    start_date = Date()
+    end_date = Date()
+    location = Location()
+    locations = List(Location())
+    sessions = List(Session())
+    extra = Dict(Integer())
+
+class Barcamp(Record):
+    schema = BarcampSchema()
+    default_values = {
+        'location' : {},
+        'locations' : [],
+        'sessions' : [],
+        'extra' : {},
+    }
+
+class Barcamps(Collection):
+    data_class = Barcamp
+
+class Address(Schema):
+    street = String()
+    city = String()
+    country = String()
+
+class Contact(Schema):
+    name = String()
+    phone = String()
+    address = Address()
+
+class Department(Schema):
+    name = String()
+    head = Contact()
+    budget = Dict(Float())
+
+class OrganisationSchema(Schema):
+    name = String()
+    contact = Contact()
+    department = Department()
+    settings = Dict(String(), dotted = True)
+
+class Organisation(Record):
+    schema = OrganisationSchema()
+    default_values = {
+        'contact' : {'address' : {}},
+        'department' : {'head' : {'address' : {}}, 'budget' : {}},
+        'settings' : {},
+    }
+
+def person(i = 0):
+    """return the python data of a flat person"""
+    return dict(
+        firstname = u"First%s" %i,
+        lastname = u"Last%s" %i,
+        email = u"person%s@example.com" %i,
+        creation = datetime.datetime(2012, 1, 1, 12, 30),
+        age = 20 + i % 50,
+        score = i / 3.0,
+        active = bool(i % 2),
+        tags = [u"a", u"b", u"c"],
+    )
+
+def barcamp(i = 0, sessions = 20):
+    """return the python data of a barcamp with a list of ``sessions`` sub documents"""
+    location = dict(name = u"Location %s" %i, street = u"Street 1", city = u"Aachen", zip = u"52062",
+        lat = 50.77, lng = 6.08)
+    return dict(
+        name = u"Barcamp %s" %i,
+        description = u"a barcamp " * 20,
+        start_date = datetime.date(2012, 5, 1),
+        end_date = datetime.date(2012, 5, 2),
+        location = location,
+        locations = [dict(location) for j in range(3)],
+        sessions = [dict(title = u"Session %s" %j, speaker = u"Speaker %s" %j,
+            day = datetime.date(2012, 5, 1 + j % 2), room = u"Room %s" %(j % 4),
+            attendees = [u"p%s" %k for k in range(10)]) for j in range(sessions)],
+        extra = dict(("key%s" %j, j) for j in range(10)),
+    )
+
+def organisation(i = 0):
+    """return the python data of a deeply nested organisation"""
+    address = dict(street = u"Street %s" %i, city = u"Aachen", country = u"DE")
+    return dict(
+        name = u"Organisation %s" %i,
+        contact = dict(name = u"Contact", phone = u"0241", address = dict(address)),
+        department = dict(name = u"Department", head = dict(name = u"Head", phone = u"0242",
+            address = dict(address)), budget = dict(("y%s" %j, j * 1000.0) for j in range(10))),
+        settings = dict(("setting%s" %j, u"value%s" %j) for j in range(10)),
+    )
@@ -0,0 +1,116 @@
+"""
+
+aggregation pipelines
+
+"""
+
+from bson.son import SON
+from query import Expression
+
+__all__ = ["Pipeline"]
+
+
+# stages after which the documents still have the shape of the collection's documents
+shape_preserving = ("$match", "$sort", "$limit", "$skip", "$sample")
+
+def preserves_shape(pipeline):
+    """return whether the documents resulting from ``pipeline`` have the shape of the input documents"""
+    for stage in pipeline:
+        if [op for op in stage if op not in shape_preserving]:
+            return False
+    return True
+
+
+class Pipeline(list):
+    """a list of aggregation stages with methods for adding the common ones. Each method returns the
+    pipeline so they can be chained::
+
+        Pipeline().match(Person.q.age > 30).group("$lastname", count = {'$sum' : 1}).sort("-count")
+    """
+
+    def stage(self, op, value):
+        """add a stage"""
+        self.append({op : value})
+        return self
+
+    def match(self, spec):
+        """add a ``$match`` stage for a query spec or an ``Expression``"""
+        if isinstance(spec, Expression):
+            spec = spec.to_spec()
+        return self.stage("$match", spec)
+
+    def project(self, *fields, **spec):
+        """add a ``$project`` stage including ``fields`` and the expressions given as keyword arguments"""
+        projection = dict([(field, 1) for field in fields])
+        projection.update(spec)
+        return self.stage("$project", projection)
+
+    def add_fields(self, **fields):
+        """add an ``$addFields`` stage"""
+        return self.stage("$addFields", fields)
+
+    def group(self, _id, **accumulators):
+        """add a ``$group`` stage
+
+        :param _id: the group key expression, e.g. ``"$lastname"`` or ``None`` for one group
+        :param accumulators: the fields of the result documents, e.g. ``total = {'$sum' : "$amount"}``
+        """
+        spec = {'_id' : _id}
+        spec.update(accumulators)
+        return self.stage("$group", spec)
+
+    def sort(self, *keys):
+        """add a ``$sort`` stage. Keys with a ``-`` prefix are sorted in descending order."""
+        order = SON()
+        for key in keys:
+            if key.startswith("-"):
+                order[key[1:]] = -1
+            else:
+                order[key] = 1
+        return self.stage("$sort", order)
+
+    def limit(self, n):
+        """add a ``$limit`` stage"""
+        return self.stage("$limit", n)
+
+    def skip(self, n):
+        """add a ``$skip`` stage"""
+        return self.stage("$skip", n)
+
+    def unwind(self, path, preserve_empty = False):
+        """add an ``$unwind`` stage for the list field ``path``"""
+        if not path.startswith("$"):
+            path = "$" + path
+        if preserve_empty:
+            return self.stage("$unwind", {'path' : path, 'preserveNullAndEmptyArrays' : True})
+        return self.stage("$unwind", path)
+
+    def lookup(self, collection, local_field, foreign_field, as_field):
+        """add a ``$lookup`` stage joining the documents of ``collection`` (a name or a ``Collection``)"""
+        if not isinstance(collection, basestring):
+            collection = collection.collection.name
+        return self.stage("$lookup", {'from' : collection, 'localField' : local_field,
+            'foreignField' : foreign_field, 'as' : as_field})
+
+    def count(self, field = "count"):
+        """add a ``$count`` stage"""
+        return self.stage("$count", field)
+
+
+class SchemaResults(object):
+    """turns result documents into python data by deserializing them with a schema. The ``_id`` is kept
+    as it's the group key in case of a ``$group`` stage."""
+
+    def __init__(self, schema):
+        self.deserialize = schema.compile().deserialize
+
+    def from_db_batch(self, docs, collection = None, **kw):
+        """deserialize a list of result documents"""
+        deserialize = self.deserialize
+        result = []
+        for doc in docs:
+            output = deserialize(doc)
+            if "_id" in doc and "_id" not in output:
+                output["_id"] = doc["_id"]
+            result.append(output)
+        return result
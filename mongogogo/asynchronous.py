@@ -0,0 +1,400 @@
+"""
+
+asynchronous collections and cursors on top of a Motor compatible driver
+
+All database methods return Tornado futures and are meant to be used from coroutines::
+
+    persons = AsyncPersons(motor_client.db.persons)
+
+    @gen.coroutine
+    def handler(_id):
+        person = yield persons.get(_id)
+        person.age += 1
+        yield persons.put(person)
+
+        cursor = persons.find({'age' : {'$gt' : 30}})
+        while (yield cursor.fetch_next):
+            person = cursor.next_object()
+
+The records, schemas and hooks are the same as for the blocking ``Collection``. This module needs
+``tornado`` (and for Python 2 the ``futures`` backport) which are not required by mongogogo itself.
+
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.concurrent import is_future
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from record import Collection, ObjectNotFound, NotSupported, PutManyResult, DatabaseError
+from schema import Invalid
+from projection import call_site
+from query import Expression
+from updates import convert_update, guarded
+from references import reference_targets, resolve_references
+
+__all__ = ["AsyncCollection", "AsyncCursor"]
+
+
+_executor = None
+
+def get_executor():
+    """return the executor shared by all asynchronous collections which don't define their own"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(4)
+    return _executor
+
+
+class AsyncCursor(object):
+    """an asynchronous cursor returning records. It wraps a Motor compatible cursor and fetches a batch
+    of documents at once which is then turned into records by the collection.
+
+    Methods which are not defined here are passed on to the driver's cursor. Those returning the
+    driver's cursor like ``sort()``, ``limit()`` or ``skip()`` return this cursor instead.
+    """
+
+    default_batch_size = 100 # number of documents to fetch and wrap at once if no batch size is given
+
+    def __init__(self, collection, cursor, wrap = None, wrap_kw = {}, batch_size = None):
+        """initialize the cursor
+
+        :param collection: the ``AsyncCollection`` the records belong to
+        :param cursor: the cursor of the driver
+        :param wrap: the class to wrap the documents with, e.g. the data class of the collection. If it's
+            ``None`` then the documents are returned as they are.
+        :param wrap_kw: additional keyword arguments for creating the records
+        :param batch_size: the number of documents to fetch and wrap at once
+        """
+        self.cursor = cursor
+        self.__mongogogo_collection = collection
+        self.__wrap = wrap
+        self.__wrap_kw = wrap_kw
+        self.__batch_size = batch_size or 0
+        self.__buffer = deque()
+        self.__exhausted = False
+        self.__populate = None
+
+    def __getattr__(self, name):
+        if name == "cursor":
+            raise AttributeError(name)
+        attr = getattr(self.cursor, name)
+        if not callable(attr):
+            return attr
+        def method(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if result is self.cursor:
+                return self
+            return result
+        return method
+
+    def batch_size(self, batch_size):
+        """set the number of documents fetched and wrapped at once"""
+        self.cursor.batch_size(batch_size)
+        self.__batch_size = batch_size
+        return self
+
+    def populate(self, *paths, **collections):
+        """populate the reference fields ``paths`` of the records of each batch, see
+        ``AsyncCollection.populate()``"""
+        self.__populate = (paths, collections)
+        return self
+
+    @gen.coroutine
+    def _fetch(self):
+        """fetch the next batch of documents into the buffer"""
+        docs = yield self.cursor.to_list(self.__batch_size or self.default_batch_size)
+        if not docs:
+            self.__exhausted = True
+            return
+        collection = self.__mongogogo_collection
+        records = yield collection._wrap(docs, self.__wrap, self.__wrap_kw)
+        if self.__populate is not None and self.__wrap is not None:
+            paths, collections = self.__populate
+            yield collection.populate(records, *paths, **collections)
+        self.__buffer.extend(records)
+
+    @property
+    def fetch_next(self):
+        """a future resolving to ``True`` if another record can be retrieved with ``next_object()``"""
+        return self._fetch_next()
+
+    @gen.coroutine
+    def _fetch_next(self):
+        if not self.__buffer and not self.__exhausted:
+            yield self._fetch()
+        raise gen.Return(bool(self.__buffer))
+
+    def next_object(self):
+        """return the next record or ``None`` if there is none. Use ``fetch_next`` first."""
+        if not self.__buffer:
+            return None
+        return self.__buffer.popleft()
+
+    @gen.coroutine
+    def to_list(self, length = None):
+        """return a future for a list of the next ``length`` records or all remaining records"""
+        result = []
+        while length is None or len(result) < length:
+            more = yield self.fetch_next
+            if not more:
+                break
+            result.append(self.next_object())
+        raise gen.Return(result)
+
+
+class AsyncCollection(Collection):
+    """a collection using a Motor compatible collection. ``get()``, ``get_many()``, ``put()``,
+    ``put_many()``, ``remove()``, ``find_one()``, ``update()``, ``update_record()``, ``count()``,
+    ``exists()``, ``distinct()``, ``populate()`` and ``paginate()`` return futures, ``find()`` and
+    ``aggregate()`` return an ``AsyncCursor``.
+
+    Batches of at least ``offload_threshold`` documents are deserialized in a thread pool so the IO loop
+    is not blocked by the schema. The ``after_load`` hooks of such records run in that thread pool.
+
+    Note that an ``identity_map()`` is bound to the thread, it is shared by all coroutines of the IO loop.
+    The ``check_queries`` setting is ignored and ``buffered()`` raises ``NotSupported`` as the
+    ``WriteBuffer`` writes with blocking calls.
+    """
+
+    offload_threshold = 200 # batches with at least this number of documents are deserialized in the executor
+    executor = None # the executor for deserializing large batches, defaults to a shared thread pool
+
+    @gen.coroutine
+    def _wrap(self, docs, wrap, wrap_kw = {}):
+        """return the objects of the class ``wrap`` for a list of documents"""
+        if wrap is None or not docs:
+            raise gen.Return(docs)
+        if len(docs) >= self.offload_threshold:
+            executor = self.executor or get_executor()
+            records = yield executor.submit(wrap.from_db_batch, docs, collection = self, **wrap_kw)
+        else:
+            records = wrap.from_db_batch(docs, collection = self, **wrap_kw)
+        raise gen.Return(records)
+
+    def buffered(self, *args, **kwargs):
+        """raise ``NotSupported`` as the ``WriteBuffer`` writes with blocking calls"""
+        raise NotSupported("write buffers are not supported by asynchronous collections")
+
+    @gen.coroutine
+    def put(self, obj):
+        """store an object, see ``Collection.put()``"""
+        if self.partial_updates and obj._mg_raw is not None and obj._id is not None and not obj.schemaless:
+            obj, update, fields = self._prepare_changes(obj)
+            if update:
+                yield self.collection.update_one({'_id' : obj._id}, update)
+            raise gen.Return(self._changes_stored(obj, fields))
+        obj, data = self._prepare(obj)
+        if data.get('_id') is None:
+            data.pop('_id', None)
+            result = yield self.collection.insert_one(data)
+            data['_id'] = result.inserted_id
+        else:
+            yield self.collection.replace_one({'_id' : data['_id']}, data, upsert = True)
+        raise gen.Return(self._stored(obj, data))
+
+    save = put
+
+    @gen.coroutine
+    def put_many(self, objs, ordered = False, batch_size = 1000):
+        """return a future for storing many objects, see ``Collection.put_many()``"""
+        result = PutManyResult()
+        batch = []
+        for index, obj in enumerate(objs):
+            try:
+                batch.append((index,) + self._prepare(obj))
+            except (Invalid, ValueError, DatabaseError), e:
+                result.errors[index] = e
+            if len(batch) >= batch_size:
+                yield self._put_batch(batch, ordered, result)
+                batch = []
+        if batch:
+            yield self._put_batch(batch, ordered, result)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def _put_batch(self, batch, ordered, result):
+        """write a batch of ``(index, obj, data)`` tuples with one ``bulk_write``"""
+        docs = [data for index, obj, data in batch]
+        errors = {}
+        try:
+            yield self.collection.bulk_write(self._write_requests(docs), ordered = ordered)
+        except BulkWriteError, e:
+            errors = self._write_errors(e, len(docs), ordered)
+        self._batch_stored(batch, errors, result)
+
+    @gen.coroutine
+    def get(self, _id):
+        """return a future for an object by it's id"""
+        _id = self._convert_id(_id)
+        obj = self._cached(_id)
+        if obj is not None:
+            raise gen.Return(obj)
+        data = yield self.collection.find_one({'_id' : _id})
+        if data is None:
+            raise ObjectNotFound(_id)
+        data['_id'] = _id
+        obj = self.data_class(from_db = data, collection = self)
+        self._remember(_id, obj)
+        raise gen.Return(obj)
+
+    @gen.coroutine
+    def get_many(self, ids, missing = 'skip', chunk_size = 1000):
+        """return a future for the objects of a list of ids, see ``Collection.get_many()``"""
+        if missing not in ('skip', 'none', 'raise'):
+            raise ValueError("missing has to be one of skip, none or raise")
+        ids = [self._convert_id(_id) for _id in ids]
+        objs = {}
+        todo = []
+        for _id in ids:
+            if _id in objs:
+                continue
+            obj = self._cached(_id)
+            if obj is not None:
+                objs[_id] = obj
+            else:
+                objs[_id] = None
+                todo.append(_id)
+        for start in range(0, len(todo), chunk_size):
+            chunk = todo[start:start + chunk_size]
+            docs = yield self.collection.find({'_id' : {'$in' : chunk}}).to_list(None)
+            records = yield self._wrap(docs, self.data_class)
+            for obj in records:
+                objs[obj._id] = obj
+                self._remember(obj._id, obj)
+        result = []
+        for _id in ids:
+            obj = objs.get(_id)
+            if obj is None:
+                if missing == 'raise':
+                    raise ObjectNotFound(_id)
+                if missing == 'none':
+                    result.append(None)
+                continue
+            result.append(obj)
+        raise gen.Return(result)
+
+    def remove(self, obj):
+        """return a future for removing an object"""
+        return self._remove({'_id' : obj._id})
+
+    @gen.coroutine
+    def _remove(self, spec):
+        """remove all objects matching the query ``spec``"""
+        self._forget_spec(spec)
+        result = yield self.collection.delete_many(spec)
+        raise gen.Return(result)
+
+    def check_query(self, spec, sort = None):
+        """not supported as ``explain()`` is asynchronous as well"""
+        return None
+
+    def find(self, *args, **kwargs):
+        """return an ``AsyncCursor`` for the records matching a query, see ``Collection.find()``"""
+        if kwargs.get('autoproject') is True:
+            kwargs['autoproject'] = call_site()
+        args, kwargs, wrap_kw = self._find_args(args, kwargs)
+        return AsyncCursor(self, self.collection.find(*args, **kwargs), self.data_class, wrap_kw)
+
+    def find_one(self, spec_or_id = None, *args, **kwargs):
+        """return a future for the first record matching a query or ``None``"""
+        if isinstance(spec_or_id, Expression):
+            spec_or_id = spec_or_id.to_spec()
+        if spec_or_id is not None and not isinstance(spec_or_id, dict):
+            spec_or_id = {"_id": spec_or_id}
+        if kwargs.get('autoproject') is True:
+            kwargs['autoproject'] = call_site()
+        return self._first(self.find(spec_or_id, *args, **kwargs).limit(-1))
+
+    @gen.coroutine
+    def _first(self, cursor):
+        """return the first record of ``cursor`` or ``None``"""
+        records = yield cursor.to_list(1)
+        raise gen.Return(records[0] if records else None)
+
+    @gen.coroutine
+    def update(self, spec, ops, multi = False, upsert = False):
+        """return a future for applying update operators to the matching documents, see ``Collection.update()``"""
+        if isinstance(spec, Expression):
+            spec = spec.to_spec()
+        update, guards = convert_update(ops, self._field_node)
+        self._forget_spec(spec)
+        if multi:
+            result = yield self.collection.update_many(guarded(spec, guards), update, upsert = upsert)
+        else:
+            result = yield self.collection.update_one(guarded(spec, guards), update, upsert = upsert)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def update_record(self, obj, ops, refresh = False):
+        """return a future for applying update operators to a record, see ``Collection.update_record()``"""
+        if obj._id is None:
+            raise ObjectNotFound(None)
+        update, guards = convert_update(ops, self._field_node)
+        spec = guarded({'_id' : obj._id}, guards)
+        self._forget(obj._id, obj)
+        if refresh:
+            doc = yield self.collection.find_one_and_update(spec, update, return_document = ReturnDocument.AFTER)
+            matched = doc is not None
+        else:
+            result = yield self.collection.update_one(spec, update)
+            matched = result.matched_count > 0
+        if not matched:
+            if guards and (yield self.exists(obj._id)):
+                raise self._range_error(guards)
+            raise ObjectNotFound(obj._id)
+        if refresh:
+            obj._mg_refresh(doc)
+        raise gen.Return(obj)
+
+    @gen.coroutine
+    def count(self, spec = None, **kwargs):
+        """return a future for the number of documents matching ``spec``, see ``Collection.count()``"""
+        if isinstance(spec, Expression):
+            spec = spec.to_spec()
+        result = yield self.collection.count_documents(spec or {}, **kwargs)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def exists(self, spec_or_id):
+        """return a future for whether a document matching the query or with the given id exists"""
+        if isinstance(spec_or_id, Expression):
+            spec_or_id = spec_or_id.to_spec()
+        if not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id' : self._convert_id(spec_or_id)}
+        doc = yield self.collection.find_one(spec_or_id, projection = {'_id' : 1})
+        raise gen.Return(doc is not None)
+
+    @gen.coroutine
+    def distinct(self, field, spec = None):
+        """return a future for the deserialized distinct values of ``field``, see ``Collection.distinct()``"""
+        if isinstance(spec, Expression):
+            spec = spec.to_spec()
+        values = yield self.collection.distinct(field, spec)
+        raise gen.Return(self._distinct_values(field, values))
+
+    @gen.coroutine
+    def populate(self, records, *paths, **collections):
+        """return a future for replacing the ids in reference fields of records with the referenced records,
+        see ``Collection.populate()``. There is one ``get_many()`` call per target collection which may be
+        asynchronous or blocking."""
+        for target, slots, ids in reference_targets(records, self.data_class.schema, paths, collections):
+            found = target.get_many(ids, missing = 'none')
+            if is_future(found):
+                found = yield found
+            resolve_references(slots, ids, found)
+        raise gen.Return(records)
+
+    def aggregate(self, pipeline, result_schema = None, allow_disk_use = False, batch_size = None, **kwargs):
+        """return an ``AsyncCursor`` over the results of an aggregation pipeline, see ``Collection.aggregate()``"""
+        wrap, kwargs = self._aggregate_args(pipeline, result_schema, allow_disk_use, batch_size, kwargs)
+        cursor = self.collection.aggregate(list(pipeline), **kwargs)
+        return AsyncCursor(self, cursor, wrap, batch_size = batch_size)
+
+    @gen.coroutine
+    def paginate(self, spec = None, sort = None, after = None, before = None, page_size = 20, **kwargs):
+        """return a future for a page of records, see ``Collection.paginate()``"""
+        spec, keys, order = self._page_query(spec, sort, after, before)
+        records = yield self.find(spec, sort = order, limit = page_size + 1, **kwargs).to_list()
+        raise gen.Return(self._page(records, keys, after, before, page_size))
@@ -0,0 +1,74 @@
+"""
+
+caching of loaded records by their id
+
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+__all__ = ["RecordCache"]
+
+class RecordCache(object):
+    """a cache for records keyed by their id. If it is full the least recently used record is removed.
+    Records can also expire after some time.
+
+    Note that the cached records are shared between all users of the cache, so better treat them as read only
+    if you use one cache for several threads.
+    """
+
+    def __init__(self, maxsize = 1000, ttl = None, clock = time.time):
+        """initialize the cache
+
+        :param maxsize: the maximum number of records to keep or ``None`` for no limit
+        :param ttl: the number of seconds after which a record expires or ``None`` to keep it until it
+            gets evicted or invalidated
+        :param clock: the function to use for retrieving the current time
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, _id):
+        """return the record for ``_id`` or ``None`` if it is not cached"""
+        with self._lock:
+            entry = self._records.pop(_id, None)
+            if entry is not None and (entry[0] is None or entry[0] > self.clock()):
+                self._records[_id] = entry # make it the most recently used one
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, _id, record):
+        """store ``record`` under ``_id``"""
+        expires = None
+        if self.ttl is not None:
+            expires = self.clock() + self.ttl
+        with self._lock:
+            self._records.pop(_id, None)
+            self._records[_id] = (expires, record)
+            if self.maxsize is not None:
+                while len(self._records) > self.maxsize:
+                    self._records.popitem(last = False)
+
+    def invalidate(self, _id):
+        """remove the record for ``_id``"""
+        with self._lock:
+            self._records.pop(_id, None)
+
+    def clear(self):
+        """remove all records"""
+        with self._lock:
+            self._records.clear()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, _id):
+        return _id in self._records
@@ -25,42 +25,152 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 # 
-# This was copied from mongokit as it looked useful. It was changed slightly though to adapt it
+# This was originally copied from mongokit. It now wraps the pymongo cursor instead of subclassing it.
 
-from pymongo.cursor import Cursor as PymongoCursor
+from itertools import islice
 from collections import deque
+from bson import decode_all
+from metrics import disabled
+
+class Cursor(object):
+    """a cursor returning records. It wraps a pymongo cursor and fetches a whole batch of documents at
+    once which is then turned into records with ``from_db_batch()`` of the wrap class.
+
+    Methods which are not defined here are passed on to the pymongo cursor. Those returning the pymongo
+    cursor like ``sort()``, ``limit()`` or ``skip()`` return this cursor instead so they can be chained.
+    """
+
+    default_batch_size = 100 # number of documents to wrap at once if no batch size is given
 
-class Cursor(PymongoCursor):
     def __init__(self, collection, *args, **kwargs):
-        self.__wrap = None
+        """initialize the cursor
+
+        :param collection: the mongogogo ``Collection`` to query
+        :param wrap: the class to wrap the documents with, e.g. a ``Record`` subclass
+        :param wrap_kw: additional keyword arguments for creating the wrapped objects
+        :param raw_batches: if ``True`` then the server batches are fetched as raw BSON and decoded at once
+        :param cursor: an existing pymongo cursor to wrap, e.g. the result of ``aggregate()``
+        :param args: further arguments are passed to ``find()`` of the pymongo collection
+        """
+        cursor = kwargs.pop('cursor', None)
+        self.__wrap = kwargs.pop('wrap', None)
+        self.__wrap_kw = kwargs.pop('wrap_kw', {})
+        self.__raw_batches = kwargs.pop('raw_batches', False)
         self.__mongogogo_collection = collection
-        if kwargs:
-            self.__wrap = kwargs.pop('wrap', None)
-        super(Cursor, self).__init__(collection.collection, *args, **kwargs)
+        self.__batch_size = kwargs.get('batch_size') or 0
+        self.__buffer = deque()
+        self.__populate = None
+        self.__spec = args[0] if args else kwargs.get('filter') # the query to check sorts with, see sort()
+        if cursor is not None:
+            self.cursor = cursor
+        elif self.__raw_batches:
+            self.cursor = collection.collection.find_raw_batches(*args, **kwargs)
+        else:
+            self.cursor = collection.collection.find(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name == "cursor":
+            raise AttributeError(name)
+        attr = getattr(self.cursor, name)
+        if not callable(attr):
+            return attr
+        def method(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if result is self.cursor:
+                return self
+            return result
+        return method
+
+    def batch_size(self, batch_size):
+        """set the number of documents fetched and wrapped at once"""
+        self.cursor.batch_size(batch_size)
+        self.__batch_size = batch_size
+        return self
+
+    def sort(self, key_or_list, direction = None):
+        """sort the documents like the pymongo cursor does. If the collection checks its queries, the
+        query is checked again with this sort, see ``Collection.check_query()``."""
+        self.cursor.sort(key_or_list, direction)
+        collection = self.__mongogogo_collection
+        if collection.check_queries:
+            if isinstance(key_or_list, basestring):
+                key_or_list = [(key_or_list, direction or 1)]
+            collection.check_query(self.__spec, list(key_or_list))
+        return self
+
+    def populate(self, *paths, **collections):
+        """populate the reference fields ``paths`` of the records, see ``Collection.populate()``. This
+        happens for each batch so there is one query per target collection and batch."""
+        self.__populate = (paths, collections)
+        return self
+
+    def rewind(self):
+        """rewind the cursor to it's unevaluated state"""
+        self.cursor.rewind()
+        self.__buffer.clear()
+        return self
+
+    def clone(self):
+        """return a clone of this cursor in it's unevaluated state"""
+        clone = Cursor.__new__(Cursor)
+        clone.__dict__.update(self.__dict__)
+        clone.cursor = self.cursor.clone()
+        clone.__buffer = deque()
+        return clone
+
+    def _wrap(self, docs, op = disabled):
+        """turn a list of raw documents into objects of the wrap class"""
+        wrap = self.__wrap
+        if wrap is None or not docs:
+            return docs
+        collection = self.__mongogogo_collection
+        from_db_batch = getattr(wrap, "from_db_batch", None)
+        if from_db_batch is not None:
+            records = op.timed("deserialize", from_db_batch, docs, collection = collection, **self.__wrap_kw)
+        else:
+            records = op.timed("deserialize", lambda: [wrap(from_db = doc, collection = collection, **self.__wrap_kw)
+                for doc in docs])
+        if self.__populate is not None:
+            paths, collections = self.__populate
+            collection.populate(records, *paths, **collections)
+        return records
+
+    def _fetch(self):
+        """fetch the next batch of documents into the buffer"""
+        with self.__mongogogo_collection._operation("iterate") as op:
+            if self.__raw_batches:
+                data = op.timed("server", next, self.cursor, None)
+                if data is None:
+                    return
+                docs = op.timed("deserialize", decode_all, data, self.cursor.collection.codec_options)
+                op.add_raw(len(docs), len(data))
+            else:
+                docs = op.timed("server", list, islice(self.cursor, self.__batch_size or self.default_batch_size))
+                op.add_documents(docs)
+            self.__buffer.extend(self._wrap(docs, op))
+
+    def __iter__(self):
+        return self
 
     def next(self):
         """Advance the cursor."""
-        if self.__empty:
-            raise StopIteration
-        _db = self.__collection.database
-        if len(self.__data) or self._refresh():
-            if self.__manipulate:
-                son = _db._fix_outgoing(self.__data.popleft(),
-                                         self.__collection)
-            else:
-                son = self.__data.popleft()
-            
-            # our own addition
-            if self.__wrap is not None:
-                return self.__wrap(from_db = son, collection=self.__mongogogo_collection)
-            else:
-                return son
-        else:
-            raise StopIteration
+        if not self.__buffer:
+            self._fetch()
+            if not self.__buffer:
+                raise StopIteration
+        return self.__buffer.popleft()
 
+    __next__ = next
 
     def __getitem__(self, index):
-        obj = super(Cursor, self).__getitem__(index)
-        if (self.__wrap is not None) and isinstance(obj, dict):
-            return self.__wrap(from_db = obj)
-        return obj
+        """return a single object for an integer index or apply skip and limit for a slice"""
+        if isinstance(index, slice):
+            self.cursor[index]
+            return self
+        return self._wrap([self.cursor[index]])[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cursor.close()
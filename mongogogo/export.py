@@ -0,0 +1,199 @@
+"""
+
+streaming export of collections to files
+
+"""
+
+import os
+import bz2
+import gzip
+import time
+from bson import BSON, json_util
+from cursor import Cursor
+
+__all__ = ["Exporter", "ExportStats"]
+
+
+class ExportStats(object):
+    """statistics about an export"""
+
+    def __init__(self):
+        """initialize the statistics"""
+        self.count = 0 # number of exported documents
+        self.bytes = 0 # number of bytes written before compression
+        self.seconds = 0.0 # the time the export took so far
+        self.last_id = None # the id of the last exported document
+
+    @property
+    def docs_per_second(self):
+        """the number of documents exported per second"""
+        if not self.seconds:
+            return 0.0
+        return self.count / self.seconds
+
+    @property
+    def bytes_per_second(self):
+        """the number of bytes written per second"""
+        if not self.seconds:
+            return 0.0
+        return self.bytes / self.seconds
+
+    def __repr__(self):
+        return "<ExportStats: %s documents, %s bytes in %.2fs (%.0f docs/s)>" %(
+            self.count, self.bytes, self.seconds, self.docs_per_second)
+
+
+class Exporter(object):
+    """exports the documents of a collection to a file in NDJSON or BSON format. The documents are
+    streamed in ``_id`` order with a cursor so memory usage does not depend on the size of the collection.
+
+    If the target is a path, the ``_id`` of the last document is stored in a checkpoint file next to it
+    after each batch. An interrupted export can then be resumed with ``resume = True``. Documents written
+    after the last checkpoint might be exported twice in that case unless the file is uncompressed
+    as it's then truncated to the checkpoint. An uncompressed file whose checkpoint has no offset is
+    exported again from the start.
+    """
+
+    formats = ("ndjson", "bson")
+    compressions = (None, "gzip", "bz2")
+
+    def __init__(self, collection, format = "ndjson", batch_size = 1000, compression = None,
+                 reserialize = False, progress = None):
+        """initialize the exporter
+
+        :param collection: the mongogogo ``Collection`` to export
+        :param format: either ``ndjson`` for one JSON document (MongoDB extended JSON) per line or ``bson``
+        :param batch_size: the number of documents to fetch and write at once
+        :param compression: ``None``, ``gzip`` or ``bz2``
+        :param reserialize: if ``True`` then each document is deserialized with the schema of the
+            collection's data class and serialized again. This validates and normalizes the exported data.
+        :param progress: an optional callable which is called with the ``ExportStats`` after each batch
+        """
+        if format not in self.formats:
+            raise ValueError("unknown format %s" %format)
+        if compression not in self.compressions:
+            raise ValueError("unknown compression %s" %compression)
+        self.collection = collection
+        self.format = format
+        self.batch_size = batch_size
+        self.compression = compression
+        self.reserialize = reserialize
+        self.progress = progress
+
+    def encode(self, doc):
+        """encode a single document"""
+        if self.format == "bson":
+            return BSON.encode(doc)
+        return json_util.dumps(doc) + "\n"
+
+    def documents(self, spec = None, after_id = None):
+        """return an iterator over the documents to export in ``_id`` order
+
+        :param spec: an optional query to restrict the exported documents
+        :param after_id: only export documents with an ``_id`` greater than this
+        """
+        spec = dict(spec or {})
+        if after_id is not None:
+            spec = {'$and' : [spec, {'_id' : {'$gt' : after_id}}]}
+        cursor = Cursor(self.collection, spec, sort = [('_id', 1)], batch_size = self.batch_size)
+        if not self.reserialize:
+            return cursor
+        return self._reserialize(cursor)
+
+    def _reserialize(self, cursor):
+        """deserialize and serialize documents with the schema of the data class"""
+        data_class = self.collection.data_class
+        serializer = data_class.schema.compile()
+        for son in cursor:
+            obj = data_class(from_db = son, collection = self.collection)
+            doc = serializer.serialize(obj)
+            doc['_id'] = son['_id']
+            yield doc
+
+    def _open(self, path, append):
+        """open the file at ``path`` with the configured compression"""
+        mode = "ab" if append else "wb"
+        if self.compression == "gzip":
+            return gzip.GzipFile(path, mode)
+        if self.compression == "bz2":
+            if append:
+                raise ValueError("bz2 compressed exports cannot be resumed")
+            return bz2.BZ2File(path, mode)
+        return open(path, mode)
+
+    def _read_checkpoint(self, path):
+        """return the contents of the checkpoint file for ``path`` or ``None``"""
+        try:
+            with open(path + ".checkpoint", "rb") as f:
+                return json_util.loads(f.read())
+        except IOError:
+            return None
+
+    def _write_checkpoint(self, path, stats, offset):
+        """store the last exported id and the file offset for ``path``"""
+        tmp = path + ".checkpoint.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json_util.dumps({'last_id' : stats.last_id, 'count' : stats.count, 'offset' : offset}))
+        os.rename(tmp, path + ".checkpoint")
+
+    def export(self, target, spec = None, after_id = None, resume = False):
+        """export the documents to ``target``
+
+        :param target: a path or a file like object opened in binary mode
+        :param spec: an optional query to restrict the exported documents
+        :param after_id: only export documents with an ``_id`` greater than this
+        :param resume: if ``True`` and ``target`` is a path then continue the export after the last checkpoint
+        :return: the ``ExportStats`` of this run
+        """
+        stats = ExportStats()
+        path = None
+        f = target
+        if isinstance(target, basestring):
+            path = target
+            append = False
+            if resume:
+                checkpoint = self._read_checkpoint(path)
+                offset = checkpoint.get('offset') if checkpoint is not None else None
+                if self.compression is None and offset is None:
+                    # without an offset the end of the file is unknown, so the export starts over
+                    checkpoint = None
+                if checkpoint is not None:
+                    after_id = checkpoint['last_id']
+                    append = True
+                    if self.compression is None:
+                        with open(path, "r+b") as raw:
+                            raw.truncate(offset)
+            f = self._open(path, append)
+
+        start = time.time()
+        try:
+            batch = []
+            for doc in self.documents(spec, after_id):
+                batch.append(self.encode(doc))
+                stats.last_id = doc['_id']
+                if len(batch) >= self.batch_size:
+                    self._write(f, batch, stats, start, path)
+                    batch = []
+            if batch:
+                self._write(f, batch, stats, start, path)
+        finally:
+            if path is not None:
+                f.close()
+        stats.seconds = time.time() - start
+        return stats
+
+    def _write(self, f, batch, stats, start, path):
+        """write a batch of encoded documents and update the statistics and the checkpoint"""
+        data = "".join(batch)
+        f.write(data)
+        stats.count += len(batch)
+        stats.bytes += len(data)
+        stats.seconds = time.time() - start
+        if path is not None:
+            f.flush()
+            offset = None
+            if self.compression is None:
+                offset = f.tell()
+            self._write_checkpoint(path, stats, offset)
+        if self.progress is not None:
+            self.progress(stats)
@@ -0,0 +1,162 @@
+"""
+
+parallel import of documents into a collection
+
+"""
+
+import time
+import multiprocessing
+from collections import deque
+from schema import Invalid
+from record import InvalidData
+
+__all__ = ["ImportPipeline", "ImportSummary"]
+
+
+def _serialize_chunk(args):
+    """validate and serialize a chunk of documents. This runs inside the worker processes.
+
+    :param args: a tuple of the record class and a list of ``(index, document)`` tuples
+    :return: a list of ``(index, data, error)`` tuples where either ``data`` or ``error`` is ``None``.
+        Documents which raise any exception are rejected with an ``InvalidData`` error.
+    """
+    data_class, docs = args
+    serializer = data_class.schema.compile()
+    results = []
+    for index, doc in docs:
+        try:
+            obj = data_class(doc)
+            data = serializer.serialize(obj)
+            if obj._id is not None:
+                data['_id'] = obj._id
+            results.append((index, data, None))
+        except Invalid, e:
+            # the schema node cannot be transferred to the parent process
+            results.append((index, None, InvalidData({getattr(e.node, 'name', None) : e.msg})))
+        except Exception, e:
+            # any other error only rejects this document, not the whole chunk
+            results.append((index, None, InvalidData({None : "%s: %s" %(e.__class__.__name__, e)})))
+    return results
+
+
+class ImportSummary(object):
+    """the result of an import"""
+
+    def __init__(self):
+        """initialize the summary"""
+        self.total = 0 # number of documents read
+        self.written = 0 # number of documents written
+        self.failed = {} # the exceptions of the documents which were not written by their position in the input
+        self.seconds = 0.0 # the time the import took
+
+    @property
+    def docs_per_second(self):
+        """the number of documents processed per second"""
+        if not self.seconds:
+            return 0.0
+        return self.total / self.seconds
+
+    def __repr__(self):
+        return "<ImportSummary: %s of %s documents written, %s failed in %.2fs>" %(
+            self.written, self.total, len(self.failed), self.seconds)
+
+
+class ImportPipeline(object):
+    """imports documents into a collection. The documents are streamed in chunks to a pool of worker
+    processes which validate and serialize them with the schema of the collection's data class. The parent
+    process collects the results in input order and writes them in batches with ``bulk_write``.
+
+    Documents are inserted if they have no ``_id`` and replaced or inserted otherwise. The record hooks
+    run in the workers but the hooks of the collection are not called as no records exist in the parent
+    process. The data class has to be importable by the workers.
+    """
+
+    def __init__(self, collection, processes = None, chunk_size = 500, batch_size = 1000, ordered = False):
+        """initialize the pipeline
+
+        :param collection: the mongogogo ``Collection`` to import into
+        :param processes: the number of worker processes, defaults to the number of CPUs. With ``0``
+            everything runs in the current process.
+        :param chunk_size: the number of documents sent to a worker at once
+        :param batch_size: the number of documents written to the database at once
+        :param ordered: whether to write the documents of a batch in order
+        """
+        self.collection = collection
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.ordered = ordered
+
+    def _chunks(self, docs):
+        """split the input into chunks of ``(index, document)`` tuples"""
+        data_class = self.collection.data_class
+        chunk = []
+        for index, doc in enumerate(docs):
+            chunk.append((index, doc))
+            if len(chunk) >= self.chunk_size:
+                yield (data_class, chunk)
+                chunk = []
+        if chunk:
+            yield (data_class, chunk)
+
+    def run(self, docs):
+        """import the documents
+
+        :param docs: an iterable of documents as they would be passed to the data class
+        :return: an ``ImportSummary``
+        """
+        summary = ImportSummary()
+        start = time.time()
+        batch = []
+        for results in self._results(docs):
+            for index, data, error in results:
+                summary.total += 1
+                if error is not None:
+                    summary.failed[index] = error
+                    continue
+                batch.append((index, data))
+                if len(batch) >= self.batch_size:
+                    self._write(batch, summary)
+                    batch = []
+        if batch:
+            self._write(batch, summary)
+        summary.seconds = time.time() - start
+        return summary
+
+    def _results(self, docs):
+        """return the results of the workers in input order. Only a few chunks are in flight at once so
+        the input is not read any further ahead than necessary."""
+        if self.processes == 0:
+            for chunk in self._chunks(docs):
+                yield _serialize_chunk(chunk)
+            return
+
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            pending = deque()
+            max_pending = 2 * (self.processes or multiprocessing.cpu_count())
+            for chunk in self._chunks(docs):
+                pending.append(pool.apply_async(_serialize_chunk, (chunk,)))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _write(self, batch, summary):
+        """write a batch of ``(index, data)`` tuples"""
+        collection = self.collection
+        docs = []
+        for index, data in batch:
+            if data.get('_id') is None and collection.create_ids:
+                data['_id'] = collection.new_id()
+            docs.append(data)
+        errors = collection._write_batch(docs, self.ordered)
+        for position, (index, data) in enumerate(batch):
+            if position in errors:
+                summary.failed[index] = errors[position]
+            else:
+                summary.written += 1
+                collection._forget(data['_id'])
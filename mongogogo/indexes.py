@@ -0,0 +1,137 @@
+"""
+
+index declarations and checking of queries against them
+
+"""
+
+import threading
+from pymongo import IndexModel, ASCENDING, DESCENDING
+
+__all__ = ["Index", "UnindexedQueryWarning"]
+
+
+class UnindexedQueryWarning(UserWarning):
+    """issued by the query checker of a collection if a query does not use an index"""
+
+
+class Index(object):
+    """declaration of an index for the ``indexes`` attribute of a ``Collection`` subclass::
+
+        indexes = [
+            Index("email", unique = True),
+            Index("lastname", "-creation"),
+            Index("session.created", expire_after = 3600),
+            Index("nickname", sparse = True),
+        ]
+    """
+
+    def __init__(self, *keys, **options):
+        """initialize the index
+
+        :param keys: the fields of the index. A ``-`` prefix means descending order, you can also pass
+            ``(field, direction)`` tuples, e.g. for text or geo indexes.
+        :param unique: whether the values have to be unique
+        :param sparse: whether to only index documents containing the fields
+        :param expire_after: the number of seconds after which documents expire (TTL index)
+        :param options: further options for ``IndexModel``, e.g. ``name`` or ``partialFilterExpression``
+        """
+        if not keys:
+            raise ValueError("an index needs at least one field")
+        self.keys = []
+        for key in keys:
+            if isinstance(key, basestring):
+                if key.startswith("-"):
+                    key = (key[1:], DESCENDING)
+                else:
+                    key = (key, ASCENDING)
+            self.keys.append(tuple(key))
+        expire_after = options.pop('expire_after', None)
+        if expire_after is not None:
+            options['expireAfterSeconds'] = expire_after
+        self.options = options
+
+    @property
+    def fields(self):
+        """the names of the indexed fields"""
+        return [key for key, direction in self.keys]
+
+    def model(self):
+        """return the ``IndexModel`` for ``create_indexes``"""
+        return IndexModel(self.keys, **self.options)
+
+    def covers(self, fields, sort = None):
+        """return whether this index can be used for a query on ``fields`` sorted by ``sort``. The queried
+        fields have to start with the first key of the index unless the query only sorts. The sort has
+        to continue with the following keys of the index in the same or in the reverse direction.
+
+        :param fields: the set of queried field names
+        :param sort: the optional sort specification as list of ``(field, direction)`` tuples
+        """
+        prefix = 0
+        while prefix < len(self.keys) and self.keys[prefix][0] in fields:
+            prefix += 1
+        if fields and not prefix:
+            return False
+        # sorting by a queried key of the prefix needs no further key
+        prefix_fields = self.fields[:prefix]
+        sort = [(key, direction) for key, direction in (sort or []) if key not in prefix_fields]
+        keys = self.keys[prefix:prefix + len(sort)]
+        if [key for key, direction in sort] != [key for key, direction in keys]:
+            return False
+        pairs = zip([direction for key, direction in sort], [direction for key, direction in keys])
+        return (not [1 for direction, indexed in pairs if direction != indexed] or
+            not [1 for direction, indexed in pairs if not isinstance(indexed, int) or direction != -indexed])
+
+    def __repr__(self):
+        return "<Index %s>" %", ".join(["%s:%s" %key for key in self.keys])
+
+
+def query_fields(spec):
+    """return the set of field names used in the query ``spec``"""
+    fields = set()
+    for key, value in (spec or {}).items():
+        if key in ("$and", "$or", "$nor"):
+            for part in value:
+                fields.update(query_fields(part))
+        elif not key.startswith("$"):
+            fields.add(key)
+    return fields
+
+
+def collection_scans(plan):
+    """return whether the ``explain()`` output ``plan`` contains a collection scan"""
+    if plan.get('cursor') == "BasicCursor": # servers before 3.0
+        return True
+    stage = plan.get('queryPlanner', {}).get('winningPlan', plan)
+    stages = [stage]
+    while stages:
+        stage = stages.pop()
+        if stage.get('stage') == "COLLSCAN":
+            return True
+        if 'inputStage' in stage:
+            stages.append(stage['inputStage'])
+        stages.extend(stage.get('inputStages', []))
+    return False
+
+
+class QueryShapes(object):
+    """remembers which query shapes have been checked already so each one is explained only once"""
+
+    def __init__(self):
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def first(self, shape):
+        """return ``True`` if ``shape`` has not been seen before and remember it"""
+        with self._lock:
+            if shape in self._seen:
+                return False
+            self._seen.add(shape)
+            return True
+
+    def clear(self):
+        """forget all shapes"""
+        with self._lock:
+            self._seen.clear()
+
+checked_shapes = QueryShapes()
@@ -0,0 +1,220 @@
+"""
+
+timing of collection operations
+
+"""
+
+import time
+import threading
+from bson import BSON
+
+__all__ = ["Metrics", "Operation", "OperationStats"]
+
+
+class Operation(object):
+    """the timings of a single operation of a collection, e.g. a ``get()`` or fetching the next batch of
+    a cursor. The time is split into the time spent in the driver and on the server, serializing and
+    deserializing with the schema and running hooks like ``before_put`` or ``after_load``. Hooks which
+    run while an object is serialized or deserialized only count as hook time.
+
+    An operation is used as context manager. While it is active it is the current operation of the thread
+    so hooks can be attributed to it.
+    """
+
+    def __init__(self, metrics, name, collection):
+        """initialize the operation
+
+        :param metrics: the ``Metrics`` object to report to when the operation is finished
+        :param name: the name of the operation, e.g. ``get``
+        :param collection: the name of the collection
+        """
+        self.metrics = metrics
+        self.name = name
+        self.collection = collection
+        self.server = 0.0
+        self.serialize = 0.0
+        self.deserialize = 0.0
+        self.hooks = 0.0
+        self.documents = 0
+        self.bytes = 0
+        self.duration = None
+        self.error = None # the exception the operation failed with
+        self._start = None
+        self._previous = None
+
+    def timed(self, kind, func, *args, **kwargs):
+        """call ``func`` and add the time it takes to ``kind`` which is one of ``server``, ``serialize``,
+        ``deserialize`` or ``hooks``. The time of hooks running in between is not added again."""
+        clock = self.metrics.clock
+        hooks = self.hooks
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = clock() - start - (self.hooks - hooks)
+            setattr(self, kind, getattr(self, kind) + elapsed)
+
+    def add_documents(self, docs):
+        """count documents which have been read or written and their size if the metrics measure bytes"""
+        self.documents += len(docs)
+        if self.metrics.measure_bytes:
+            self.bytes += sum([len(BSON.encode(doc)) for doc in docs])
+
+    def add_raw(self, count, size):
+        """count ``count`` documents which have been read as ``size`` bytes of raw BSON"""
+        self.documents += count
+        self.bytes += size
+
+    def __enter__(self):
+        local = self.metrics._local
+        self._previous = getattr(local, 'current', None)
+        local.current = self
+        self._start = self.metrics.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.duration = self.metrics.clock() - self._start
+        self.error = exc_val
+        self.metrics._local.current = self._previous
+        self.metrics.finished(self)
+
+
+class DisabledOperation(object):
+    """stands in for an ``Operation`` if a collection has no metrics"""
+
+    def timed(self, kind, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def add_documents(self, docs):
+        pass
+
+    def add_raw(self, count, size):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+disabled = DisabledOperation()
+
+
+class OperationStats(object):
+    """the sums of the timings and counts of all operations of one kind on one collection"""
+
+    def __init__(self):
+        """initialize the stats"""
+        self.count = 0
+        self.errors = 0
+        self.documents = 0
+        self.bytes = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.server = 0.0
+        self.serialize = 0.0
+        self.deserialize = 0.0
+        self.hooks = 0.0
+
+    def add(self, op):
+        """add the timings of a finished ``Operation``"""
+        self.count += 1
+        if op.error is not None:
+            self.errors += 1
+        self.documents += op.documents
+        self.bytes += op.bytes
+        self.total += op.duration
+        self.max = max(self.max, op.duration)
+        self.server += op.server
+        self.serialize += op.serialize
+        self.deserialize += op.deserialize
+        self.hooks += op.hooks
+
+    @property
+    def mean(self):
+        """the mean duration of an operation in seconds"""
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def as_dict(self):
+        """return the stats as dictionary"""
+        return dict(count = self.count, errors = self.errors, documents = self.documents, bytes = self.bytes,
+            total = self.total, max = self.max, mean = self.mean, server = self.server,
+            serialize = self.serialize, deserialize = self.deserialize, hooks = self.hooks)
+
+
+class Metrics(object):
+    """records the timings of the operations of collections and their cursors. Attach it to one or more
+    collections with their ``metrics`` attribute or the ``metrics`` argument of the constructor::
+
+        metrics = Metrics()
+        persons = Persons(db.persons, metrics = metrics)
+        ...
+        metrics.snapshot() # {'db.persons' : {'get' : {'count' : 12, 'server' : 0.01, ...}}}
+
+    The recorded operations are ``get``, ``get_many``, ``put``, ``put_many``, ``find``, ``remove`` and
+    ``iterate`` which is fetching and wrapping one batch of a cursor. Collections without metrics
+    skip all of this. The operations of an ``AsyncCollection`` are not timed.
+
+    Listeners are called with each finished ``Operation``, e.g. to send it to a monitoring system.
+    """
+
+    def __init__(self, listeners = (), measure_bytes = True, clock = time.time):
+        """initialize the metrics
+
+        :param listeners: callables which are called with each finished ``Operation``
+        :param measure_bytes: whether to count the BSON size of documents. Documents which are not
+            fetched as raw BSON are encoded again for this, so switch it off if this is too expensive.
+        :param clock: the function to use for retrieving the current time
+        """
+        self.listeners = list(listeners)
+        self.measure_bytes = measure_bytes
+        self.clock = clock
+        self.stats = {} # OperationStats by (collection, operation name)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_listener(self, listener):
+        """add a callable which is called with each finished ``Operation``"""
+        self.listeners.append(listener)
+
+    def operation(self, name, collection):
+        """return a new ``Operation`` named ``name`` for the mongogogo ``collection``"""
+        return Operation(self, name, collection.collection.full_name)
+
+    def current(self):
+        """return the active ``Operation`` of this thread or ``None``"""
+        return getattr(self._local, 'current', None)
+
+    def hook(self, hook, *args):
+        """call a hook and add the time it takes to the active operation"""
+        op = self.current()
+        if op is None:
+            return hook(*args)
+        return op.timed("hooks", hook, *args)
+
+    def finished(self, op):
+        """add a finished ``Operation`` to the stats and pass it on to the listeners"""
+        key = (op.collection, op.name)
+        with self._lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = OperationStats()
+            stats.add(op)
+        for listener in self.listeners:
+            listener(op)
+
+    def snapshot(self):
+        """return the stats as dictionary of collection names to dictionaries of operation names to the
+        dictionaries of their stats"""
+        result = {}
+        with self._lock:
+            for (collection, name), stats in self.stats.items():
+                result.setdefault(collection, {})[name] = stats.as_dict()
+        return result
+
+    def reset(self):
+        """remove all stats"""
+        with self._lock:
+            self.stats.clear()
@@ -0,0 +1,95 @@
+"""
+
+keyset pagination
+
+Instead of skipping documents a page continues after (or before) the sort key values of the last
+(or first) record of the previous page. The values are stored in an opaque token.
+
+"""
+
+import base64
+from bson import json_util
+
+__all__ = ["Page"]
+
+
+class Page(object):
+    """a page of records returned by ``Collection.paginate()``"""
+
+    def __init__(self, records, next = None, previous = None):
+        """initialize the page
+
+        :param records: the records on this page
+        :param next: the token for the following page or ``None`` if this is the last page
+        :param previous: the token for the preceding page or ``None`` if this is the first page
+        """
+        self.records = records
+        self.next = next
+        self.previous = previous
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __repr__(self):
+        return "<Page of %s records>" %len(self.records)
+
+
+def sort_keys(sort):
+    """return the sort specification as list of ``(key, direction)`` tuples ending with ``_id``"""
+    keys = [(key, direction) for key, direction in (sort or [])]
+    if "_id" not in [key for key, direction in keys]:
+        keys.append(("_id", 1))
+    return keys
+
+def key_values(raw, keys):
+    """return the values of the sort keys of a raw document. Dotted keys are resolved into sub documents
+    and missing values are returned as ``None``."""
+    values = []
+    for key, direction in keys:
+        value = raw
+        for part in key.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        values.append(value)
+    return values
+
+def encode_token(keys, values):
+    """return the token for continuing at a record with the key ``values``"""
+    return base64.urlsafe_b64encode(json_util.dumps([[list(key) for key in keys], values]))
+
+def decode_token(keys, token):
+    """return the key values stored in ``token``"""
+    try:
+        stored, values = json_util.loads(base64.urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError):
+        raise ValueError("invalid pagination token")
+    if [tuple(key) for key in stored] != keys or len(values) != len(keys):
+        raise ValueError("the pagination token does not match the sort order")
+    return values
+
+def keyset_spec(keys, values, forward = True):
+    """return the query for all documents after (or before if not ``forward``) the key ``values``. Nulls
+    and missing values sort before everything else but are never matched by ``$gt`` or ``$lt``, so they
+    are compared explicitly."""
+    alternatives = []
+    for i, (key, direction) in enumerate(keys):
+        after = (direction == 1) == forward
+        prefix = dict([(k, v) for (k, d), v in zip(keys[:i], values[:i])])
+        if values[i] is None:
+            # everything but null comes after null and nothing before it
+            conditions = [{"$ne" : None}] if after else []
+        elif after:
+            conditions = [{"$gt" : values[i]}]
+        else:
+            conditions = [{"$lt" : values[i]}, None]
+        for condition in conditions:
+            alternative = dict(prefix)
+            alternative[key] = condition
+            alternatives.append(alternative)
+    if not alternatives:
+        return {"_id" : {"$in" : []}}
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return {"$or" : alternatives}
@@ -0,0 +1,190 @@
+"""
+
+projections of a schema to a subset of it's fields and profiling of the fields which
+are actually read from records.
+
+"""
+
+import sys
+from schema import null, Schema, List, Dict
+
+__all__ = ["Projection", "FieldProfile", "get_projection", "get_profile", "call_site"]
+
+
+def _field_nodes(node):
+    """return the sub nodes of ``node`` as a dictionary if it's a schema or a list of schemas"""
+    if isinstance(node, List):
+        node = node.subtype
+    if isinstance(node, Schema):
+        return dict(node._nodes)
+    return None
+
+def _has_sub_fields(node):
+    """check whether ``node`` contains sub documents which can be projected"""
+    if isinstance(node, List):
+        node = node.subtype
+    return isinstance(node, (Schema, Dict))
+
+def _add_path(tree, node, path, full_path):
+    """add the dotted ``path`` to the ``tree`` of fields of ``node``. The tree maps each field name either
+    to ``True`` if the whole field is requested or to another tree for parts of it."""
+    name, _, rest = path.partition(".")
+    nodes = _field_nodes(node)
+    if nodes is None:
+        # a dict or some custom node, we cannot check the path any further
+        field = None
+    elif name not in nodes:
+        raise ValueError("unknown field %s" %full_path)
+    else:
+        field = nodes[name]
+    if tree.get(name) is True:
+        return
+    if not rest:
+        tree[name] = True
+        return
+    if field is not None and not _has_sub_fields(field):
+        raise ValueError("field %s has no sub fields" %full_path)
+    _add_path(tree.setdefault(name, {}), field, rest, full_path)
+
+def _spec(tree, prefix = ""):
+    """flatten a tree of fields to a MongoDB projection"""
+    spec = {}
+    for name, sub in tree.items():
+        if sub is True:
+            spec[prefix+name] = 1
+        else:
+            spec.update(_spec(sub, prefix+name+"."))
+    return spec
+
+def _compile_partial(node, tree):
+    """return a deserializer ``f(value, data, kw)`` for the parts of ``node`` given in ``tree``.
+    Only sub documents of ``Schema`` and ``List(Schema)`` nodes are deserialized partially,
+    all other nodes are deserialized as a whole with the data which has been fetched."""
+    if tree is True:
+        return node._compile_deserializer()
+    if isinstance(node, List) and isinstance(node.subtype, Schema):
+        deserialize = _compile_partial(node.subtype, tree)
+        def deserialize_list(value, data, kw):
+            if value is null:
+                return value
+            return [deserialize(item, data, kw) for item in value]
+        return deserialize_list
+    if not isinstance(node, Schema):
+        return node._compile_deserializer()
+
+    nodes = dict(node._nodes)
+    fields = tuple([(name, _compile_partial(nodes[name], sub)) for name, sub in tree.items()])
+    def deserialize_schema(value, data, kw):
+        if value is null:
+            return value
+        output = {}
+        get = value.get
+        for name, deserialize in fields:
+            output[name] = deserialize(get(name, null), data, kw)
+        if node._mg_class is not None:
+            return node._mg_class(output)
+        return output
+    return deserialize_schema
+
+
+class Projection(object):
+    """a projection of a schema to a subset of it's fields. Records which are loaded with a projection only
+    contain the top level fields of the projection and only those are deserialized. Default values
+    and required checks are therefore only applied to fields which have been fetched.
+
+    A projection without fields is used for records which are loaded completely but whose field
+    access is recorded in a ``FieldProfile``.
+    """
+
+    def __init__(self, schema, fields = None, profile = None):
+        """initialize the projection
+
+        :param schema: the schema of the records
+        :param fields: a list of field names which can also be dotted paths into sub schemas and lists of
+            sub schemas. ``None`` means all fields.
+        :param profile: an optional ``FieldProfile`` which records the fields which are read.
+        """
+        self.schema = schema
+        self.profile = profile
+        self.tree = None
+        self.spec = None
+        self.fields = None
+        self.deserializers = None
+        if fields is None:
+            return
+        self.tree = {}
+        for path in fields:
+            if path == "_id":
+                continue
+            _add_path(self.tree, schema, path, path)
+        self.spec = _spec(self.tree)
+        self.spec['_id'] = 1
+        self.fields = frozenset(self.tree)
+        nodes = dict(schema._nodes)
+        self.deserializers = dict([(name, _compile_partial(nodes[name], sub)) for name, sub in self.tree.items()])
+
+    def with_profile(self, profile):
+        """return a copy of this projection which records the accessed fields in ``profile``"""
+        projection = Projection.__new__(Projection)
+        projection.__dict__.update(self.__dict__)
+        projection.profile = profile
+        return projection
+
+
+def get_projection(schema, fields):
+    """return a ``Projection`` of ``schema`` to ``fields``. Projections are cached on the schema."""
+    key = frozenset(fields)
+    cache = schema.__dict__.get("_mg_projections")
+    if cache is None:
+        cache = schema._mg_projections = {}
+    projection = cache.get(key)
+    if projection is None:
+        projection = cache[key] = Projection(schema, fields)
+    return projection
+
+
+class FieldProfile(object):
+    """the fields which are read from the records returned at one call site. The first ``runs`` calls
+    are profiled and return complete records. Later calls only fetch the fields which have been read so far.
+    Fields which are read from such a partial record later on are fetched on demand and added to the profile.
+    """
+
+    def __init__(self, runs = 1):
+        """initialize the profile
+
+        :param runs: the number of calls which are profiled before projecting
+        """
+        self.runs = runs
+        self.calls = 0
+        self.fields = set()
+
+    def add(self, name):
+        """record that the field ``name`` has been read"""
+        self.fields.add(name)
+
+    def update(self, names):
+        """record that the fields ``names`` have been read"""
+        self.fields.update(names)
+
+    def projection(self, schema):
+        """return the ``Projection`` to use for the next call"""
+        self.calls += 1
+        if self.calls <= self.runs:
+            return Projection(schema, profile = self)
+        names = set([name for name, node in schema._nodes])
+        return get_projection(schema, self.fields & names).with_profile(self)
+
+
+_profiles = {}
+
+def get_profile(key, runs = 1):
+    """return the ``FieldProfile`` for ``key`` and create it if it does not exist yet"""
+    profile = _profiles.get(key)
+    if profile is None:
+        profile = _profiles.setdefault(key, FieldProfile(runs))
+    return profile
+
+def call_site(depth = 1):
+    """return a key for the code location ``depth`` frames above the caller"""
+    frame = sys._getframe(depth + 1)
+    return (frame.f_code.co_filename, frame.f_lineno)
@@ -0,0 +1,341 @@
+"""
+
+schema aware query builder.
+
+Fields are derived from the schema of a record class, operands are converted with ``convert()`` of
+the respective schema node and the resulting query spec can be passed to ``Collection.find()``::
+
+    Person.q.age > 30
+    (Person.q.creation >= param("since")) & Person.q.bio.name.in_(["foo", "bar"])
+
+Expressions with the same structure share one compiled builder for their spec.
+
+"""
+
+from mongogogo.schema import Schema, List, Dict
+
+__all__ = ["Expression", "Field", "Fields", "Param", "param"]
+
+
+class Param(object):
+    """a placeholder for an operand which is given when the spec is built"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "<Param %s>" %self.name
+
+def param(name):
+    """return a placeholder for an operand which is passed to ``Expression.to_spec()`` by ``name``"""
+    return Param(name)
+
+
+###
+### conversion of operands
+###
+
+def _converter(node):
+    """return a function converting an operand for ``node`` to it's MongoDB representation"""
+    if node is None or isinstance(node, Dict):
+        return lambda value: value
+    if isinstance(node, List):
+        # conditions on lists match their elements
+        return _converter(node.subtype)
+    if isinstance(node, Schema):
+        serializer = node.compile()
+        return lambda value: value if value is None else serializer.serialize(value)
+    # only the type is converted as operands may lie outside of what the node accepts for storing
+    convert = node.convert
+    return lambda value: value if value is None else convert(value)
+
+def _list_converter(convert):
+    """return a function converting each element of a list operand"""
+    return lambda values: [convert(value) for value in values]
+
+def _keep(value):
+    """don't convert the operand"""
+    return value
+
+
+###
+### expressions
+###
+
+_builders = {} # compiled spec builders by the shape of the expression
+
+class Expression(object):
+    """base class for query expressions. They can be combined with ``&``, ``|`` and ``~``."""
+
+    def __and__(self, other):
+        return And([self, other])
+
+    def __or__(self, other):
+        return Or([self, other])
+
+    def __invert__(self):
+        return Nor([self])
+
+    def shape(self):
+        """return a hashable key describing the structure of this expression without the operands"""
+        raise NotImplementedError
+
+    def operands(self):
+        """return the list of operands in the order in which the builder consumes them"""
+        raise NotImplementedError
+
+    def compile(self):
+        """return a function building the spec from an iterator over the converted operands"""
+        raise NotImplementedError
+
+    def to_spec(self, **params):
+        """return the MongoDB query spec for this expression
+
+        :param params: the values for the ``Param`` placeholders in this expression
+        """
+        builder = self.__dict__.get("_builder")
+        if builder is None:
+            shape = self.shape()
+            builder = _builders.get(shape)
+            if builder is None:
+                builder = _builders[shape] = self.compile()
+            self._builder = builder
+        values = []
+        for convert, value in self.operands():
+            if isinstance(value, Param):
+                if value.name not in params:
+                    raise KeyError("missing query parameter %s" %value.name)
+                value = params[value.name]
+            values.append(convert(value))
+        return builder(iter(values))
+
+    bind = to_spec
+
+
+class Condition(Expression):
+    """a condition on a single field"""
+
+    def __init__(self, field, op, value, convert):
+        """initialize the condition
+
+        :param field: the ``Field`` the condition is about
+        :param op: the MongoDB operator or ``$eq`` for a plain match
+        :param value: the operand
+        :param convert: the function converting the operand
+        """
+        self.field = field
+        self.op = op
+        self.value = value
+        self.convert = convert
+
+    def shape(self):
+        return ("cond", self.field.path, self.op)
+
+    def operands(self):
+        return [(self.convert, self.value)]
+
+    def compile(self):
+        path = self.field.path
+        op = self.op
+        if op == "$eq":
+            return lambda values: {path : values.next()}
+        return lambda values: {path : {op : values.next()}}
+
+
+class _Combination(Expression):
+    """base class for expressions combining other expressions"""
+
+    op = None
+
+    def __init__(self, parts):
+        # flatten nested combinations of the same kind
+        self.parts = []
+        for part in parts:
+            if type(part) == type(self):
+                self.parts.extend(part.parts)
+            else:
+                self.parts.append(part)
+
+    def shape(self):
+        return (self.op,) + tuple([part.shape() for part in self.parts])
+
+    def operands(self):
+        result = []
+        for part in self.parts:
+            result.extend(part.operands())
+        return result
+
+    def compile(self):
+        builders = [part.compile() for part in self.parts]
+        op = self.op
+        return lambda values: {op : [build(values) for build in builders]}
+
+
+class And(_Combination):
+    """all parts have to match"""
+
+    op = "$and"
+
+    def compile(self):
+        # conditions on different fields or with different operators are merged into one document
+        conditions = [part for part in self.parts if isinstance(part, Condition)]
+        seen = set()
+        mergeable = len(conditions) == len(self.parts)
+        for c in conditions:
+            key = (c.field.path, c.op)
+            if key in seen or (c.field.path, "$eq") in seen or (c.op == "$eq" and c.field.path in [k[0] for k in seen]):
+                mergeable = False
+            seen.add(key)
+        if not mergeable:
+            return super(And, self).compile()
+        conditions = [(c.field.path, c.op) for c in conditions]
+        def build(values):
+            spec = {}
+            for path, op in conditions:
+                if op == "$eq":
+                    spec[path] = values.next()
+                else:
+                    spec.setdefault(path, {})[op] = values.next()
+            return spec
+        return build
+
+
+class Or(_Combination):
+    """one of the parts has to match"""
+
+    op = "$or"
+
+
+class Nor(_Combination):
+    """none of the parts may match"""
+
+    op = "$nor"
+
+
+###
+### fields
+###
+
+class Field(object):
+    """a field of a schema for building conditions. Sub fields of sub schemas and lists of sub schemas
+    can be accessed as attributes or with ``[]`` in case their name clashes with a method."""
+
+    def __init__(self, path, node):
+        self.path = path
+        self.node = node
+
+    def __getitem__(self, name):
+        node = self.node
+        if isinstance(node, List):
+            node = node.subtype
+        if isinstance(node, Schema):
+            nodes = dict(node._nodes)
+            if name not in nodes:
+                raise KeyError("unknown field %s.%s" %(self.path, name))
+            return Field(self.path+"."+name, nodes[name])
+        if node is None or isinstance(node, Dict):
+            return Field(self.path+"."+name, None)
+        raise KeyError("field %s has no sub fields" %self.path)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError, e:
+            raise AttributeError(str(e))
+
+    def _condition(self, op, value, convert = None):
+        if convert is None:
+            convert = _converter(self.node)
+        return Condition(self, op, value, convert)
+
+    def __eq__(self, value):
+        return self._condition("$eq", value)
+
+    def __ne__(self, value):
+        return self._condition("$ne", value)
+
+    def __lt__(self, value):
+        return self._condition("$lt", value)
+
+    def __le__(self, value):
+        return self._condition("$lte", value)
+
+    def __gt__(self, value):
+        return self._condition("$gt", value)
+
+    def __ge__(self, value):
+        return self._condition("$gte", value)
+
+    __hash__ = object.__hash__
+
+    def in_(self, values):
+        """the field has to match one of ``values``"""
+        return self._condition("$in", values, _list_converter(_converter(self.node)))
+
+    def nin(self, values):
+        """the field may match none of ``values``"""
+        return self._condition("$nin", values, _list_converter(_converter(self.node)))
+
+    def all(self, values):
+        """the list field has to contain all of ``values``"""
+        return self._condition("$all", values, _list_converter(_converter(self.node)))
+
+    def exists(self, flag = True):
+        """the field has to exist (or not)"""
+        return self._condition("$exists", flag, bool)
+
+    def size(self, n):
+        """the list field has to have ``n`` elements"""
+        return self._condition("$size", n, int)
+
+    def regex(self, pattern):
+        """the string field has to match the regular expression ``pattern``"""
+        return self._condition("$regex", pattern, _keep)
+
+    def __repr__(self):
+        return "<Field %s>" %self.path
+
+
+class Fields(object):
+    """the fields of a schema. Use attribute access or ``[]`` to get a ``Field``."""
+
+    def __init__(self, schema):
+        self._schema = schema
+        self._nodes = dict(schema._nodes)
+
+    def __getitem__(self, name):
+        if name == "_id":
+            return Field(name, None)
+        if name not in self._nodes:
+            raise KeyError("unknown field %s" %name)
+        return Field(name, self._nodes[name])
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError, e:
+            raise AttributeError(str(e))
+
+
+class FieldsDescriptor(object):
+    """descriptor returning the ``Fields`` of the schema of a record class. On instances it returns the
+    value stored under the descriptor's name so it does not hide a field with the same name."""
+
+    def __init__(self, name = "q"):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is not None:
+            try:
+                return instance[self.name]
+            except KeyError:
+                raise AttributeError(self.name)
+        schema = owner.schema
+        fields = schema.__dict__.get("_mg_query_fields")
+        if fields is None:
+            fields = schema._mg_query_fields = Fields(schema)
+        return fields
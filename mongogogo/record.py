@@ -1,7 +1,24 @@
 import uuid
 import types
 import copy
+import threading
+import contextlib
+import warnings
 from cursor import Cursor
+from cache import RecordCache
+from bson import ObjectId
+from pymongo import InsertOne, ReplaceOne, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+from schema import null, Invalid, Schema, List, Dict
+from projection import get_projection, get_profile, call_site
+from updates import diff, snapshot, convert_update, guarded
+from query import Expression, FieldsDescriptor
+from references import populate
+from writebuffer import WriteBuffer
+from metrics import Metrics, disabled
+from aggregation import Pipeline, SchemaResults, preserves_shape
+from pagination import Page, sort_keys, key_values, encode_token, decode_token, keyset_spec
+from indexes import Index, UnindexedQueryWarning, query_fields, collection_scans, checked_shapes
 
 class AttributeMapper(dict):
     """a dictionary like object which also is accessible via getattr/setattr"""
@@ -62,6 +79,37 @@ class InvalidData(DatabaseError):
         fs = ["%s: %s" %(a,v) for a,v in self.errors.items()]
         return """<Invalid Data: %s>""" %", ".join(fs)
 
+class PartialRecord(DatabaseError):
+    """exception raised if a record which was loaded with a projection should be stored as a whole"""
+
+    def __init__(self, _id):
+        """initialize the exception"""
+        self._id = _id
+
+class WriteFailed(DatabaseError):
+    """exception describing a failed write of a single document in a bulk write"""
+
+    def __init__(self, details):
+        """initialize the exception.
+
+        :param details: the error document returned by the server
+        """
+        self.details = details
+
+    def __str__(self):
+        """return a printable representation of the error"""
+        return "<Write failed: %s>" %self.details.get('errmsg', '')
+
+class UnindexedQuery(DatabaseError):
+    """exception raised by the query checker of a collection if a query does not use an index"""
+
+    def __init__(self, msg):
+        """initialize the exception"""
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
 class ObjectNotFound(DatabaseError):
     """exception raised if an object was not found"""
 
@@ -69,15 +117,40 @@ class ObjectNotFound(DatabaseError):
         """initialize the exception"""
         self._id = _id
 
+class NotSupported(DatabaseError):
+    """exception raised if a collection does not support an operation, e.g. ``buffered()`` of an ``AsyncCollection``"""
+
+
+class PutManyResult(object):
+    """the result of ``Collection.put_many()``"""
+
+    def __init__(self):
+        """initialize the result"""
+        self.records = [] # the stored objects
+        self.errors = {} # the exceptions of the objects which were not stored by their position
+
+    @property
+    def ok(self):
+        """``True`` if all objects have been stored"""
+        return not self.errors
+
 
 class Record(dict):
     
     schema = None
-    _protected = ['schema', 'collection', '_protected', '_schemaless', 'default_values']
+    _protected = ['schema', 'collection', '_protected', '_schemaless', 'default_values',
+                  '_mg_pending', '_mg_raw', '_mg_deserializers', '_mg_fields', '_mg_profile', '_mg_dirty']
     schemaless = False # set to true to allow arbitrary data. If set to False, then additional data will be filtered out
     default_values = {} # default values for a newly created record. Will only be used if from_db is None 
+    _mg_pending = None # names of fields in lazy mode which have not been deserialized yet
+    _mg_raw = None # the raw document this record was loaded from, replaced by a snapshot of what is stored on put
+    _mg_deserializers = None # the field deserializers to use in lazy mode
+    _mg_fields = None # the names of the loaded fields if the record was loaded with a projection
+    _mg_profile = None # the FieldProfile recording which fields are read
+    _mg_dirty = None # the keys which have been set or removed since the record was loaded
+    q = FieldsDescriptor() # the fields of the schema for building queries, e.g. ``Person.q.age > 30``
 
-    def __init__(self, doc={}, from_db = None, collection = None, *args, **kwargs):
+    def __init__(self, doc={}, from_db = None, collection = None, lazy = False, projection = None, *args, **kwargs):
         """initialize a record with data
 
         :param doc: The initial document coming from python. This will be merged with keyword
@@ -87,6 +160,12 @@ class Record(dict):
             we assume that it's a new object. Note that default values from the schema will not be set.
             This will only happen on the serialization step on save.
         :param collection: the collection instance this data object belongs to
+        :param lazy: if ``True`` then the fields of ``from_db`` are only deserialized once they are accessed.
+            Note that in this case errors during deserialization are also only raised on access. Comparing,
+            printing or iterating over the record deserializes all fields. ``dict(record)`` reads the
+            dictionary directly though and returns the raw values of the pending fields, use ``copy()``.
+        :param projection: a ``Projection`` in case ``from_db`` only contains some of the fields. Only
+            those fields are deserialized and such a record cannot be stored as a whole.
         """
 
         self._id = None
@@ -97,8 +176,27 @@ class Record(dict):
 
         # only deserialize it if it's coming from the database
         if from_db is not None:
-            self.update(self.schema.deserialize(from_db))
+            if projection is not None:
+                self._mg_profile = projection.profile
+            if projection is not None and projection.fields is not None:
+                self._mg_fields = projection.fields
+                if lazy:
+                    self._mg_defer(from_db, projection.deserializers)
+                else:
+                    self.update(dict([(name, deserialize(from_db.get(name, null), from_db, {}))
+                        for name, deserialize in projection.deserializers.items()]))
+            elif lazy:
+                self._mg_defer(from_db, self.schema.compile().field_deserializers)
+                self._mg_loaded()
+            else:
+                compiled = self.schema.compile()
+                if compiled.fill is not None and not self.schemaless and not args and not kwargs:
+                    # deserialize straight into this record instead of merging a copy
+                    self._mg_fill(compiled.fill, from_db)
+                else:
+                    self.update(compiled.deserialize(from_db))
             self._id = from_db.get("_id", None)
+            self._mg_raw = from_db
         else:
             self._initialize_defaults()
             self.update(doc)
@@ -106,18 +204,85 @@ class Record(dict):
 
         self._collection = collection
 
+        if from_db is not None:
+            # from now on we track changes to be able to only update those
+            self._mg_dirty = set()
+
         if from_db is None:
             # lets initialize it
             self.after_initialize()
             self.after_create()
+        elif collection is not None and collection.metrics is not None:
+            collection.metrics.hook(self.after_load)
         else:
             self.after_load()
 
         # set the schema class to this class
         self.schema._mg_class = self.__class__
 
-    def _initialize_defaults(self):
-        """initialize the record with the default values"""
+    @classmethod
+    def from_db_batch(cls, docs, collection = None, **kw):
+        """create records for a list of documents coming from the database. The compiled deserializer
+        is looked up only once for the whole batch.
+
+        :param docs: the raw documents
+        :param collection: the collection instance the records belong to
+        :param kw: further arguments for the constructor like ``lazy`` or ``projection``
+        """
+        compiled = cls.schema.compile()
+        lazy = kw.get('lazy', False)
+        if [k for k in kw if k != 'lazy'] or cls.schemaless or (compiled.fill is None and not lazy) \
+                or cls.__init__.__func__ is not Record.__init__.__func__:
+            return [cls(from_db = doc, collection = collection, **kw) for doc in docs]
+        fill = compiled.fill
+        deserializers = compiled.field_deserializers
+        metrics = collection.metrics if collection is not None else None
+        result = []
+        for doc in docs:
+            obj = cls.__new__(cls)
+            obj._id = None
+            if lazy:
+                obj._mg_defer(doc, deserializers)
+                obj._mg_loaded()
+            else:
+                obj._mg_fill(fill, doc)
+                obj._mg_raw = doc
+            obj._id = doc.get("_id", None)
+            obj._collection = collection
+            obj._mg_dirty = set()
+            if metrics is None:
+                obj.after_load()
+            else:
+                metrics.hook(obj.after_load)
+            result.append(obj)
+        cls.schema._mg_class = cls
+        return result
+
+    def _mg_fill(self, fill, from_db):
+        """deserialize ``from_db`` straight into this record with the compiled ``fill`` function of the schema"""
+        fill(self, from_db, from_db, {})
+        self._mg_loaded()
+
+    def _mg_loaded(self):
+        """finish a record whose fields have been deserialized or deferred without the compiled deserializer.
+        The result is the same as merging the record it returns: missing keys of the ``default_values``
+        are set, default dictionaries are updated with the loaded ones and ``after_initialize()`` and
+        ``after_create()`` are called. Pending fields are left alone."""
+        if self.default_values:
+            pending = self._mg_pending or ()
+            for k, v in self._default_values().items():
+                if k in pending:
+                    continue
+                if k not in self:
+                    dict.__setitem__(self, k, v)
+                elif type(v) == types.DictType and type(dict.__getitem__(self, k)) == types.DictType:
+                    v.update(dict.__getitem__(self, k))
+                    dict.__setitem__(self, k, v)
+        self.after_initialize()
+        self.after_create()
+
+    def _default_values(self):
+        """return a copy of the default values with callables replaced by their results"""
         def ini(value):
             if callable(value):
                 value = value()
@@ -131,7 +296,189 @@ class Record(dict):
                     n.append(ini(v))
                 value = n
             return value
-        self.update(ini(self.default_values))
+        return ini(self.default_values)
+
+    def _initialize_defaults(self):
+        """initialize the record with the default values"""
+        self.update(self._default_values())
+
+    def _mg_defer(self, from_db, deserializers):
+        """store the raw fields of ``from_db`` and mark them for deserialization on first access
+
+        :param deserializers: a dictionary mapping the field names to their compiled deserializers
+        """
+        for name in deserializers:
+            dict.__setitem__(self, name, from_db.get(name, null))
+        self._mg_raw = from_db
+        self._mg_deserializers = deserializers
+        self._mg_pending = set(deserializers)
+
+    def _mg_load(self, k):
+        """deserialize the pending field ``k``, store and return it"""
+        old = dict.__getitem__(self, k)
+        value = self._mg_deserializers[k](old, self._mg_raw, {})
+        if self.schemaless:
+            # merge like ``update()`` does it for schemaless records
+            if type(old) == types.DictType and type(value) == types.DictType:
+                old.update(value)
+                value = old
+        self._mg_pending.discard(k)
+        dict.__setitem__(self, k, value)
+        return value
+
+    def _mg_load_all(self):
+        """deserialize all pending fields"""
+        if self._mg_profile is not None:
+            self._mg_profile.update([name for name, node in self.schema._nodes])
+        if self._mg_pending:
+            for k in list(self._mg_pending):
+                self._mg_load(k)
+
+    def _mg_touch(self, k):
+        """record that ``k`` is read and fetch it if it is a field which was not loaded"""
+        self._mg_profile.add(k)
+        fields = self._mg_fields
+        # _id and _collection are stored as keys, read them directly to not end up here again
+        collection = dict.get(self, '_collection')
+        if fields is None or k in fields or collection is None:
+            return
+        deserializers = self.schema.compile().field_deserializers
+        if k not in deserializers:
+            return
+        doc = collection.collection.find_one({'_id' : dict.get(self, '_id')}, {k : 1}) or {}
+        self._mg_fields = fields | frozenset([k])
+        dict.__setitem__(self, k, deserializers[k](doc.get(k, null), doc, {}))
+
+    def __getitem__(self, k):
+        """retrieve a value and deserialize it first if it's still pending"""
+        if self._mg_profile is not None:
+            self._mg_touch(k)
+        pending = self._mg_pending
+        if pending and k in pending:
+            return self._mg_load(k)
+        return dict.__getitem__(self, k)
+
+    def __setitem__(self, k, v):
+        """store a value which replaces a pending one"""
+        if self._mg_pending:
+            self._mg_pending.discard(k)
+        if self._mg_dirty is not None:
+            self._mg_dirty.add(k)
+        dict.__setitem__(self, k, v)
+
+    def __delitem__(self, k):
+        """remove a value"""
+        if self._mg_pending:
+            self._mg_pending.discard(k)
+        if self._mg_dirty is not None:
+            self._mg_dirty.add(k)
+        dict.__delitem__(self, k)
+
+    def mark_dirty(self, *keys):
+        """mark the given keys as changed so they are stored as a whole on the next save. Changes of
+        values inside of sub documents and lists are found on save anyway. Use this if a field should
+        replace the stored one as a whole instead."""
+        if self._mg_dirty is not None:
+            self._mg_dirty.update(keys)
+
+    def get(self, k, default = None):
+        """retrieve a value or ``default`` if it's missing"""
+        if self._mg_profile is not None:
+            self._mg_touch(k)
+        pending = self._mg_pending
+        if pending and k in pending:
+            return self._mg_load(k)
+        return dict.get(self, k, default)
+
+    def pop(self, k, *args):
+        """remove and return a value"""
+        self.get(k)
+        if self._mg_dirty is not None:
+            self._mg_dirty.add(k)
+        return dict.pop(self, k, *args)
+
+    def setdefault(self, k, default = None):
+        """return a value and set it to ``default`` if it's missing"""
+        self.get(k)
+        if self._mg_dirty is not None and k not in self:
+            self._mg_dirty.add(k)
+        return dict.setdefault(self, k, default)
+
+    def clear(self):
+        """remove all values"""
+        if self._mg_dirty is not None:
+            self._mg_dirty.update(dict.keys(self))
+        self._mg_pending = None
+        dict.clear(self)
+
+    def copy(self):
+        """return a shallow copy as plain dictionary"""
+        self._mg_load_all()
+        return dict.copy(self)
+
+    def items(self):
+        """deserialize all pending fields before returning the items"""
+        self._mg_load_all()
+        return dict.items(self)
+
+    def iteritems(self):
+        """deserialize all pending fields before returning the items"""
+        self._mg_load_all()
+        return dict.iteritems(self)
+
+    def values(self):
+        """deserialize all pending fields before returning the values"""
+        self._mg_load_all()
+        return dict.values(self)
+
+    def itervalues(self):
+        """deserialize all pending fields before returning the values"""
+        self._mg_load_all()
+        return dict.itervalues(self)
+
+    def viewitems(self):
+        """deserialize all pending fields before returning the items"""
+        self._mg_load_all()
+        return dict.viewitems(self)
+
+    def viewvalues(self):
+        """deserialize all pending fields before returning the values"""
+        self._mg_load_all()
+        return dict.viewvalues(self)
+
+    def keys(self):
+        """deserialize all pending fields before returning the keys so they can be looked up directly"""
+        self._mg_load_all()
+        return dict.keys(self)
+
+    def iterkeys(self):
+        """deserialize all pending fields before iterating over the keys"""
+        self._mg_load_all()
+        return dict.iterkeys(self)
+
+    def __iter__(self):
+        """deserialize all pending fields before iterating over the keys"""
+        self._mg_load_all()
+        return dict.__iter__(self)
+
+    def __repr__(self):
+        """deserialize all pending fields before showing the values"""
+        self._mg_load_all()
+        return dict.__repr__(self)
+
+    def __eq__(self, other):
+        """compare the deserialized values of both records"""
+        self._mg_load_all()
+        if isinstance(other, Record):
+            other._mg_load_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        """compare the deserialized values of both records"""
+        self._mg_load_all()
+        if isinstance(other, Record):
+            other._mg_load_all()
+        return dict.__ne__(self, other)
 
     def __getattr__(self, k):
         """retrieve some data from the dict"""
@@ -139,6 +486,12 @@ class Record(dict):
             return dict.__getattribute__(self, k)
         if self.has_key(k):
             return self[k]
+        if self._mg_profile is not None and not k.startswith('__'):
+            # this might be a field which was not fetched
+            try:
+                return self[k]
+            except KeyError:
+                pass
         raise AttributeError(k)
 
     def __setattr__(self, k,v):
@@ -187,23 +540,142 @@ class Record(dict):
             raise CollectionMissing()
         self._collection.remove(self)
 
+    def inc(self, field, n = 1, refresh = False):
+        """increment the number ``field`` by ``n`` on the server, see ``Collection.update_record()``"""
+        return self._mg_update({'$inc' : {field : n}}, refresh)
+
+    def push(self, field, value, refresh = False):
+        """append ``value`` to the list ``field`` on the server, see ``Collection.update_record()``"""
+        return self._mg_update({'$push' : {field : value}}, refresh)
+
+    def pull(self, field, value, refresh = False):
+        """remove all occurrences of ``value`` from the list ``field`` on the server"""
+        return self._mg_update({'$pull' : {field : value}}, refresh)
+
+    def add_to_set(self, field, value, refresh = False):
+        """append ``value`` to the list ``field`` on the server if it's not contained yet"""
+        return self._mg_update({'$addToSet' : {field : value}}, refresh)
+
+    def _mg_update(self, ops, refresh):
+        """apply update operators to the stored version of this record"""
+        if self._collection is None:
+            raise CollectionMissing()
+        return self._collection.update_record(self, ops, refresh = refresh)
+
+    def _mg_refresh(self, from_db):
+        """replace the fields of this record with the ones of the document ``from_db`` from the database"""
+        compiled = self.schema.compile()
+        if compiled.fill is not None:
+            compiled.fill(self, from_db, from_db, {})
+        else:
+            data = compiled.deserialize(from_db)
+            for name, node in self.schema._nodes:
+                dict.__setitem__(self, name, data[name])
+        self._mg_raw = from_db
+        self._mg_pending = None
+        self._mg_fields = None
+        self._mg_dirty = set()
+
 class Collection(object):
     """collection class for handling objects"""
 
     data_class = Record
+    partial_updates = True # if True then records loaded from the database are saved with $set/$unset of the changed fields
     create_ids = False # if True then you can override gen_id to generate a new id, otherwise a UUID will be used. If False then we use mongo objectids 
     convert_objectids = True # if True then get() will convert string _ids to object ids
+    cache = None # an optional RecordCache which keeps the records loaded with get() and get_many()
+    lazy = False # if True then find() returns records which only deserialize fields once they are accessed
+    autoproject_runs = 1 # number of calls of a call site which are profiled before find(autoproject=...) projects
+    indexes = [] # the Index declarations of this collection, see ensure_indexes()
+    check_queries = None # set to "warn" or "raise" during development to explain() each new query shape of find() and Cursor.sort()
+    write_buffer = None # the WriteBuffer put() adds objects to instead of writing them, see buffered()
+    metrics = None # an optional Metrics object recording the timings of the operations of this collection
 
-    def __init__(self, collection, md = {}, **kwargs):
+    def __init__(self, collection, md = {}, cache = None, metrics = None, **kwargs):
         """initialize the collection
 
         :param collection: The pymongo collection object to use
         :param md: Additional Metadata to be stored in this collection (link to some config etc. maybe useful for validation)
+        :param cache: a ``RecordCache`` to use instead of the one configured in the ``cache`` class attribute
+        :param metrics: a ``Metrics`` object to use instead of the one configured in the ``metrics`` class attribute
         :param kwargs: Additional parameters which will be stored inside the metadata dict
         """
         self.collection = collection
         self.md = AttributeMapper(md)
         self.md.update(kwargs)
+        if cache is not None:
+            self.cache = cache
+        if metrics is not None:
+            self.metrics = metrics
+        self._mg_local = threading.local()
+
+    def _operation(self, name):
+        """return a new ``Operation`` for timing the operation ``name`` or a disabled one if there are no metrics"""
+        if self.metrics is None:
+            return disabled
+        return self.metrics.operation(name, self)
+
+    def _hook(self, hook, *args):
+        """call a hook of this collection and count it's time for the current operation"""
+        if self.metrics is None:
+            return hook(*args)
+        return self.metrics.hook(hook, *args)
+
+    @contextlib.contextmanager
+    def identity_map(self):
+        """context manager which makes ``get()`` and ``get_many()`` return the same record object for an id
+        within the current thread as long as the context is active, e.g. for the duration of a request.
+        Records are only loaded once then. On exit the identity map is discarded.
+        """
+        local = self._mg_local
+        previous = getattr(local, 'identity', None)
+        local.identity = RecordCache(maxsize = None)
+        try:
+            yield local.identity
+        finally:
+            local.identity = previous
+
+    def _cached(self, _id):
+        """return the record for ``_id`` from the identity map or the cache or ``None`` if it's not cached"""
+        identity = getattr(self._mg_local, 'identity', None)
+        if identity is not None:
+            obj = identity.get(_id)
+            if obj is not None:
+                return obj
+        if self.cache is not None:
+            obj = self.cache.get(_id)
+            if obj is not None and identity is not None:
+                identity.put(_id, obj)
+            return obj
+        return None
+
+    def _remember(self, _id, obj):
+        """store a loaded record in the identity map and the cache"""
+        identity = getattr(self._mg_local, 'identity', None)
+        if identity is not None:
+            identity.put(_id, obj)
+        if self.cache is not None:
+            self.cache.put(_id, obj)
+
+    def _forget(self, _id, obj = None):
+        """remove the record for ``_id`` from the cache as it has changed. The identity map keeps ``obj``
+        if it is given as this is the current version of it."""
+        identity = getattr(self._mg_local, 'identity', None)
+        if identity is not None:
+            if obj is None:
+                identity.invalidate(_id)
+            else:
+                identity.put(_id, obj)
+        if self.cache is not None:
+            self.cache.invalidate(_id)
+
+    def _forget_all(self):
+        """remove all records from the cache and the identity map"""
+        identity = getattr(self._mg_local, 'identity', None)
+        if identity is not None:
+            identity.clear()
+        if self.cache is not None:
+            self.cache.clear()
 
     def new_id(self):
         """create a new unique id"""
@@ -213,8 +685,157 @@ class Collection(object):
         """create a new instance of the data class and store the collection inside"""
         return self.data_class(collection = self)
 
+    def buffered(self, max_size = 1000, interval = 1.0, write_concern = None, ordered = False):
+        """attach a ``WriteBuffer`` to this collection. Until it's closed ``put()`` only adds objects to
+        the buffer which writes them in batches, storing repeated saves of an object only once.
+
+        :param max_size: the number of pending objects which triggers a write
+        :param interval: the number of seconds between writes of the background thread or ``None``
+        :param write_concern: the pymongo ``WriteConcern`` for the writes of the buffer
+        :param ordered: whether to write the documents of a batch in order
+        :return: the ``WriteBuffer``. Call it's ``close()`` on shutdown to write the remaining objects.
+        """
+        if self.write_buffer is not None:
+            raise ValueError("the collection already has a write buffer")
+        self.write_buffer = WriteBuffer(self, max_size = max_size, interval = interval,
+            write_concern = write_concern, ordered = ordered)
+        return self.write_buffer
+
     def put(self, obj):
-        """store an object"""
+        """store an object. Objects which have been loaded from the database only get their changed
+        fields updated unless ``partial_updates`` is switched off or they are schemaless. If a
+        ``write_buffer`` is attached the object is only added to it."""
+        with self._operation("put") as op:
+            if self.write_buffer is not None:
+                return op.timed("serialize", self.write_buffer.put, obj)
+            if self.partial_updates and obj._mg_raw is not None and obj._id is not None and not obj.schemaless:
+                return self._put_changes(obj, op)
+            obj, data = op.timed("serialize", self._prepare, obj)
+            op.add_documents([data])
+            op.timed("server", self.collection.save, data, True)
+            return self._stored(obj, data)
+
+    def _stored(self, obj, data):
+        """update an object after it has been stored as the document ``data`` and run the ``after_put`` hook"""
+        obj._id = data['_id']
+        obj._collection = self
+        if obj._mg_raw is not None and not obj.schemaless:
+            # later partial updates are computed against what is stored now
+            obj._mg_raw = snapshot(data)
+        if obj._mg_dirty is not None:
+            obj._mg_dirty.clear()
+        self._forget(obj._id, obj)
+        self._hook(self.after_put, obj)
+        return obj
+
+    def _put_changes(self, obj, op = disabled):
+        """store only the changes of an object loaded from the database with ``$set`` and ``$unset``.
+
+        Fields which have been set or removed are serialized and stored as a whole. Fields holding sub
+        documents or lists are serialized and compared to the raw document so only changed parts of them
+        are set. All other fields are left alone. If the collection has a ``before_put`` hook it gets the
+        whole serialized document like in ``put()`` and the changes are taken from the document it returns.
+        """
+        obj, update, fields = op.timed("serialize", self._prepare_changes, obj)
+        if update:
+            op.add_documents([update])
+            op.timed("server", self.collection.update_one, {'_id' : obj._id}, update)
+        return self._changes_stored(obj, fields)
+
+    def _prepare_changes(self, obj):
+        """compute the update document for the changes of an object and run the hooks for it
+
+        :return: a tuple of the object returned from ``before_serialize``, the update document or ``None``
+            if nothing changed and the changed top level fields as returned by ``_changes()``
+        """
+        obj = self._hook(self.before_serialize, obj)
+        if getattr(self.before_put, "__func__", None) is Collection.before_put.__func__:
+            sets, unsets, fields = self._changes(obj)
+        else:
+            data = self._hook(self.before_put, obj, self._serialize_loaded(obj))
+            sets, unsets, fields = self._changes(obj, data)
+        update = None
+        if sets or unsets:
+            update = {}
+            if sets:
+                update['$set'] = sets
+            if unsets:
+                update['$unset'] = unsets
+        return obj, update, fields
+
+    def _changes_stored(self, obj, fields):
+        """update an object after it's changes have been stored and run the ``after_put`` hook"""
+        # remember what is stored now without changing the document the record was loaded from
+        raw = obj._mg_raw = dict(obj._mg_raw)
+        for name, value in fields.items():
+            raw[name] = snapshot(value)
+        obj._collection = self
+        obj._mg_dirty.clear()
+        self._forget(obj._id, obj)
+        self._hook(self.after_put, obj)
+        return obj
+
+    def _serialize_loaded(self, obj):
+        """serialize the fields of an object loaded from the database which can be stored. These are all
+        fields unless it was loaded with a projection."""
+        compiled = obj.schema.compile()
+        if obj._mg_fields is None:
+            obj._mg_load_all()
+            data = compiled.serialize(obj)
+        else:
+            data = dict([(name, serialize(dict.get(obj, name, null), obj, {}))
+                for name, serialize in compiled.field_serializers.items() if name in obj._mg_fields])
+        data['_id'] = obj._id
+        return data
+
+    def _changes(self, obj, data = None):
+        """compute the changes of an object loaded from the database
+
+        :param data: the serialized document as returned by the ``before_put`` hook. If it's given then
+            the changes are computed from it instead of serializing the fields.
+        :return: a tuple of the ``$set`` document, the ``$unset`` document and a dictionary of the changed
+            top level fields with their new serialized value
+        """
+        raw = obj._mg_raw
+        dirty = obj._mg_dirty or ()
+        pending = obj._mg_pending or ()
+        loaded = obj._mg_fields
+        fields = {}
+        sets = {}
+        unsets = {}
+        if data is not None:
+            for name, new in data.items():
+                if name == "_id":
+                    continue
+                old = raw.get(name, diff.missing)
+                if name in dirty:
+                    fields[name] = sets[name] = new
+                    continue
+                diff(name, old, new, sets, unsets)
+                if new != old:
+                    fields[name] = new
+            return sets, unsets, fields
+        for name, serialize in obj.schema.compile().field_serializers.items():
+            if name in pending or (loaded is not None and name not in loaded):
+                continue
+            value = dict.get(obj, name, null)
+            old = raw.get(name, diff.missing)
+            if name in dirty:
+                fields[name] = sets[name] = serialize(value, obj, {})
+                continue
+            if value is old and not isinstance(value, (dict, list)):
+                continue
+            new = serialize(value, obj, {})
+            diff(name, old, new, sets, unsets)
+            if new != old:
+                fields[name] = new
+        return sets, unsets, fields
+
+    def _prepare(self, obj):
+        """serialize and validate an object for storing it and run the hooks for it
+
+        :return: a tuple of the object returned from ``before_serialize`` and the data to store
+        """
 
         # check if we need to create an id
         _id = None
@@ -223,21 +844,111 @@ class Collection(object):
         else:
             _id = obj._id
 
+        if obj._mg_fields is not None:
+            raise PartialRecord(obj._id)
+
         # now serialize and validate the object
-        obj = self.before_serialize(obj)
+        obj = self._hook(self.before_serialize, obj)
+        serializer = obj.schema.compile()
         if obj.schemaless:
             data = obj
-            data.update(obj.schema.serialize(obj))
+            data.update(serializer.serialize(obj))
         else:
-            data = obj.schema.serialize(obj)
+            data = serializer.serialize(obj)
         if _id is not None:
             data['_id'] = _id
-        data = self.before_put(obj, data) # hook for handling additional validation etc.
-        self.collection.save(data, True)
-        obj._id = data['_id']
-        obj._collection = self
-        self.after_put(obj)
-        return obj
+        data = self._hook(self.before_put, obj, data) # hook for handling additional validation etc.
+        return obj, data
+
+    def put_many(self, objs, ordered = False, batch_size = 1000):
+        """store many objects with as few round trips as possible. Each object is serialized and
+        validated and the ``before_serialize``, ``before_put`` and ``after_put`` hooks are called for it
+        like in ``put()``. Objects without an id are inserted, the others are replaced or inserted if
+        they do not exist yet.
+
+        Objects which fail validation are skipped and reported in the result, the others are still stored.
+
+        :param objs: an iterable of objects to store
+        :param ordered: if ``True`` then the writes of a batch are done in order and stop at the first
+            failing write. Otherwise the server might do them in parallel.
+        :param batch_size: the number of objects to send to the server at once
+        :return: a ``PutManyResult`` with the stored objects and the errors by position in ``objs``
+        """
+        result = PutManyResult()
+        batch = []
+        with self._operation("put_many") as op:
+            for index, obj in enumerate(objs):
+                try:
+                    batch.append((index,) + op.timed("serialize", self._prepare, obj))
+                except (Invalid, ValueError, DatabaseError), e:
+                    result.errors[index] = e
+                if len(batch) >= batch_size:
+                    self._put_batch(batch, ordered, result, op)
+                    batch = []
+            if batch:
+                self._put_batch(batch, ordered, result, op)
+        return result
+
+    def _put_batch(self, batch, ordered, result, op = disabled):
+        """write a batch of ``(index, obj, data)`` tuples and run the ``after_put`` hook for each stored object"""
+        docs = [data for index, obj, data in batch]
+        op.add_documents(docs)
+        errors = op.timed("server", self._write_batch, docs, ordered)
+        self._batch_stored(batch, errors, result)
+
+    def _batch_stored(self, batch, errors, result):
+        """add the objects of a written batch of ``(index, obj, data)`` tuples and the errors by their
+        position in the batch to ``result`` and run the ``after_put`` hook for each stored object"""
+        for position, (index, obj, data) in enumerate(batch):
+            if position in errors:
+                result.errors[index] = errors[position]
+                continue
+            result.records.append(self._stored(obj, data))
+
+    def _write_batch(self, docs, ordered = False, write_concern = None):
+        """write serialized documents with one ``bulk_write``. Documents without an ``_id`` get a new
+        ObjectId and are inserted, all others are replaced or inserted if they do not exist yet. ``UpdateOne``
+        requests for the changes of loaded records are written as they are. A ``write_concern`` overrides
+        the one of the pymongo collection.
+
+        :return: a dictionary mapping the positions of the documents which have not been written to the
+            ``WriteFailed`` exception describing the reason
+        """
+        collection = self.collection
+        if write_concern is not None:
+            collection = collection.with_options(write_concern = write_concern)
+        try:
+            collection.bulk_write(self._write_requests(docs), ordered = ordered)
+        except BulkWriteError, e:
+            return self._write_errors(e, len(docs), ordered)
+        return {}
+
+    def _write_requests(self, docs):
+        """return the ``bulk_write`` requests for serialized documents, see ``_write_batch()``"""
+        requests = []
+        for doc in docs:
+            if isinstance(doc, UpdateOne):
+                requests.append(doc)
+            elif doc.get('_id') is None:
+                doc['_id'] = ObjectId()
+                requests.append(InsertOne(doc))
+            else:
+                requests.append(ReplaceOne({'_id' : doc['_id']}, doc, upsert = True))
+        return requests
+
+    def _write_errors(self, e, count, ordered):
+        """return the ``WriteFailed`` exceptions by position for the ``BulkWriteError`` ``e`` of a batch
+        of ``count`` documents"""
+        errors = {}
+        write_errors = e.details.get('writeErrors', [])
+        for error in write_errors:
+            errors[error['index']] = WriteFailed(error)
+        if ordered and write_errors:
+            # the server stops at the first failing write
+            first = min(errors)
+            for position in range(first + 1, count):
+                errors[position] = WriteFailed({'errmsg' : 'not written due to an earlier error', 'index' : position})
+        return errors
 
     save = put
 
@@ -253,17 +964,91 @@ class Collection(object):
         """hook for changing data after the object from the database has been instantiated"""
         pass
 
+    def _convert_id(self, _id):
+        """convert a string id to an ObjectId if ``convert_objectids`` is set and it is a valid one"""
+        if self.convert_objectids and isinstance(_id, basestring) and len(_id) == 24 and ObjectId.is_valid(_id):
+            return ObjectId(_id)
+        return _id
+
     def get(self, _id):
         """return an object by it's id"""
-        data = self.collection.find_one({'_id' : _id})
-        if data is None:
-            raise ObjectNotFound(_id)
-        #if self.data_class.schemaless:
-            #data.update(self.data_class.schema.deserialize(data))
-        #else:
-            #data = self.data_class.schema.deserialize(data)
-        data['_id'] = _id
-        return self.data_class(from_db = data, collection=self)
+        with self._operation("get") as op:
+            _id = self._convert_id(_id)
+            obj = self._cached(_id)
+            if obj is not None:
+                return obj
+            data = op.timed("server", self.collection.find_one, {'_id' : _id})
+            if data is None:
+                raise ObjectNotFound(_id)
+            #if self.data_class.schemaless:
+                #data.update(self.data_class.schema.deserialize(data))
+            #else:
+                #data = self.data_class.schema.deserialize(data)
+            op.add_documents([data])
+            data['_id'] = _id
+            obj = op.timed("deserialize", self.data_class, from_db = data, collection=self)
+            self._remember(_id, obj)
+            return obj
+
+    def get_many(self, ids, missing = 'skip', chunk_size = 1000):
+        """return the objects for a list of ids in the order of the ids. The objects are retrieved
+        with one ``$in`` query per ``chunk_size`` ids. An id which is requested more than once
+        results in the same object at each position.
+
+        :param ids: the ids of the objects to return
+        :param missing: what to do about ids which are not found. ``skip`` leaves them out,
+            ``none`` returns ``None`` at their position and ``raise`` raises ``ObjectNotFound``.
+        :param chunk_size: the maximum number of ids to query at once
+        :return: a list of objects
+        """
+        if missing not in ('skip', 'none', 'raise'):
+            raise ValueError("missing has to be one of skip, none or raise")
+        with self._operation("get_many") as op:
+            return self._get_many(ids, missing, chunk_size, op)
+
+    def _get_many(self, ids, missing, chunk_size, op):
+        """implementation of ``get_many()`` which records it's timings in the ``Operation`` op"""
+        ids = [self._convert_id(_id) for _id in ids]
+        unique = []
+        seen = set()
+        for _id in ids:
+            if _id not in seen:
+                seen.add(_id)
+                unique.append(_id)
+
+        objs = {}
+        for _id in unique:
+            obj = self._cached(_id)
+            if obj is not None:
+                objs[_id] = obj
+        query = [_id for _id in unique if _id not in objs]
+
+        found = {}
+        for start in range(0, len(query), chunk_size):
+            chunk = query[start:start+chunk_size]
+            docs = op.timed("server", list, self.collection.find({'_id' : {'$in' : chunk}}))
+            op.add_documents(docs)
+            for data in docs:
+                found[data['_id']] = data
+
+        if missing == 'raise':
+            for _id in query:
+                if _id not in found:
+                    raise ObjectNotFound(_id)
+
+        result = []
+        for _id in ids:
+            obj = objs.get(_id)
+            if obj is None:
+                data = found.get(_id)
+                if data is None:
+                    if missing == 'none':
+                        result.append(None)
+                    continue
+                obj = objs[_id] = op.timed("deserialize", self.data_class, from_db = data, collection = self)
+                self._remember(_id, obj)
+            result.append(obj)
+        return result
 
     def remove(self, obj):
         """high level method to remove an object"""
@@ -272,20 +1057,336 @@ class Collection(object):
 
     def _remove(self, *args, **kwargs):
         """raw remove method for using a query to remove one or more objects"""
-        return self.collection.remove(*args, **kwargs)
+        self._forget_spec(args[0] if args else kwargs.get('spec_or_id'))
+        with self._operation("remove") as op:
+            return op.timed("server", self.collection.remove, *args, **kwargs)
+
+    def _forget_spec(self, spec):
+        """remove the records which might be affected by a query from the cache"""
+        if isinstance(spec, dict) and spec.keys() == ['_id'] and not isinstance(spec['_id'], dict):
+            self._forget(spec['_id'])
+        else:
+            self._forget_all()
+
+    def ensure_indexes(self):
+        """create the declared ``indexes`` of this collection if they don't exist yet
+
+        :return: the list of index names
+        """
+        if not self.indexes:
+            return []
+        return self.collection.create_indexes([index.model() for index in self.indexes])
+
+    def _explain(self, spec, sort = None):
+        """return the ``explain()`` output for a query"""
+        cursor = self.collection.find(spec)
+        if sort:
+            cursor = cursor.sort(sort)
+        return cursor.explain()
+
+    def check_query(self, spec, sort = None):
+        """check whether a query uses an index and is covered by one of the declared indexes. Each query
+        shape is only checked once. Depending on ``check_queries`` a ``UnindexedQueryWarning`` is issued or
+        ``UnindexedQuery`` is raised.
+
+        :param spec: the query spec
+        :param sort: the optional sort specification as list of ``(field, direction)`` tuples
+        :return: ``None`` if the query is fine or was checked before and the problem otherwise
+        """
+        fields = query_fields(spec)
+        sort_fields = tuple([key for key, direction in (sort or [])])
+        if not fields and not sort_fields:
+            return None
+        shape = (self.collection.full_name, tuple(sorted(fields)), sort_fields)
+        if not checked_shapes.first(shape):
+            return None
+
+        problem = None
+        used = fields | set(sort_fields)
+        if collection_scans(self._explain(spec, sort)):
+            problem = "query on %s of %s is a collection scan" %(", ".join(sorted(used)), self.collection.full_name)
+        elif "_id" not in used and not [index for index in self.indexes if index.covers(fields, sort)]:
+            problem = "query on %s of %s is not covered by a declared index" %(", ".join(sorted(used)), self.collection.full_name)
+        if problem is None:
+            return None
+        if self.check_queries == "raise":
+            raise UnindexedQuery(problem)
+        warnings.warn(problem, UnindexedQueryWarning, stacklevel = 3)
+        return problem
 
     def find(self, *args, **kwargs):
-        return Cursor(self, wrap = self.data_class, *args, **kwargs)
+        """find records. Additionally to the pymongo parameters you can pass
+
+        :param lazy: override the ``lazy`` setting of this collection
+        :param fields: a list of schema field names to fetch. These can be dotted paths into sub schemas
+            and lists of sub schemas. The resulting records only contain those fields and cannot be stored
+            as a whole.
+        :param autoproject: a key for the call site or ``True`` to use the calling code location. The first
+            ``autoproject_runs`` calls for a key return complete records and record which fields are read
+            from them. Later calls only fetch these fields. Fields which are read from such a record
+            anyhow are fetched on demand and will be fetched on the next calls as well.
+
+        The query spec can also be an ``Expression`` built from the fields of the data class.
+        """
+        if kwargs.get('autoproject') is True:
+            kwargs['autoproject'] = call_site()
+        with self._operation("find") as op:
+            args, kwargs, wrap_kw = self._find_args(args, kwargs)
+            return op.timed("server", Cursor, self, wrap = self.data_class, wrap_kw = wrap_kw, *args, **kwargs)
+
+    def _find_args(self, args, kwargs):
+        """process the arguments of ``find()``
+
+        :return: a tuple of the arguments and keyword arguments for the driver and the keyword arguments
+            for creating the records
+        """
+        if args and isinstance(args[0], Expression):
+            args = (args[0].to_spec(),) + args[1:]
+        if isinstance(kwargs.get('filter'), Expression):
+            kwargs['filter'] = kwargs['filter'].to_spec()
+        if self.check_queries:
+            self.check_query(args[0] if args else kwargs.get('filter'), kwargs.get('sort'))
+        wrap_kw = {}
+        if kwargs.pop('lazy', self.lazy):
+            wrap_kw['lazy'] = True
+        fields = kwargs.pop('fields', None)
+        autoproject = kwargs.pop('autoproject', None)
+        projection = None
+        if autoproject is not None:
+            profile = get_profile((self.__class__, autoproject), self.autoproject_runs)
+            projection = profile.projection(self.data_class.schema)
+        elif fields is not None:
+            projection = get_projection(self.data_class.schema, fields)
+        if projection is not None:
+            wrap_kw['projection'] = projection
+            if projection.spec is not None:
+                kwargs['projection'] = projection.spec
+        return args, kwargs, wrap_kw
         
     def find_one(self, spec_or_id=None, *args, **kwargs):
 
+        if isinstance(spec_or_id, Expression):
+            spec_or_id = spec_or_id.to_spec()
         if spec_or_id is not None and not isinstance(spec_or_id, dict):
             spec_or_id = {"_id": spec_or_id}
+        if kwargs.get('autoproject') is True:
+            kwargs['autoproject'] = call_site()
 
         for result in self.find(spec_or_id, *args, **kwargs).limit(-1):
             return result
         return None
 
+    def _field_node(self, path):
+        """return the schema node of the field ``path`` of the data class or ``None`` for parts of a
+        ``Dict`` and other fields without a node. Indexes and positional operators select the items of
+        a list, e.g. ``tags.0`` or ``events.$.title``."""
+        node = self.data_class.schema
+        for part in path.split("."):
+            if isinstance(node, List):
+                node = node.subtype
+                if part.isdigit() or part.startswith("$"):
+                    continue
+            if node is None or part == "_id":
+                return None
+            if not isinstance(node, Schema):
+                if not isinstance(node, Dict):
+                    raise ValueError("field %s has no sub fields" %path)
+                return None
+            nodes = dict(node._nodes)
+            if part not in nodes:
+                raise ValueError("unknown field %s" %path)
+            node = nodes[part]
+        return node
+
+    def update(self, spec, ops, multi = False, upsert = False):
+        """apply update operators to the documents matching ``spec`` on the server. The operands are
+        validated and serialized with the schema nodes of their fields. An ``$inc`` of a field with
+        ``min`` or ``max`` only updates documents where the result stays within the range.
+
+        :param spec: the query as dict or ``Expression``
+        :param ops: the update document, e.g. ``{'$inc' : {'visits' : 1}, '$push' : {'tags' : u"new"}}``
+        :param multi: whether to update all matching documents or only the first one
+        :param upsert: whether to insert a document if none matches
+        :return: the pymongo ``UpdateResult``
+        """
+        if isinstance(spec, Expression):
+            spec = spec.to_spec()
+        update, guards = convert_update(ops, self._field_node)
+        self._forget_spec(spec)
+        if multi:
+            return self.collection.update_many(guarded(spec, guards), update, upsert = upsert)
+        return self.collection.update_one(guarded(spec, guards), update, upsert = upsert)
+
+    def update_record(self, obj, ops, refresh = False):
+        """apply update operators to the stored version of a record with one request, see ``update()``.
+        The record itself is not changed unless ``refresh`` is set.
+
+        :param obj: the record to update
+        :param ops: the update document
+        :param refresh: if ``True`` then the fields of the record are replaced with the updated document
+            returned by the server
+        :return: the record
+        """
+        if obj._id is None:
+            raise ObjectNotFound(None)
+        update, guards = convert_update(ops, self._field_node)
+        spec = guarded({'_id' : obj._id}, guards)
+        self._forget(obj._id, obj)
+        if refresh:
+            doc = self.collection.find_one_and_update(spec, update, return_document = ReturnDocument.AFTER)
+            matched = doc is not None
+        else:
+            matched = self.collection.update_one(spec, update).matched_count > 0
+        if not matched:
+            if guards and self.exists(obj._id):
+                raise self._range_error(guards)
+            raise ObjectNotFound(obj._id)
+        if refresh:
+            obj._mg_refresh(doc)
+        return obj
+
+    def _range_error(self, guards):
+        """return the exception for an update of a record which did not match because the guarded fields
+        would leave their range"""
+        node = guards.values()[0][0]
+        return Invalid(node, "the update would leave the allowed range of %s" %", ".join(guards))
+
+    def count(self, spec = None, **kwargs):
+        """return the number of documents matching ``spec`` as counted by the server
+
+        :param spec: the query as dict or ``Expression``
+        :param kwargs: further options for ``count_documents()`` like ``limit`` or ``skip``
+        """
+        if isinstance(spec, Expression):
+            spec = spec.to_spec()
+        return self.collection.count_documents(spec or {}, **kwargs)
+
+    def exists(self, spec_or_id):
+        """return whether a document matching the query or with the given id exists. Only the ``_id``
+        of one document is fetched."""
+        if isinstance(spec_or_id, Expression):
+            spec_or_id = spec_or_id.to_spec()
+        if not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id' : self._convert_id(spec_or_id)}
+        return self.collection.find_one(spec_or_id, projection = {'_id' : 1}) is not None
+
+    def distinct(self, field, spec = None):
+        """return the distinct values of ``field`` in the documents matching ``spec``. The values are
+        deserialized with the schema node of the field, for a list field with the node of it's items.
+
+        :param field: the name of the field, a dotted path for fields of sub schemas
+        :param spec: the query as dict or ``Expression``
+        """
+        if isinstance(spec, Expression):
+            spec = spec.to_spec()
+        return self._distinct_values(field, self.collection.distinct(field, spec))
+
+    def _distinct_values(self, field, values):
+        """deserialize the distinct values of ``field`` returned by the server"""
+        node = self._field_node(field)
+        if isinstance(node, List):
+            node = node.subtype
+        if node is None:
+            return values
+        deserialize = node.compile().deserialize
+        return [deserialize(value) for value in values]
+
+    def populate(self, records, *paths, **collections):
+        """replace the ids in reference fields of records with the referenced records. All ids of a
+        target collection are fetched with one query, regardless of the number of records. Ids which are
+        not found are left alone.
+
+        :param records: a list of records of this collection
+        :param paths: the dotted paths of ``Reference`` fields, also inside lists and sub schemas, e.g.
+            ``location`` or ``events.speakers``
+        :param collections: target collections by path for references without a target
+        :return: the records
+        """
+        return populate(records, self.data_class.schema, paths, collections)
+
+    def aggregate(self, pipeline, result_schema = None, allow_disk_use = False, batch_size = None, **kwargs):
+        """run an aggregation pipeline and return a cursor over the results
+
+        :param pipeline: a list of stages or a ``Pipeline``
+        :param result_schema: a ``Schema`` to deserialize the results with or a ``Record`` class to turn them
+            into. If it's not given then the results are records of the data class if the pipeline only
+            filters, sorts or limits the documents and plain dictionaries otherwise.
+        :param allow_disk_use: whether stages may write temporary data to disk
+        :param batch_size: the number of documents to fetch and deserialize at once
+        :param kwargs: further options for the pymongo ``aggregate()``
+        """
+        wrap, kwargs = self._aggregate_args(pipeline, result_schema, allow_disk_use, batch_size, kwargs)
+        cursor = self.collection.aggregate(list(pipeline), **kwargs)
+        return Cursor(self, cursor = cursor, wrap = wrap, batch_size = batch_size)
+
+    def _aggregate_args(self, pipeline, result_schema, allow_disk_use, batch_size, kwargs):
+        """return the class to wrap the results of ``aggregate()`` with and the options for the driver"""
+        if result_schema is None:
+            wrap = self.data_class if preserves_shape(pipeline) else None
+        elif isinstance(result_schema, type):
+            wrap = result_schema
+        else:
+            wrap = SchemaResults(result_schema)
+        if allow_disk_use:
+            kwargs['allowDiskUse'] = True
+        if batch_size is not None:
+            kwargs['batchSize'] = batch_size
+        return wrap, kwargs
+
+    def paginate(self, spec = None, sort = None, after = None, before = None, page_size = 20, **kwargs):
+        """return a page of records. Pages are found by the sort key values of the last record of the
+        previous page (or the first record of the next page) instead of skipping documents so deep pages
+        are as fast as the first one if there is an index for the sort keys.
+
+        :param spec: the query as dict or ``Expression``
+        :param sort: the sort order as list of ``(key, direction)`` tuples. ``_id`` is added as last key
+            if it's missing so the order is unique.
+        :param after: the ``next`` token of the previous page to return the page following it
+        :param before: the ``previous`` token of a page to return the page preceding it
+        :param page_size: the maximum number of records on a page
+        :param kwargs: further arguments for ``find()``. If you pass ``fields`` they have to include the
+            sort keys.
+        :return: a ``Page``
+        """
+        spec, keys, order = self._page_query(spec, sort, after, before)
+        # one more record tells whether there is another page
+        records = list(self.find(spec, sort = order, limit = page_size + 1, **kwargs))
+        return self._page(records, keys, after, before, page_size)
+
+    def _page_query(self, spec, sort, after, before):
+        """return the query, the sort keys and the order for fetching a page, see ``paginate()``"""
+        if after is not None and before is not None:
+            raise ValueError("pass either after or before")
+        if isinstance(spec, Expression):
+            spec = spec.to_spec()
+        keys = sort_keys(sort)
+        forward = before is None
+        token = after if forward else before
+        if token is not None:
+            keyset = keyset_spec(keys, decode_token(keys, token), forward)
+            spec = {'$and' : [spec, keyset]} if spec else keyset
+        if forward:
+            order = keys
+        else:
+            order = [(key, -direction) for key, direction in keys]
+        return spec or {}, keys, order
+
+    def _page(self, records, keys, after, before, page_size):
+        """return the ``Page`` for the records fetched for the query of ``_page_query()``"""
+        forward = before is None
+        more = len(records) > page_size
+        records = records[:page_size]
+        if not forward:
+            records.reverse()
+        if not records:
+            return Page(records)
+
+        first = encode_token(keys, key_values(records[0]._mg_raw, keys))
+        last = encode_token(keys, key_values(records[-1]._mg_raw, keys))
+        if forward:
+            return Page(records, last if more else None, first if after is not None else None)
+        return Page(records, last, first if more else None)
+
     def __call__(self, data = {}, **kw):
         """create a new object and return it. It is not saved yet.
 
@@ -0,0 +1,128 @@
+"""
+
+resolution of reference fields
+
+"""
+
+from schema import Schema, List, Reference
+
+__all__ = ["reference_node", "reference_slots", "reference_targets", "resolve_references", "populate"]
+
+
+def reference_node(schema, path):
+    """return the ``Reference`` node for the dotted ``path`` into ``schema``. Lists of sub schemas are
+    entered and the node may also be the subtype of a list."""
+    node = schema
+    for name in path.split("."):
+        if isinstance(node, List):
+            node = node.subtype
+        if not isinstance(node, Schema):
+            raise ValueError("%s is not a reference field" %path)
+        nodes = dict(node._nodes)
+        if name not in nodes:
+            raise ValueError("unknown field %s" %path)
+        node = nodes[name]
+    if isinstance(node, List):
+        node = node.subtype
+    if not isinstance(node, Reference):
+        raise ValueError("%s is not a reference field" %path)
+    return node
+
+
+def _get(container, key):
+    """return the value stored under ``key`` of a record, a dictionary or a list"""
+    if isinstance(container, list):
+        return container[key]
+    return container.get(key)
+
+def _slots(container, key, parts):
+    """yield the ``(container, key)`` pairs holding the references below ``container[key]``"""
+    value = _get(container, key)
+    if value is None:
+        return
+    if not parts:
+        if isinstance(value, list):
+            for index in range(len(value)):
+                yield value, index
+        else:
+            yield container, key
+        return
+    if isinstance(value, list):
+        for index in range(len(value)):
+            for slot in _slots(value, index, parts):
+                yield slot
+    elif isinstance(value, dict):
+        for slot in _slots(value, parts[0], parts[1:]):
+            yield slot
+
+def reference_slots(records, path):
+    """return the ``(container, key)`` pairs holding the references for ``path`` in ``records``"""
+    parts = path.split(".")
+    slots = []
+    for record in records:
+        slots.extend(_slots(record, parts[0], parts[1:]))
+    return slots
+
+
+def reference_targets(records, schema, paths, collections):
+    """return a list of ``(target, slots, ids)`` tuples with a target collection, the ``(container, key)``
+    pairs holding references to it and the ids which have to be fetched from it
+
+    :param records: the records to populate
+    :param schema: the schema of the records
+    :param paths: the dotted paths of the reference fields
+    :param collections: a dictionary of target collections by path overriding the ones of the nodes
+    """
+    targets = {} # id of the target collection -> (collection, slots)
+    for path in paths:
+        target = collections.get(path)
+        if target is None:
+            target = reference_node(schema, path).get_target()
+        if target is None:
+            raise ValueError("no target collection known for %s" %path)
+        targets.setdefault(id(target), (target, []))[1].extend(reference_slots(records, path))
+
+    result = []
+    for target, slots in targets.values():
+        ids = []
+        seen = set()
+        for container, key in slots:
+            value = _get(container, key)
+            if isinstance(value, dict) or value in seen:
+                continue # already populated
+            seen.add(value)
+            ids.append(value)
+        if ids:
+            result.append((target, slots, ids))
+    return result
+
+def resolve_references(slots, ids, found):
+    """replace the references in ``slots`` with the records ``found`` by ``get_many()`` for ``ids``"""
+    found = dict(zip(ids, found))
+    for container, key in slots:
+        value = _get(container, key)
+        if isinstance(value, dict) or found.get(value) is None:
+            continue
+        if isinstance(container, list):
+            container[key] = found[value]
+        else:
+            # don't mark the record as changed, the reference itself stays the same
+            dict.__setitem__(container, key, found[value])
+
+def populate(records, schema, paths, collections):
+    """replace the ids in the reference fields ``paths`` of ``records`` with the referenced records.
+    The ids of all paths with the same target collection are fetched with one ``get_many()`` call.
+    Asynchronous target collections are only supported by ``AsyncCollection.populate()``.
+
+    :param records: the records to populate
+    :param schema: the schema of the records
+    :param paths: the dotted paths of the reference fields
+    :param collections: a dictionary of target collections by path overriding the ones of the nodes
+    """
+    for target, slots, ids in reference_targets(records, schema, paths, collections):
+        found = target.get_many(ids, missing = 'none')
+        if not isinstance(found, list):
+            raise ValueError("%s is asynchronous, populate the records with an AsyncCollection"
+                %target.__class__.__name__)
+        resolve_references(slots, ids, found)
+    return records
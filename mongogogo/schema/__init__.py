@@ -1,3 +1,4 @@
 from utils import *
 from filters import *
 from nodes import * 
+from profiler import *
@@ -1,8 +1,11 @@
-from utils import null, Invalid, marker, AttributeMapper
+from utils import null, Invalid, marker, AttributeMapper, snapshot
 import datetime
 import types
 import dateutil.parser
+import dateutil.tz
 import re
+import threading
+import profiler
 
 __all__ = [
     "SchemaNode",
@@ -16,8 +19,47 @@ __all__ = [
     "DateTime",
     "Dict",
     "List",
+    "Reference",
 ]
 
+def _overrides(node, name, base):
+    """check whether the class of ``node`` overrides the method ``name`` defined in ``base``"""
+    return getattr(type(node), name).__func__ is not getattr(base, name).__func__
+
+_compiling = threading.local() # knows whether a profiled version of a node is compiled in this thread
+
+def _compile(node, kind, parent = None):
+    """return the compiled serializer or deserializer of ``node`` depending on ``kind``. If a profiled
+    version is compiled it's wrapped so the active ``SchemaProfiler`` records it's calls.
+
+    :param parent: the name of the schema if the node is compiled as single field of it
+    """
+    if kind == "serialize":
+        func = node._compile_serializer()
+    else:
+        func = node._compile_deserializer()
+    if getattr(_compiling, 'profiled', False):
+        func = profiler.wrap_node(node, kind, func, parent)
+    return func
+
+def _filters(filters, kind):
+    """return the filters of a node as tuple, wrapped for the profiler if a profiled version is compiled"""
+    if getattr(_compiling, 'profiled', False):
+        return tuple([profiler.wrap_filter(filter, kind) for filter in filters])
+    return tuple(filters)
+
+_fillable = {} # whether a destination class can be filled directly by class
+
+def fillable(kls):
+    """return whether objects of the destination class ``kls`` can be created empty and filled with the
+    deserialized fields afterwards. This is the case for dictionaries which keep the constructor of
+    ``dict`` as creating them from a dictionary only copies it."""
+    result = _fillable.get(kls)
+    if result is None:
+        result = _fillable[kls] = (isinstance(kls, type) and issubclass(kls, dict)
+            and kls.__init__ is dict.__init__ and kls.__new__ is dict.__new__)
+    return result
+
 def get_class( kls ):
     parts = kls.split('.')
     module = ".".join(parts[:-1])
@@ -39,29 +81,43 @@ class SchemaNode(object):
     """
 
     _schemanode = True # marker for meta class that this is part of the schema
-    #_counter = 0 # this is a global counter which is incremented on instantiation of a type.
+    _counter = 0 # this is a global counter which is incremented on instantiation of a type.
 
     def __new__(cls, *args, **kwargs):
         # increment the counter so we know which the original sequence of type nodes is. 
-        #SchemaNode._counter += 1
+        SchemaNode._counter += 1
         kls = kwargs.get("kls")
         if "kls" in kwargs:
             del kwargs['kls']
         instance = super(SchemaNode, cls).__new__(cls, *args, **kwargs)
-        #instance._counter = SchemaNode._counter
-
-        # now collect the nodes in this instance
+        instance._mg_counter = SchemaNode._counter
         instance._mg_class = kls
-        instance._nodes = []
-        for name in dir(instance):
+
+        # the nodes are class attributes so they are only collected once per class
+        instance._nodes = cls._mg_collect_nodes()
+        return instance
+
+    @classmethod
+    def _mg_collect_nodes(cls):
+        """return the sequence of ``(name, node)`` tuples of this class in the order in which the nodes
+        have been declared. This is computed on first use and then cached on the class itself. Note that
+        nodes which are added to the class after it has been instantiated once are not picked up.
+        """
+        nodes = cls.__dict__.get("_mg_nodes")
+        if nodes is not None:
+            return nodes
+        nodes = []
+        for name in dir(cls):
             if not name.startswith('__') and not name.startswith('_mg_'):
-                field = getattr(instance, name)
+                field = getattr(cls, name)
 
                 # filter out only the type elements. We have marker in the base class for that
                 if hasattr(field, '_schemanode'):
                     field.name = name
-                    instance._nodes.append((name, field))
-        return instance
+                    nodes.append((name, field))
+        nodes.sort(key = lambda item: getattr(item[1], "_mg_counter", 0))
+        nodes = cls._mg_nodes = tuple(nodes)
+        return nodes
 
     def __init__(self, on_serialize = [], on_deserialize = [], default = marker, required = False, name = None, **kw): 
         """initialize the ``SchemaNode`` with generic parameters like queues, default and required flag
@@ -174,6 +230,149 @@ class SchemaNode(object):
         """
         return value
 
+    def convert(self, value):
+        """convert a single value to it's MongoDB representation without validating it, e.g. an operand
+        of a query which might be outside of the range allowed for stored values. Nodes with checks like
+        a minimum or a maximum length override this so only the type is converted.
+        """
+        return self.do_serialize(value, value)
+
+    def compile(self):
+        """return a ``Compiled`` version of this node. It walks the node tree once and builds
+        flat serializer and deserializer functions from it. Sub nodes of ``Schema``, ``List`` and ``Dict``
+        are inlined and empty filter queues, unset defaults and required checks are left out.
+
+        The result is cached on the node so you can call this as often as you like. Note that
+        changes to the node tree after the first call are not picked up.
+
+        While a ``SchemaProfiler`` is enabled a version recording the time spent in each sub node and
+        filter is returned instead.
+        """
+        if profiler.active is not None:
+            compiled = self.__dict__.get("_mg_profiled")
+            if compiled is None:
+                compiled = self._mg_profiled = Compiled(self, profiled = True)
+            return compiled
+        compiled = self.__dict__.get("_mg_compiled")
+        if compiled is None:
+            compiled = self._mg_compiled = Compiled(self)
+        return compiled
+
+    def _compile_serializer(self):
+        """return a function ``f(value, data, kw)`` which does the same as ``serialize()``"""
+        if _overrides(self, "serialize", SchemaNode):
+            serialize = self.serialize
+            return lambda value, data, kw: serialize(value, data, **kw)
+
+        do_serialize = self._compile_do_serializer()
+        filters = _filters(self.on_serialize, "on_serialize")
+        default = self.default
+        required = self.required
+        node = self
+        if not filters and default is marker and not required:
+            return do_serialize
+
+        def serialize(value, data, kw):
+            for filter in filters:
+                value = filter(value, data, **kw)
+            if value is null and default is not marker:
+                if callable(default):
+                    value = default()
+                else:
+                    value = default
+            if value is null and required:
+                raise Invalid(node, "required data missing")
+            return do_serialize(value, data, kw)
+        return serialize
+
+    def _compile_deserializer(self):
+        """return a function ``f(value, data, kw)`` which does the same as ``deserialize()``"""
+        if _overrides(self, "deserialize", SchemaNode):
+            deserialize = self.deserialize
+            return lambda value, data, kw: deserialize(value, data, **kw)
+
+        do_deserialize = self._compile_do_deserializer()
+        filters = _filters(self.on_deserialize, "on_deserialize")
+        default = self.default
+        required = self.required
+        kls = self._mg_class
+        node = self
+        if not filters and default is marker and not required and kls is None:
+            return do_deserialize
+
+        def deserialize(value, data, kw):
+            for filter in filters:
+                value = filter(value, data, **kw)
+            if value is null and default is not marker:
+                value = default
+            if value is null and required:
+                raise Invalid(node, "required data missing")
+            value = do_deserialize(value, data, kw)
+            if kls is not None:
+                return kls(value)
+            return value
+        return deserialize
+
+    def _compile_do_serializer(self):
+        """return a function ``f(value, data, kw)`` which does the same as ``do_serialize()``.
+        Override this in nodes with sub nodes to inline them."""
+        do_serialize = self.do_serialize
+        return lambda value, data, kw: do_serialize(value, data, **kw)
+
+    def _compile_do_deserializer(self):
+        """return a function ``f(value, data, kw)`` which does the same as ``do_deserialize()``.
+        Override this in nodes with sub nodes to inline them."""
+        do_deserialize = self.do_deserialize
+        return lambda value, data, kw: do_deserialize(value, data, **kw)
+
+    def _compile_filler(self, parent = None):
+        """return a function ``f(target, value, data, kw)`` which deserializes the fields of ``value``
+        directly into the dictionary ``target`` and returns it or ``None`` if this node has no fields
+        which can be deserialized one by one.
+
+        :param parent: the name to record the fields under if a profiled version is compiled
+        """
+        return None
+
+
+class Compiled(object):
+    """the compiled version of a schema node as returned by ``SchemaNode.compile()``. It offers
+    the same ``serialize()`` and ``deserialize()`` interface as the node itself."""
+
+    def __init__(self, node, profiled = False):
+        """compile the given node
+
+        :param profiled: whether to compile a version which records it's calls in the active ``SchemaProfiler``
+        """
+        self.node = node
+        previous = getattr(_compiling, 'profiled', False)
+        _compiling.profiled = profiled
+        try:
+            self._serialize = _compile(node, "serialize")
+            self._deserialize = _compile(node, "deserialize")
+
+            # the serializers and deserializers of the direct sub nodes so fields can be handled one by one
+            label = node.__class__.__name__
+            self.field_serializers = dict([(name, _compile(field, "serialize", label)) for name, field in node._nodes])
+            self.field_deserializers = dict([(name, _compile(field, "deserialize", label)) for name, field in node._nodes])
+
+            # deserializes the fields of a document straight into a dictionary like a record or None
+            self.fill = node._compile_filler(label)
+        finally:
+            _compiling.profiled = previous
+
+    def serialize(self, value = null, data = null, **kw):
+        """serialize data to a data structure for MongoDB, see ``SchemaNode.serialize()``"""
+        if data is null:
+            data = value
+        return self._serialize(value, data, kw)
+
+    def deserialize(self, value = null, data = null, **kw):
+        """deserialize MongoDB data to a python usable data structure, see ``SchemaNode.deserialize()``"""
+        if data is null:
+            data = value
+        return self._deserialize(value, data, kw)
+
 
 class Schema(SchemaNode):
 
@@ -201,6 +400,58 @@ class Schema(SchemaNode):
             return self._mg_class(output)
         return output
 
+    def _compile_do_serializer(self):
+        """inline the serializers of all sub nodes"""
+        if _overrides(self, "do_serialize", Schema):
+            return super(Schema, self)._compile_do_serializer()
+        fields = tuple([(name, _compile(field, "serialize")) for name, field in self._nodes])
+        node = self
+
+        def do_serialize(value, data, kw):
+            output = {}
+            if not fields:
+                return output
+            if value is None:
+                raise ValueError, "node %s is missing from data and no default was given" %node.name
+            get = value.get
+            for name, serialize in fields:
+                output[name] = serialize(get(name, null), data, kw)
+            return output
+        return do_serialize
+
+    def _compile_deserializer(self):
+        """inline the deserializers of all sub nodes. The destination class is looked up on each call
+        as ``Record`` sets it on it's schema after the schema has been created. If it's a plain
+        dictionary class the fields are deserialized directly into a new instance of it."""
+        if _overrides(self, "deserialize", Schema):
+            return super(Schema, self)._compile_deserializer()
+        fill = self._compile_filler()
+        node = self
+
+        def deserialize(value, data, kw):
+            kls = node._mg_class
+            if kls is None:
+                return fill({}, value, data, kw)
+            if fillable(kls):
+                return fill(kls(), value, data, kw)
+            return kls(fill({}, value, data, kw))
+        return deserialize
+
+    def _compile_filler(self, parent = None):
+        """inline the deserializers of all sub nodes into a function storing them in the target. The
+        values are stored with ``dict.__setitem__`` like creating a dictionary from another one does."""
+        if _overrides(self, "deserialize", Schema):
+            return None
+        fields = tuple([(name, _compile(field, "deserialize", parent)) for name, field in self._nodes])
+        setitem = dict.__setitem__
+
+        def fill(target, value, data, kw):
+            get = value.get
+            for name, deserialize in fields:
+                setitem(target, name, deserialize(get(name, null), data, kw))
+            return target
+        return fill
+
 class String(SchemaNode):
     """a string type. """
 
@@ -220,6 +471,10 @@ class String(SchemaNode):
                 return None
         if self.max_length is not None and len(value) > self.max_length:
             raise Invalid(self, "string too long")
+        return self.convert(value)
+
+    def convert(self, value):
+        """convert a value to unicode or to a string in the encoding of the node without checking it's length"""
         try:
             if isinstance(value, unicode):
                 if self.encoding:
@@ -281,20 +536,82 @@ class Date(SchemaNode):
             return value
         return value.date()
 
+_iso8601 = re.compile(r"(\d{4})-(\d\d)-(\d\d)(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6}))?)?(Z|[+-]\d\d(?::?\d\d)?)?)?$")
+_utc = dateutil.tz.tzutc()
+
+def parse_iso8601(value, ignore_tz = False):
+    """parse a string in the ISO-8601 format ``YYYY-MM-DD[(T| )HH:MM[:SS[.ffffff]][Z|+HH:MM]]`` like
+    ``dateutil`` does but a lot faster
+
+    :param ignore_tz: if ``True`` then a time zone is left out instead of being attached to the result
+    :return: the datetime or ``None`` if ``value`` is not in this format
+    """
+    match = _iso8601.match(value)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, tz = match.groups()
+    tzinfo = None
+    if tz is not None and not ignore_tz:
+        if tz == "Z":
+            tzinfo = _utc
+        else:
+            offset = int(tz[1:3]) * 3600 + int(tz[-2:] if len(tz) > 3 else 0) * 60
+            if tz[0] == "-":
+                offset = -offset
+            tzinfo = _utc if offset == 0 else dateutil.tz.tzoffset(None, offset)
+    try:
+        return datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0),
+            int(second or 0), int(fraction.ljust(6, "0")) if fraction else 0, tzinfo)
+    except ValueError:
+        return None
+
 class DateTime(SchemaNode):
     """a datetime type. """
 
-    def __init__(self, ignore_tz = False, *args, **kw):
-        """initialize the datetime object"""
+    def __init__(self, ignore_tz = False, formats = (), cache_size = None, *args, **kw):
+        """initialize the datetime object
+
+        :param ignore_tz: if ``True`` then the time zone of strings is ignored
+        :param formats: a list of ``strptime`` formats which are tried in order for strings which are not
+            in the ISO-8601 format. Only if none of them matches the string is parsed with ``dateutil``.
+        :param cache_size: the number of parsed strings to remember. Use this if the same strings are
+            serialized often. If the cache is full it is emptied. ``None`` means no cache.
+        """
         super(DateTime, self).__init__(*args, **kw)
         self.ignore_tz = ignore_tz
+        self.formats = tuple(formats)
+        self.cache_size = cache_size
+        self._cache = {} if cache_size else None
+
+    def parse(self, value):
+        """convert a string to a datetime object"""
+        cache = self._cache
+        if cache is not None:
+            result = cache.get(value)
+            if result is not None:
+                return result
+        result = parse_iso8601(value, self.ignore_tz)
+        if result is None:
+            for format in self.formats:
+                try:
+                    result = datetime.datetime.strptime(value, format)
+                    break
+                except ValueError:
+                    pass
+        if result is None:
+            result = dateutil.parser.parse(value, ignoretz = self.ignore_tz)
+        if cache is not None:
+            if len(cache) >= self.cache_size:
+                cache.clear()
+            cache[value] = result
+        return result
 
     def do_serialize(self, value, data, **kw):
         # datetime.datetime also returns True for testing datetime.date
 
         # if datetime is a string try to convert it to a datetime object
         if isinstance(value, types.UnicodeType) or isinstance(value, types.StringType):
-            value = dateutil.parser.parse(value, ignoretz = self.ignore_tz)
+            value = self.parse(value)
         if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
             value = datetime.datetime.combine(value, datetime.time())
         elif value is None and not self.required:
@@ -334,12 +651,42 @@ class Dict(SchemaNode):
             return value
 
     def do_deserialize(self, value, data, **kw):
-        """deserialize either into a normal dictionary or into an AttributeMapper allowing dotted notation
+        """deserialize either into a normal dictionary or into an AttributeMapper allowing dotted notation.
+        Sub documents and lists are copied so changing them does not change the raw document a loaded
+        record compares it's fields with.
         """
         if self.dotted:
-            return AttributeMapper(value)
+            return AttributeMapper(snapshot(value))
         else:
-            return dict(value)
+            return snapshot(value)
+
+    def _compile_do_serializer(self):
+        """inline the serializer of the subtype"""
+        if _overrides(self, "do_serialize", Dict):
+            return super(Dict, self)._compile_do_serializer()
+        required = self.required
+        node = self
+
+        if self.subtype is None:
+            def do_serialize(value, data, kw):
+                if value is null:
+                    if required:
+                        raise Invalid(node, "required data missing")
+                    return {}
+                return value
+            return do_serialize
+
+        serialize = _compile(self.subtype, "serialize")
+        def do_serialize(value, data, kw):
+            if value is null:
+                if required:
+                    raise Invalid(node, "required data missing")
+                return {}
+            result = {}
+            for key, item in value.items():
+                result[key] = serialize(item, item, kw)
+            return result
+        return do_serialize
 
 
 class Integer(SchemaNode):
@@ -355,34 +702,30 @@ class Integer(SchemaNode):
         """serialize data"""
         if value is null and not self.required:
             return None
-        try:
-            v = int(value)
-        except Exception, e: 
-            raise Invalid(self, "Value '%s' cannot be serialized: %s" %(value, e))
+        v = self.convert(value)
         if self.min is not None and v < self.min:
             raise Invalid(self, "Value '%s' is too low, minimum value is %s" %(value, self.min))
         if self.max is not None and v > self.max:
             raise Invalid(self, "Value '%s' is too big, maximum value is %s" %(value, self.max))
         return v
 
+    def convert(self, value):
+        """convert a value to an integer without checking ``min`` and ``max``"""
+        try:
+            return int(value)
+        except Exception, e: 
+            raise Invalid(self, "Value '%s' cannot be serialized: %s" %(value, e))
+
 class Float(Integer):
     """a float type. """
 
-    def do_serialize(self, value, data, **kw):
-        """serialize data"""
-        if value is null and not self.required:
-            return None
+    def convert(self, value):
+        """convert a value to a float without checking ``min`` and ``max``"""
         try:
-            v = float(value)
+            return float(value)
         except Exception, e: 
             raise Invalid(self, "Value '%s' cannot be serialized: %s" %(value, e))
 
-        if self.min is not None and v < self.min:
-            raise Invalid(self, "Value '%s' is too low, minimum value is %s" %(value, self.min))
-        if self.max is not None and v > self.max:
-            raise Invalid(self, "Value '%s' is too big, maximum value is %s" %(value, self.max))
-        return v
-
 class Boolean(SchemaNode):
     """an integer type. """
 
@@ -433,3 +776,58 @@ class List(SchemaNode):
             item = self.subtype.deserialize(item, data, **kw)
             result.append(item)
         return result
+
+    def _compile_do_serializer(self):
+        """inline the serializer of the subtype"""
+        if _overrides(self, "do_serialize", List):
+            return super(List, self)._compile_do_serializer()
+        serialize = _compile(self.subtype, "serialize")
+        required = self.required
+        node = self
+
+        def do_serialize(value, data, kw):
+            if value is null:
+                if required:
+                    raise Invalid(node, "required data missing")
+                return []
+            return [serialize(item, data, kw) for item in value]
+        return do_serialize
+
+    def _compile_do_deserializer(self):
+        """inline the deserializer of the subtype"""
+        if _overrides(self, "do_deserialize", List):
+            return super(List, self)._compile_do_deserializer()
+        deserialize = _compile(self.subtype, "deserialize")
+        return lambda value, data, kw: [deserialize(item, data, kw) for item in value]
+
+class Reference(SchemaNode):
+    """a reference to a record of another collection. It's stored as the ``_id`` of the referenced record
+    and deserialized to that id. ``Collection.populate()`` replaces the ids with the records."""
+
+    def __init__(self, target = None, *args, **kw):
+        """initialize the reference
+
+        :param target: the ``Collection`` the referenced records are stored in or a callable returning it.
+            It can also be passed to ``populate()`` instead.
+        """
+        super(Reference, self).__init__(*args, **kw)
+        self.target = target
+
+    def get_target(self):
+        """return the collection of the referenced records or ``None`` if it's unknown"""
+        target = self.target
+        if target is not None and not hasattr(target, "get_many"):
+            target = target()
+        return target
+
+    def do_serialize(self, value, data, **kw):
+        """serialize a record or an id to the id"""
+        if value is null:
+            if self.required:
+                raise Invalid(self, "required data missing")
+            return None
+        if isinstance(value, dict):
+            if value.get("_id") is None:
+                raise Invalid(self, "the referenced record has not been stored yet")
+            return value["_id"]
+        return value
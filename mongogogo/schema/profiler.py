@@ -0,0 +1,189 @@
+"""
+
+profiling of serialization and deserialization by field
+
+While a ``SchemaProfiler`` is enabled ``compile()`` returns versions of the nodes which record the time
+spent in each node and each filter by the path of the field, e.g. ``BarcampSchema.sessions.*.day``.
+Items of a ``List`` and values of a ``Dict`` are denoted by ``*``. Records, collections and everything
+else using ``compile()`` is profiled this way::
+
+    with SchemaProfiler() as profiler:
+        for barcamp in barcamps.find():
+            pass
+    profiler.print_report(limit = 10)
+
+"""
+
+import sys
+import json
+import threading
+from timeit import default_timer
+
+__all__ = ["SchemaProfiler"]
+
+active = None # the enabled SchemaProfiler
+
+
+def wrap_node(node, kind, func, parent = None):
+    """return a function calling the compiled serializer or deserializer ``func`` of ``node`` which is
+    timed by the active profiler
+
+    :param kind: ``serialize`` or ``deserialize``
+    :param parent: the name of the schema ``node`` belongs to if it's compiled as a single field
+    """
+    name = node.name
+    if name is not None and parent is not None:
+        name = "%s.%s" %(parent, name)
+    label = node.__class__.__name__
+    def profiled(value, data, kw):
+        profiler = active
+        if profiler is None:
+            return func(value, data, kw)
+        return profiler.call_node(name, label, kind, func, value, data, kw)
+    return profiled
+
+def wrap_filter(filter, kind):
+    """return a function calling ``filter`` which is timed by the active profiler
+
+    :param kind: ``on_serialize`` or ``on_deserialize``
+    """
+    name = getattr(filter, "__name__", None) or filter.__class__.__name__
+    def profiled(value, data, **kw):
+        profiler = active
+        if profiler is None:
+            return filter(value, data, **kw)
+        return profiler.call_filter(name, kind, filter, value, data, kw)
+    return profiled
+
+
+class PathStats(object):
+    """the calls and timings of a node or filter at one path"""
+
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.calls = 0
+        self.total = 0.0 # the time including sub nodes and filters
+        self.own = 0.0 # the time without sub nodes and filters
+
+    def as_dict(self):
+        """return the stats as dictionary"""
+        return dict(path = self.path, kind = self.kind, calls = self.calls, total = self.total, own = self.own)
+
+
+class SchemaProfiler(object):
+    """collects the calls and timings of the compiled serializers and deserializers of schema nodes and
+    their ``on_serialize`` and ``on_deserialize`` filters by field path. Use it as context manager or call
+    ``enable()`` and ``disable()``. Only one profiler can be enabled at a time.
+
+    Only serializers which are looked up with ``compile()`` while the profiler is enabled are profiled.
+    Calling ``serialize()`` or ``deserialize()`` of a node directly is not.
+    """
+
+    def __init__(self, clock = default_timer):
+        """initialize the profiler
+
+        :param clock: the function to use for retrieving the current time
+        """
+        self.clock = clock
+        self.stats = {} # PathStats by (path, kind)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self):
+        """make this the active profiler"""
+        global active
+        active = self
+
+    def disable(self):
+        """stop profiling"""
+        global active
+        if active is self:
+            active = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disable()
+
+    def reset(self):
+        """remove all stats"""
+        with self._lock:
+            self.stats.clear()
+
+    def _stack(self):
+        """return the stack of ``[path, time of children]`` entries of the running calls of this thread"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def call_node(self, name, label, kind, func, value, data, kw):
+        """call the compiled function of a node named ``name`` and record it under the path of the node.
+        A node without a name is recorded as ``label`` if it's the outermost one and as ``*`` otherwise."""
+        stack = self._stack()
+        if not stack:
+            path = name or label
+        elif name is None:
+            path = stack[-1][0] + ".*"
+        else:
+            path = "%s.%s" %(stack[-1][0], name)
+        return self._timed(stack, path, kind, func, (value, data, kw), {})
+
+    def call_filter(self, name, kind, filter, value, data, kw):
+        """call a filter and record it under the path of it's node followed by it's name"""
+        stack = self._stack()
+        path = "%s:%s" %(stack[-1][0] if stack else "", name)
+        return self._timed(stack, path, kind, filter, (value, data), kw)
+
+    def _timed(self, stack, path, kind, func, args, kw):
+        """call ``func`` and add it's timings to the stats of ``path``"""
+        frame = [path, 0.0]
+        stack.append(frame)
+        clock = self.clock
+        start = clock()
+        try:
+            return func(*args, **kw)
+        finally:
+            elapsed = clock() - start
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            with self._lock:
+                stats = self.stats.get((path, kind))
+                if stats is None:
+                    stats = self.stats[(path, kind)] = PathStats(path, kind)
+                stats.calls += 1
+                stats.total += elapsed
+                stats.own += elapsed - frame[1]
+
+    def entries(self, sort = "own"):
+        """return the stats as list of dictionaries sorted descending by ``sort`` which is one of ``own``,
+        ``total`` or ``calls``"""
+        with self._lock:
+            entries = [stats.as_dict() for stats in self.stats.values()]
+        entries.sort(key = lambda entry: (-entry[sort], entry['path']))
+        return entries
+
+    def report(self, sort = "own", limit = None):
+        """return a table of the stats as string, see ``entries()``
+
+        :param limit: the maximum number of rows
+        """
+        lines = ["%12s %12s %10s %12s  %-14s %s" %("own (ms)", "total (ms)", "calls", "per call (us)", "kind", "path")]
+        for entry in self.entries(sort)[:limit]:
+            lines.append("%12.3f %12.3f %10d %12.3f  %-14s %s" %(entry['own'] * 1000, entry['total'] * 1000,
+                entry['calls'], entry['own'] / entry['calls'] * 1000000, entry['kind'], entry['path']))
+        return "\n".join(lines)
+
+    def print_report(self, sort = "own", limit = None, stream = None):
+        """print the report to ``stream`` which defaults to ``sys.stdout``"""
+        stream = stream or sys.stdout
+        stream.write(self.report(sort, limit) + "\n")
+
+    def save(self, filename, sort = "own"):
+        """write the stats to ``filename`` as JSON list of the entries"""
+        with open(filename, "w") as f:
+            json.dump(self.entries(sort), f, indent = 2)
@@ -0,0 +1,85 @@
+from mongogogo.schema import *
+from conftest import TestSchema1, TestSchema12
+import pytest
+import datetime
+
+class MyDict(dict):
+    """custom dict for testing"""
+
+def test_compile_is_cached(schema1):
+    assert schema1.compile() is schema1.compile()
+
+def test_compiled_serialize_ok(schema1):
+    data = {'not_required' : 'n/a',
+         'required' : 'Required'}
+    assert schema1.compile().serialize(data) == schema1.serialize(data)
+
+def test_compiled_serialize_with_missing(schema1):
+    res = schema1.compile().serialize({'required' : 'Required'})
+    assert res['not_required'] is null
+    assert res['with_default'] == "default"
+
+def test_compiled_serialize_required_missing(schema1):
+    pytest.raises(Invalid, schema1.compile().serialize, {'not_required' : 'Required'})
+
+def test_compiled_serialize_submapping(schema2):
+    data = {
+        'bio2' : {
+            'name' : 'Foo',
+            'url' : 'http://example.com',
+        },
+    }
+    res = schema2.compile().serialize(data)
+    assert res == schema2.serialize(data)
+    assert res['bio1']['name'] == "foobar"
+    pytest.raises(Invalid, schema2.compile().serialize, {'bio1' : {}})
+
+def test_compiled_list_and_defaults():
+    schema = TestSchema12()
+    data = {
+        'name' : 'foo',
+        'links' : [{'url' : 'http://example.com'}, {'description' : 'bar'}],
+    }
+    res = schema.compile().serialize(data)
+    assert res == schema.serialize(data)
+    assert res['permissions'] == []
+    assert res['links'][1]['url'] is null
+
+def test_compiled_dict_subtype():
+
+    class DictSchema(Schema):
+        values = Dict(Integer())
+        raw = Dict()
+
+    schema = DictSchema()
+    res = schema.compile().serialize({'values' : {'a' : "1", 'b' : 2}})
+    assert res['values'] == {'a' : 1, 'b' : 2}
+    assert res['raw'] == {}
+
+def test_compiled_deserialize_to_class():
+
+    class NameSchema(Schema):
+        name = String()
+
+    class NamesSchema(Schema):
+        names = List(NameSchema(kls=MyDict))
+        created = Date()
+
+    names = NamesSchema(kls=MyDict)
+    data = {'names' : [{'name' : 'one'}, {'name' : 'two'}], 'created' : datetime.date(2012, 3, 17)}
+    res = names.compile().deserialize(names.compile().serialize(data))
+    assert isinstance(res, MyDict)
+    assert isinstance(res['names'][1], MyDict)
+    assert res['names'][1]['name'] == "two"
+    assert res['created'] == datetime.date(2012, 3, 17)
+
+def test_compiled_uses_overridden_do_serialize():
+
+    class Upper(String):
+        def do_serialize(self, value, data, **kw):
+            return value.upper()
+
+    class UpperSchema(Schema):
+        name = Upper()
+
+    assert UpperSchema().compile().serialize({'name' : 'foo'})['name'] == "FOO"
@@ -84,3 +84,31 @@ def test_fillin_defaults_in_subsubschema():
     assert data['sub1']['test_list'][0]['empty'] == ""
 
 
+
+
+def test_compiled_deserialize_fills_class():
+
+    class Constructed(dict):
+        """a class which does more than copying in it's constructor"""
+        def __init__(self, data):
+            super(Constructed, self).__init__(data)
+            self.constructed = True
+
+    class NameSchema(Schema):
+        name = String()
+
+    class NamesSchema(Schema):
+        first = NameSchema(kls = MyDict)
+        second = NameSchema(kls = Constructed)
+
+    names = NamesSchema()
+    res = names.compile().deserialize({'first' : {'name' : 'one'}, 'second' : {'name' : 'two'}})
+    assert isinstance(res['first'], MyDict)
+    assert res['first'] == {'name' : 'one'}
+    assert res['second'].constructed
+    assert res['second']['name'] == 'two'
+
+    target = MyDict()
+    assert names.compile().fill(target, {'first' : {'name' : 'one'}, 'second' : {}}, None, {}) is target
+    assert target['first']['name'] == 'one'
+    assert target['second']['name'] is None
@@ -94,3 +94,18 @@ def test_underscore_mapping(underscoreschema):
     data = {'_name' : 'foobar'}
     res = underscoreschema.serialize(data)
     assert res['_name'] == "foobar"
+
+def test_nodes_in_declaration_order():
+    from mongogogo.schema import Schema, String, Integer
+
+    class OrderedSchema(Schema):
+        zeta = String()
+        alpha = Integer()
+        mu = String()
+
+    assert [name for name, node in OrderedSchema()._nodes] == ["zeta", "alpha", "mu"]
+
+def test_nodes_shared_per_class(schema1, subschema1):
+    from conftest import TestSchema1
+    assert TestSchema1()._nodes is schema1._nodes
+    assert [name for name, node in subschema1._nodes] == ["not_required", "required", "with_default", "name2"]
@@ -0,0 +1,57 @@
+from mongogogo.schema import *
+from conftest import TestSchema12
+import StringIO
+import json
+
+class Clock(object):
+    now = 0
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+def test_profiled_paths():
+    schema = TestSchema12()
+    data = {
+        'name' : 'foo',
+        'links' : [{'url' : 'http://example.com'}, {'description' : 'bar'}],
+    }
+    with SchemaProfiler() as profiler:
+        res = schema.compile().serialize(data)
+        schema.compile().deserialize(res)
+    assert res == schema.serialize(data)
+    stats = dict([((entry['path'], entry['kind']), entry) for entry in profiler.entries()])
+    assert stats[('TestSchema12', 'serialize')]['calls'] == 1
+    assert stats[('TestSchema12.links.*.url', 'serialize')]['calls'] == 2
+    assert stats[('TestSchema12.links.*.url', 'deserialize')]['calls'] == 2
+    assert stats[('TestSchema12.permissions:Default', 'on_serialize')]['calls'] == 1
+    assert stats[('TestSchema12.bio:Default', 'on_serialize')]['calls'] == 1
+
+def test_own_time():
+    schema = TestSchema12()
+    profiler = SchemaProfiler(clock = Clock())
+    with profiler:
+        schema.compile().serialize({'name' : 'foo'})
+    stats = dict([(entry['path'], entry) for entry in profiler.entries()])
+    root = stats['TestSchema12']
+    assert root['own'] < root['total']
+    assert sum([entry['own'] for entry in stats.values()]) == root['total']
+
+def test_disabled():
+    schema = TestSchema12()
+    profiler = SchemaProfiler()
+    with profiler:
+        compiled = schema.compile()
+    assert schema.compile() is not compiled
+    compiled.serialize({'name' : 'foo'})
+    assert profiler.entries() == []
+
+def test_report(tmpdir):
+    schema = TestSchema12()
+    with SchemaProfiler() as profiler:
+        schema.compile().serialize({'name' : 'foo'})
+    out = StringIO.StringIO()
+    profiler.print_report(sort = "calls", limit = 3, stream = out)
+    assert len(out.getvalue().splitlines()) == 4
+    filename = str(tmpdir.join("profile.json"))
+    profiler.save(filename)
+    assert len(json.load(open(filename))) == len(profiler.stats)
@@ -1,6 +1,8 @@
 from mongogogo.schema import *
 import pytest
 import datetime
+import dateutil.parser
+from mongogogo.schema.nodes import parse_iso8601
 
 def test_datetime():
     s = DateTime()
@@ -8,6 +10,30 @@ def test_datetime():
     assert v <= datetime.datetime.utcnow()
     assert isinstance(v, datetime.datetime)
 
+def test_datetime_iso8601():
+    s = DateTime()
+    for value in ["2012-03-17T18:02:05.25+01:30", "2012-03-17 18:02", "2012-03-17", "2012-03-17T18:02:05Z",
+            "2012-03-17T18:02:05-0500"]:
+        assert parse_iso8601(value) == dateutil.parser.parse(value)
+        assert s.serialize(value) == dateutil.parser.parse(value)
+    assert s.serialize(u"2012-03-17T18:02:05.25") == datetime.datetime(2012, 3, 17, 18, 2, 5, 250000)
+    assert parse_iso8601("2012-03-17T18:02:05+01:00", ignore_tz = True).tzinfo is None
+    assert parse_iso8601("17.03.2012") is None
+    assert parse_iso8601("2012-02-30") is None
+
+def test_datetime_formats():
+    s = DateTime(formats = ["%d/%m/%Y", "%d.%m.%Y %H:%M"])
+    assert s.serialize("17.03.2012 18:02") == datetime.datetime(2012, 3, 17, 18, 2)
+    assert s.serialize("March 17 2012") == datetime.datetime(2012, 3, 17)
+
+def test_datetime_cache():
+    s = DateTime(cache_size = 2)
+    v = s.serialize("2012-03-17")
+    assert s.serialize("2012-03-17") is v
+    s.serialize("2012-03-18")
+    s.serialize("2012-03-19")
+    assert len(s._cache) == 1
+
 def test_date():
     s = Date()
     v = s.serialize(datetime.date(2012, 3, 17))
@@ -28,6 +28,17 @@ class Invalid(Exception):
         return "<%s: %s in %s>" %(self.__class__.__name__, self.msg, self.node.name)
 
 
+def snapshot(value):
+    """return a copy of a raw value from the database which shares no sub documents or lists with it.
+    Nodes use it to deserialize values which can be changed in place and records to remember what they
+    stored, so changes made in place to sub documents or lists are not made to the raw value as well."""
+    if isinstance(value, dict):
+        return dict([(key, snapshot(item)) for key, item in value.iteritems()])
+    if isinstance(value, list):
+        return [snapshot(item) for item in value]
+    return value
+
+
 class AttributeMapper(dict):
     """a dictionary like object which also is accessible via getattr/setattr"""
 
@@ -0,0 +1,46 @@
+import datetime
+from conftest import Person
+from mongogogo import Schema, String, Integer, DateTime, Pipeline
+from mongogogo.cursor import Cursor
+
+class AgeGroup(Schema):
+    count = Integer()
+    first = DateTime()
+    names = String()
+
+def fill(persons):
+    for i in range(6):
+        persons.put(Person(firstname = "Foo%s" %i, age = 20 + i % 2,
+            creation = datetime.datetime(2012, 1, i + 1)))
+
+def test_pipeline_builder():
+    pipeline = Pipeline().match(Person.q.age > 20).group("$age", count = {'$sum' : 1}) \
+        .sort("-count", "_id").limit(3).unwind("tags").project("a", b = "$c")
+    assert pipeline[0] == {'$match' : {'age' : {'$gt' : 20}}}
+    assert pipeline[1] == {'$group' : {'_id' : "$age", 'count' : {'$sum' : 1}}}
+    assert pipeline[2]['$sort'].items() == [("count", -1), ("_id", 1)]
+    assert pipeline[3] == {'$limit' : 3}
+    assert pipeline[4] == {'$unwind' : "$tags"}
+    assert pipeline[5] == {'$project' : {'a' : 1, 'b' : "$c"}}
+
+def test_records(persons):
+    fill(persons)
+    cursor = persons.aggregate(Pipeline().match({'age' : 21}).sort("firstname"))
+    assert isinstance(cursor, Cursor)
+    result = list(cursor)
+    assert [p.firstname for p in result] == ["Foo1", "Foo3", "Foo5"]
+    assert isinstance(result[0], Person)
+    assert result[0]._collection is persons
+
+def test_raw(persons):
+    fill(persons)
+    result = list(persons.aggregate([{'$group' : {'_id' : "$age", 'count' : {'$sum' : 1}}}], allow_disk_use = True))
+    assert sorted([(doc['_id'], doc['count']) for doc in result]) == [(20, 3), (21, 3)]
+    assert type(result[0]) == dict
+
+def test_result_schema(persons):
+    fill(persons)
+    pipeline = Pipeline().group("$age", count = {'$sum' : 1}, first = {'$min' : "$creation"}).sort("_id")
+    result = list(persons.aggregate(pipeline, result_schema = AgeGroup(), batch_size = 1))
+    assert result[0] == {'_id' : 20, 'count' : 3, 'first' : datetime.datetime(2012, 1, 1), 'names' : None}
+    assert result[1]['first'] == datetime.datetime(2012, 1, 2)
@@ -0,0 +1,231 @@
+import py.test
+tornado = py.test.importorskip("tornado")
+
+from itertools import islice
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from conftest import Person, Persons
+from mongogogo import ObjectNotFound, NotSupported, Invalid, Record, Collection, Schema, Integer, String, List, Reference
+from mongogogo.asynchronous import AsyncCollection
+
+def resolved(value):
+    f = Future()
+    f.set_result(value)
+    return f
+
+class FakeCursor(object):
+    """a Motor like cursor on top of a blocking cursor"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, n):
+        self.cursor.limit(abs(n))
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def to_list(self, length):
+        if length is None:
+            return resolved(list(self.cursor))
+        return resolved(list(islice(self.cursor, length)))
+
+class FakeMotorCollection(object):
+    """a Motor like collection on top of a blocking collection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return FakeCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return FakeCursor(self.collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        return lambda *args, **kwargs: resolved(method(*args, **kwargs))
+
+class AsyncPersons(AsyncCollection):
+    data_class = Person
+    offload_threshold = 5
+
+    def after_put(self, obj):
+        obj.stored = True
+
+def pytest_funcarg__apersons(request):
+    db = request.getfuncargvalue("db")
+    return AsyncPersons(FakeMotorCollection(db.persons))
+
+def run(f):
+    return IOLoop.current().run_sync(f)
+
+def test_put_and_get(apersons):
+    @gen.coroutine
+    def f():
+        p = yield apersons.put(Person(firstname = "Foo"))
+        assert p.stored
+        assert p._id is not None
+        p2 = yield apersons.get(p._id)
+        assert p2.firstname == "Foo"
+        assert p2.lastname == "foobar"
+        p2.age = 42
+        yield apersons.put(p2)
+        p3 = yield apersons.get(str(p._id))
+        assert p3.age == 42
+        yield apersons.remove(p3)
+        try:
+            yield apersons.get(p._id)
+        except ObjectNotFound:
+            pass
+        else:
+            assert False
+    run(f)
+
+def test_find(apersons):
+    @gen.coroutine
+    def f():
+        for i in range(12):
+            yield apersons.put(Person(firstname = "Foo%s" %i, age = i))
+        cursor = apersons.find({'age' : {'$gte' : 2}}).sort("age", 1)
+        ages = []
+        while (yield cursor.fetch_next):
+            ages.append(cursor.next_object().age)
+        assert ages == range(2, 12)
+        # large batches go through the executor
+        records = yield apersons.find().batch_size(10).to_list()
+        assert len(records) == 12
+        assert records[0]._collection is apersons
+        person = yield apersons.find_one({'age' : 3})
+        assert person.firstname == "Foo3"
+        assert (yield apersons.find_one({'age' : 99})) is None
+        many = yield apersons.get_many([records[1]._id, records[0]._id, "missing"], missing = 'none')
+        assert [p and p.age for p in many] == [records[1].age, records[0].age, None]
+    run(f)
+
+def test_put_many_and_aggregate(apersons):
+    @gen.coroutine
+    def f():
+        result = yield apersons.put_many([Person(firstname = "Foo%s" %i, age = i) for i in range(5)], batch_size = 2)
+        assert result.ok
+        assert len(result.records) == 5
+        assert result.records[0].stored
+        cursor = apersons.aggregate([{'$match' : {'age' : {'$gte' : 3}}}, {'$sort' : {'age' : 1}}])
+        records = yield cursor.to_list()
+        assert [p.age for p in records] == [3, 4]
+        assert isinstance(records[0], Person)
+        groups = yield apersons.aggregate([{'$group' : {'_id' : None, 'total' : {'$sum' : "$age"}}}]).to_list()
+        assert groups == [{'_id' : None, 'total' : 10}]
+    run(f)
+
+def test_queries(apersons):
+    @gen.coroutine
+    def f():
+        for i in range(5):
+            yield apersons.put(Person(firstname = "Foo%s" %i, age = i))
+        assert (yield apersons.count()) == 5
+        assert (yield apersons.count(Person.q.age >= 3)) == 2
+        assert (yield apersons.exists({'age' : 4}))
+        assert not (yield apersons.exists({'age' : 99}))
+        assert sorted((yield apersons.distinct("age"))) == range(5)
+    run(f)
+
+def test_updates(apersons):
+    @gen.coroutine
+    def f():
+        for i in range(5):
+            yield apersons.put(Person(firstname = "Foo%s" %i, age = i))
+        result = yield apersons.update({'age' : {'$lt' : 2}}, {'$inc' : {'age' : 10}}, multi = True)
+        assert result.modified_count == 2
+        p = yield apersons.find_one({'age' : 4})
+        p = yield apersons.update_record(p, {'$inc' : {'age' : 1}}, refresh = True)
+        assert p.age == 5
+        p = yield apersons.update_record(p, {'$set' : {'firstname' : u"Bar"}})
+        assert p.firstname == "Foo4"
+        assert (yield apersons.exists({'firstname' : u"Bar"}))
+        p._id = "missing"
+        try:
+            yield apersons.update_record(p, {'$inc' : {'age' : 1}})
+        except ObjectNotFound:
+            pass
+        else:
+            assert False
+    run(f)
+
+class CounterSchema(Schema):
+    visits = Integer(max = 2)
+
+class Counter(Record):
+    schema = CounterSchema()
+
+class AsyncCounters(AsyncCollection):
+    data_class = Counter
+
+def test_update_record_out_of_range(db):
+    counters = AsyncCounters(FakeMotorCollection(db.persons))
+    @gen.coroutine
+    def f():
+        counter = yield counters.put(Counter(visits = 2))
+        try:
+            yield counters.update_record(counter, {'$inc' : {'visits' : 1}})
+        except Invalid:
+            pass
+        else:
+            assert False
+    run(f)
+
+def test_paginate(apersons):
+    @gen.coroutine
+    def f():
+        for i in range(5):
+            yield apersons.put(Person(firstname = "Foo%s" %i, age = i))
+        page = yield apersons.paginate(sort = [('age', 1)], page_size = 2)
+        assert [p.age for p in page] == [0, 1]
+        page = yield apersons.paginate(sort = [('age', 1)], page_size = 2, after = page.next)
+        assert [p.age for p in page] == [2, 3]
+        page = yield apersons.paginate(sort = [('age', 1)], page_size = 2, before = page.previous)
+        assert [p.age for p in page] == [0, 1]
+    run(f)
+
+class TeamSchema(Schema):
+    name = String()
+    members = List(Reference())
+
+class Team(Record):
+    schema = TeamSchema()
+
+class AsyncTeams(AsyncCollection):
+    data_class = Team
+
+class Teams(Collection):
+    data_class = Team
+
+def test_populate(db, apersons):
+    teams = AsyncTeams(FakeMotorCollection(db.barcamps))
+    @gen.coroutine
+    def f():
+        foo = yield apersons.put(Person(firstname = "Foo"))
+        bar = yield apersons.put(Person(firstname = "Bar"))
+        yield teams.put(Team(name = u"team", members = [foo, bar]))
+        team = yield teams.find_one()
+        populated = yield teams.populate([team], "members", members = apersons)
+        assert [p.firstname for p in populated[0].members] == ["Foo", "Bar"]
+        records = yield teams.find().populate("members", members = apersons).to_list()
+        assert [p.firstname for p in records[0].members] == ["Foo", "Bar"]
+        # blocking collections cannot wait for the asynchronous target
+        py.test.raises(ValueError, Teams(db.barcamps).populate, list(Teams(db.barcamps).find()),
+            "members", members = apersons)
+        # but asynchronous collections can use blocking targets
+        team = yield teams.find_one()
+        yield teams.populate([team], "members", members = Persons(db.persons))
+        assert team.members[1].firstname == "Bar"
+    run(f)
+
+def test_buffered_not_supported():
+    py.test.raises(NotSupported, AsyncPersons(None).buffered)
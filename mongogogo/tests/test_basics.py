@@ -1,6 +1,7 @@
 import pytest
 import datetime
 from conftest import Person
+from mongogogo import ObjectNotFound
 
 def test_add(db, persons):
     p = persons.data_class(firstname="Foo", lastname="Bar")
@@ -131,3 +132,27 @@ def test_initialize_with_doc(db, persons):
     p2 = persons[p._id]
     assert p2.firstname == "Foo"
 
+def test_get_many(db, persons):
+    ids = []
+    for i in range(1,6):
+        p = persons.data_class(firstname="Foo%s" %i, lastname="Bar%s" %i)
+        persons.save(p)
+        ids.append(p._id)
+    ids.reverse()
+    res = persons.get_many(ids + [ids[0]], chunk_size = 2)
+    assert [p.firstname for p in res] == ["Foo5", "Foo4", "Foo3", "Foo2", "Foo1", "Foo5"]
+    assert res[0] is res[-1]
+
+def test_get_many_missing(db, persons):
+    p = persons.data_class(firstname="Foo", _id=u"cs")
+    persons.save(p)
+    assert len(persons.get_many([u"cs", u"missing"])) == 1
+    assert persons.get_many([u"missing", u"cs"], missing = 'none')[0] is None
+    pytest.raises(ObjectNotFound, persons.get_many, [u"cs", u"missing"], missing = 'raise')
+
+def test_get_many_converts_objectids(db, persons):
+    p = persons.data_class(firstname="Foo")
+    persons.save(p)
+    assert persons.get_many([str(p._id)])[0].firstname == "Foo"
+    assert persons.get(str(p._id)).firstname == "Foo"
+
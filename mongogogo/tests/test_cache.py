@@ -0,0 +1,77 @@
+"""
+
+tests for caching records by id
+
+"""
+
+from mongogogo.cache import RecordCache
+from conftest import Persons
+
+class Clock(object):
+    now = 0
+    def __call__(self):
+        return self.now
+
+def test_cache_lru():
+    cache = RecordCache(maxsize = 2)
+    cache.put(1, "a")
+    cache.put(2, "b")
+    assert cache.get(1) == "a"
+    cache.put(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+def test_cache_ttl():
+    clock = Clock()
+    cache = RecordCache(ttl = 10, clock = clock)
+    cache.put(1, "a")
+    clock.now = 9
+    assert cache.get(1) == "a"
+    clock.now = 10
+    assert cache.get(1) is None
+    assert 1 not in cache
+
+def test_cache_invalidate():
+    cache = RecordCache()
+    cache.put(1, "a")
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    cache.put(1, "a")
+    cache.clear()
+    assert len(cache) == 0
+
+def test_get_cached(db):
+    cache = RecordCache()
+    persons = Persons(db.persons, cache = cache)
+    p = persons.data_class(firstname = "Foo", _id = u"cs")
+    persons.save(p)
+    p1 = persons.get(u"cs")
+    assert persons.get(u"cs") is p1
+    assert persons.get_many([u"cs"])[0] is p1
+    assert cache.hits == 2
+    db.persons.update_one({'_id' : u'cs'}, {'$set' : {'firstname' : u'Changed'}})
+    assert persons.get(u"cs").firstname == "Foo"
+
+def test_cache_invalidated_on_put_and_remove(db):
+    cache = RecordCache()
+    persons = Persons(db.persons, cache = cache)
+    p = persons.data_class(firstname = "Foo", _id = u"cs")
+    persons.save(p)
+    p1 = persons.get(u"cs")
+    p1.firstname = "Bar"
+    persons.save(p1)
+    assert u"cs" not in cache
+    assert persons.get(u"cs").firstname == "Bar"
+    persons.remove(p1)
+    assert u"cs" not in cache
+
+def test_identity_map(db, persons):
+    p = persons.data_class(firstname = "Foo", _id = u"cs")
+    persons.save(p)
+    with persons.identity_map():
+        p1 = persons.get(u"cs")
+        assert persons.get(u"cs") is p1
+    assert persons.get(u"cs") is not p1
@@ -0,0 +1,53 @@
+import py.test
+import datetime
+from conftest import Person
+from mongogogo import Record, Collection, Schema, String, Date, List
+
+class EventSchema(Schema):
+    title = String()
+    day = Date()
+    days = List(Date())
+
+class Event(Record):
+    schema = EventSchema()
+    created = 0
+
+    def after_load(self):
+        Event.created += 1
+
+class Events(Collection):
+    data_class = Event
+
+def fill(persons):
+    for i in range(5):
+        persons.put(Person(firstname = "Foo%s" %i, age = 20 + i % 2))
+
+def test_count(persons):
+    fill(persons)
+    assert persons.count() == 5
+    assert persons.count({'age' : 21}) == 2
+    assert persons.count(Person.q.age == 20) == 3
+    assert persons.count(limit = 2) == 2
+
+def test_exists(persons):
+    fill(persons)
+    person = persons.find_one({'firstname' : "Foo1"})
+    assert persons.exists({'age' : 21})
+    assert not persons.exists(Person.q.age > 21)
+    assert persons.exists(person._id)
+    assert persons.exists(str(person._id))
+    assert not persons.exists("missing")
+
+def test_distinct(db):
+    events = Events(db.persons)
+    for i in range(4):
+        events.put(Event(title = u"t%s" %(i % 2), day = datetime.date(2012, 1, 1 + i % 2),
+            days = [datetime.date(2012, 2, 1), datetime.date(2012, 2, 1 + i)]))
+    Event.created = 0
+    assert sorted(events.distinct("title")) == [u"t0", u"t1"]
+    assert sorted(events.distinct("day")) == [datetime.date(2012, 1, 1), datetime.date(2012, 1, 2)]
+    assert len(events.distinct("days")) == 4
+    assert type(events.distinct("days")[0]) == datetime.date
+    assert events.distinct("day", Event.q.title == "t1") == [datetime.date(2012, 1, 2)]
+    assert Event.created == 0
+    py.test.raises(ValueError, events.distinct, "unknown")
@@ -0,0 +1,90 @@
+from conftest import Person, Persons
+from mongogogo.cursor import Cursor
+
+def fill(persons, n = 10):
+    for i in range(n):
+        persons.put(Person(firstname = "Foo%s" %i, age = i))
+
+def test_batches(persons):
+    fill(persons)
+    batches = []
+    class Counting(Person):
+        @classmethod
+        def from_db_batch(cls, docs, collection = None, **kw):
+            batches.append(len(docs))
+            return super(Counting, cls).from_db_batch(docs, collection = collection, **kw)
+    cursor = Cursor(persons, wrap = Counting, sort = [('age', 1)]).batch_size(4)
+    result = list(cursor)
+    assert [p.age for p in result] == range(10)
+    assert batches == [4, 4, 2]
+    assert isinstance(result[0], Counting)
+    assert result[0]._collection is persons
+    assert result[0]._mg_dirty == set()
+
+def test_chaining(persons):
+    fill(persons)
+    cursor = persons.find({'age' : {'$gte' : 2}})
+    assert cursor.sort("age", -1).skip(1).limit(3) is cursor
+    assert [p.age for p in cursor] == [8, 7, 6]
+    assert cursor.count() == 8
+
+def test_getitem(persons):
+    fill(persons)
+    person = persons.find().sort("age", 1)[3]
+    assert isinstance(person, Person)
+    assert person.age == 3
+    assert person._collection is persons
+    assert [p.age for p in persons.find().sort("age", 1)[2:4]] == [2, 3]
+
+def test_rewind_and_clone(persons):
+    fill(persons, 3)
+    cursor = persons.find().sort("age", 1)
+    assert len(list(cursor)) == 3
+    assert len(list(cursor.rewind())) == 3
+    assert [p.age for p in cursor.clone()] == [0, 1, 2]
+
+def test_custom_init(persons):
+    fill(persons, 3)
+    class Custom(Person):
+        def __init__(self, *args, **kwargs):
+            super(Custom, self).__init__(*args, **kwargs)
+            self.extra = 1
+    assert [p.extra for p in Cursor(persons, wrap = Custom)] == [1, 1, 1]
+
+def test_unwrapped(persons):
+    fill(persons, 2)
+    docs = list(Cursor(persons, {'age' : 1}))
+    assert type(docs[0]) == dict
+    assert docs[0]['firstname'] == "Foo1"
+
+from bson import BSON, CodecOptions
+
+class RawCollection(object):
+    full_name = "db.persons"
+    codec_options = CodecOptions()
+    def find_raw_batches(self, *args, **kwargs):
+        return RawBatches([[{'_id' : i, 'firstname' : u"Foo%s" %i, 'age' : i} for i in range(j, j+2)] for j in (0, 2)])
+
+class RawBatches(list):
+    collection = RawCollection()
+    def __init__(self, batches):
+        list.__init__(self, ["".join([BSON.encode(doc) for doc in batch]) for batch in batches])
+        self.it = iter(self)
+    def next(self):
+        return self.it.next()
+
+def test_raw_batches():
+    persons = Persons(RawCollection())
+    result = list(Cursor(persons, wrap = Person, raw_batches = True))
+    assert [p.age for p in result] == [0, 1, 2, 3]
+    assert result[3]._id == 3
+
+def test_raw_batches_metrics():
+    from mongogogo.metrics import Metrics
+    metrics = Metrics()
+    persons = Persons(RawCollection(), metrics = metrics)
+    assert len(list(Cursor(persons, wrap = Person, raw_batches = True))) == 4
+    stats = metrics.snapshot()["db.persons"]["iterate"]
+    assert stats['count'] == 3 # the last one finds no batch
+    assert stats['documents'] == 4
+    assert stats['bytes'] == sum([len(batch) for batch in RawCollection().find_raw_batches()])
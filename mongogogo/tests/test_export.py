@@ -0,0 +1,61 @@
+"""
+
+tests for exporting collections
+
+"""
+
+import gzip
+from StringIO import StringIO
+from bson import json_util, decode_all
+from mongogogo.export import Exporter
+
+def fill(persons, n):
+    for i in range(n):
+        p = persons.data_class(firstname = "Foo%s" %i, _id = u"%03d" %i)
+        persons.save(p)
+
+def test_export_ndjson(db, persons):
+    fill(persons, 5)
+    f = StringIO()
+    stats = Exporter(persons, batch_size = 2).export(f)
+    lines = f.getvalue().splitlines()
+    assert stats.count == 5
+    assert stats.last_id == u"004"
+    assert [json_util.loads(line)['firstname'] for line in lines] == ["Foo%s" %i for i in range(5)]
+
+def test_export_bson(db, persons):
+    fill(persons, 3)
+    f = StringIO()
+    Exporter(persons, format = "bson").export(f, spec = {'firstname' : {'$ne' : "Foo1"}})
+    assert [doc['_id'] for doc in decode_all(f.getvalue())] == [u"000", u"002"]
+
+def test_export_reserialize(db, persons):
+    fill(persons, 1)
+    db.persons.update_one({'_id' : u'000'}, {'$set' : {'age' : "17", 'extra' : 1}})
+    f = StringIO()
+    Exporter(persons, reserialize = True).export(f)
+    doc = json_util.loads(f.getvalue())
+    assert doc['age'] == 17
+    assert 'extra' not in doc
+
+def test_export_resume_gzip(db, persons, tmpdir):
+    fill(persons, 3)
+    path = str(tmpdir.join("persons.ndjson.gz"))
+    exporter = Exporter(persons, batch_size = 1, compression = "gzip")
+    exporter.export(path)
+    fill(persons, 5)
+    stats = exporter.export(path, resume = True)
+    assert stats.count == 2
+    lines = gzip.GzipFile(path).read().splitlines()
+    assert [json_util.loads(line)['_id'] for line in lines] == [u"%03d" %i for i in range(5)]
+
+def test_export_resume_without_offset(db, persons, tmpdir):
+    fill(persons, 3)
+    path = str(tmpdir.join("persons.ndjson"))
+    exporter = Exporter(persons, batch_size = 1)
+    exporter.export(path)
+    tmpdir.join("persons.ndjson.checkpoint").write(json_util.dumps({'last_id' : u"002", 'count' : 3, 'offset' : None}))
+    stats = exporter.export(path, resume = True)
+    assert stats.count == 3
+    lines = open(path).read().splitlines()
+    assert [json_util.loads(line)['_id'] for line in lines] == [u"%03d" %i for i in range(3)]
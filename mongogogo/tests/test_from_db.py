@@ -0,0 +1,60 @@
+"""
+
+tests for creating records from documents of the database
+
+"""
+
+from conftest import Person, PersonSchema
+from mongogogo import Record
+
+def raw_person():
+    return {
+        '_id' : u'cs',
+        'firstname' : u'Foo',
+        'lastname' : u'Bar',
+        'incr' : 1,
+        'd' : {'foo' : 'bar'},
+    }
+
+class CountingPerson(Record):
+    schema = PersonSchema()
+    default_values = {'age' : 24, 'extra' : 1, 'd' : {'default' : True}}
+    created = 0
+
+    def after_create(self):
+        CountingPerson.created += 1
+
+def test_from_db_fills_record():
+    p = Person(from_db = raw_person())
+    assert p._id == u'cs'
+    assert p.incr == 2
+    assert p.d.foo == "bar"
+    assert p._mg_dirty == set()
+    assert Person.from_db_batch([raw_person()])[0] == p
+
+def test_from_db_applies_defaults_like_deserialize():
+    CountingPerson.created = 0
+    p = CountingPerson(from_db = raw_person())
+    assert CountingPerson.created == 1
+    assert p.extra == 1
+    # the same as merging the record returned by the compiled deserializer
+    merged = CountingPerson(from_db = raw_person())
+    dict.clear(merged)
+    merged.update(CountingPerson.schema.compile().deserialize(raw_person()))
+    merged._id = u'cs'
+    merged._collection = None
+    assert dict.copy(p) == dict.copy(merged)
+    batch = CountingPerson.from_db_batch([raw_person()])
+    assert dict.copy(batch[0]) == dict.copy(p)
+    assert Person(from_db = raw_person()).bio == {'name' : 'foobar'}
+
+def test_from_db_batch_lazy():
+    p = Person.from_db_batch([raw_person()], lazy = True)[0]
+    assert type(p) == Person
+    assert p._id == u'cs'
+    assert p._mg_pending
+    assert p._mg_dirty == set()
+    assert p.incr == 2
+    eager = Person(from_db = raw_person())
+    for name, node in Person.schema._nodes:
+        assert p[name] == eager[name]
@@ -0,0 +1,38 @@
+"""
+
+tests for importing documents with a process pool
+
+"""
+
+from mongogogo.importer import ImportPipeline
+from mongogogo import InvalidData
+
+def documents(n):
+    for i in range(n):
+        if i == 3:
+            yield {'lastname' : None}
+        else:
+            yield {'firstname' : "Foo%s" %i, 'age' : str(i)}
+
+def test_import_in_process(db, persons):
+    summary = ImportPipeline(persons, processes = 0, chunk_size = 2, batch_size = 3).run(documents(10))
+    assert summary.total == 10
+    assert summary.written == 9
+    assert summary.failed.keys() == [3]
+    assert isinstance(summary.failed[3], InvalidData)
+    assert db.persons.count_documents({}) == 9
+    assert persons.find_one({'firstname' : "Foo5"}).age == 5
+
+def test_import_rejects_broken_documents(db, persons):
+    docs = [{'firstname' : "Foo"}, 42, {'firstname' : "Bar"}]
+    summary = ImportPipeline(persons, processes = 0).run(docs)
+    assert summary.written == 2
+    assert summary.failed.keys() == [1]
+    assert isinstance(summary.failed[1], InvalidData)
+
+def test_import_with_pool(db, persons):
+    docs = [{'firstname' : "Foo%s" %i, '_id' : u"%03d" %i} for i in range(20)]
+    summary = ImportPipeline(persons, processes = 2, chunk_size = 3).run(iter(docs))
+    assert summary.written == 20
+    assert not summary.failed
+    assert persons.get(u"017").firstname == "Foo17"
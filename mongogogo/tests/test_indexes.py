@@ -0,0 +1,99 @@
+import py.test
+import warnings
+from conftest import Person, Persons
+from mongogogo import Index, UnindexedQuery, UnindexedQueryWarning
+from mongogogo.indexes import collection_scans, query_fields, checked_shapes
+
+IXSCAN = {'queryPlanner' : {'winningPlan' : {'stage' : 'FETCH', 'inputStage' : {'stage' : 'IXSCAN'}}}}
+COLLSCAN = {'queryPlanner' : {'winningPlan' : {'stage' : 'SORT', 'inputStage' : {'stage' : 'COLLSCAN'}}}}
+
+class IndexedPersons(Persons):
+    indexes = [
+        Index("firstname", "-age", unique = True),
+        Index("creation", expire_after = 3600),
+        Index("lastname", sparse = True),
+    ]
+    check_queries = "raise"
+    plan = IXSCAN
+
+    def _explain(self, spec, sort = None):
+        self.explained.append(spec)
+        return self.plan
+
+def pytest_funcarg__indexed(request):
+    checked_shapes.clear()
+    db = request.getfuncargvalue("db")
+    persons = IndexedPersons(db.persons)
+    request.addfinalizer(db.persons.drop_indexes)
+    persons.explained = []
+    return persons
+
+def test_index_declaration():
+    index = Index("firstname", "-age", ("loc", "2d"), unique = True, expire_after = 10)
+    assert index.keys == [("firstname", 1), ("age", -1), ("loc", "2d")]
+    assert index.fields == ["firstname", "age", "loc"]
+    assert index.model().document['unique'] == True
+    assert index.model().document['expireAfterSeconds'] == 10
+    py.test.raises(ValueError, Index)
+
+def test_ensure_indexes(indexed):
+    names = indexed.ensure_indexes()
+    assert len(names) == 3
+    info = indexed.collection.index_information()
+    assert info['firstname_1_age_-1']['unique'] == True
+    assert Persons(indexed.collection).ensure_indexes() == []
+
+def test_query_fields():
+    spec = {'a' : 1, '$or' : [{'b' : 2}, {'c.d' : {'$gt' : 1}}], '$where' : "x"}
+    assert query_fields(spec) == set(['a', 'b', 'c.d'])
+
+def test_collection_scans():
+    assert collection_scans(COLLSCAN)
+    assert not collection_scans(IXSCAN)
+    assert collection_scans({'cursor' : 'BasicCursor'})
+    assert collection_scans({'queryPlanner' : {'winningPlan' : {'stage' : 'OR', 'inputStages' : [{'stage' : 'IXSCAN'}, {'stage' : 'COLLSCAN'}]}}})
+
+def test_covers():
+    index = Index("firstname", "-age", "lastname")
+    assert index.covers(set(["firstname"]))
+    assert index.covers(set(["firstname", "age", "creation"]))
+    assert not index.covers(set(["age"]))
+    assert index.covers(set(["firstname"]), [("age", -1)])
+    assert index.covers(set(["firstname"]), [("age", 1), ("lastname", -1)])
+    assert index.covers(set(["firstname"]), [("firstname", 1), ("age", -1)])
+    assert not index.covers(set(["firstname"]), [("age", 1), ("lastname", 1)])
+    assert not index.covers(set(["firstname"]), [("lastname", 1)])
+    assert not index.covers(set(["firstname", "lastname"]), [("creation", 1)])
+    assert index.covers(set(), [("firstname", -1), ("age", 1)])
+    assert not index.covers(set(), [("age", 1)])
+    assert not Index(("loc", "2d"), "name").covers(set(), [("loc", -1)])
+
+def test_check_covered(indexed):
+    assert indexed.check_query({'firstname' : "a"}) is None
+    assert indexed.check_query({'_id' : 1}) is None
+    assert indexed.check_query({}) is None
+    assert indexed.explained == [{'firstname' : "a"}, {'_id' : 1}]
+
+def test_check_collscan(indexed):
+    indexed.plan = COLLSCAN
+    py.test.raises(UnindexedQuery, indexed.check_query, {'firstname' : "a"})
+
+def test_check_not_declared(indexed):
+    py.test.raises(UnindexedQuery, indexed.find, {'age' : 5})
+
+def test_check_once_per_shape(indexed):
+    indexed.check_queries = "warn"
+    with warnings.catch_warnings(record = True) as w:
+        warnings.simplefilter("always")
+        indexed.find({'age' : 5})
+        indexed.find({'age' : 6})
+        indexed.find(Person.q.age > 7)
+    assert len(w) == 1
+    assert issubclass(w[0].category, UnindexedQueryWarning)
+    assert len(indexed.explained) == 1
+
+def test_check_sort(indexed):
+    assert indexed.check_query({'firstname' : "a"}, [('age', -1)]) is None
+    assert indexed.find({'firstname' : "a"}).sort("age", 1) is not None
+    py.test.raises(UnindexedQuery, indexed.find({'firstname' : "a"}).sort, "lastname")
+    py.test.raises(UnindexedQuery, indexed.find, {'firstname' : "b"}, sort = [('age', -1), ('creation', 1)])
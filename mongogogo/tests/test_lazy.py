@@ -0,0 +1,65 @@
+"""
+
+tests for records which deserialize their fields on first access
+
+"""
+
+from conftest import Person
+
+def raw_person():
+    return {
+        '_id' : u'cs',
+        'firstname' : u'Foo',
+        'lastname' : u'Bar',
+        'incr' : 1,
+        'd' : {'foo' : 'bar'},
+    }
+
+def test_lazy_fields_are_pending():
+    p = Person(from_db = raw_person(), lazy = True)
+    assert p._mg_pending == set([name for name, node in Person.schema._nodes])
+    assert p._id == u'cs'
+
+def test_lazy_deserialize_on_access():
+    p = Person(from_db = raw_person(), lazy = True)
+    assert p.incr == 2
+    assert p['incr'] == 2 # memoized, so not incremented twice
+    assert "incr" not in p._mg_pending
+    assert p.d.foo == "bar"
+    assert "firstname" in p._mg_pending
+
+def test_lazy_get_and_items():
+    p = Person(from_db = raw_person(), lazy = True)
+    assert p.get('incr') == 2
+    assert dict(p.items())['incr'] == 2
+    assert not p._mg_pending
+
+def test_lazy_set_replaces_pending():
+    p = Person(from_db = raw_person(), lazy = True)
+    p.incr = 17
+    assert p.incr == 17
+
+def test_lazy_equals_eager():
+    lazy = Person(from_db = raw_person(), lazy = True)
+    eager = Person(from_db = raw_person())
+    for name, node in Person.schema._nodes:
+        assert lazy[name] == eager[name]
+
+def test_lazy_compares_and_shows_deserialized_values():
+    lazy = Person(from_db = raw_person(), lazy = True)
+    eager = Person(from_db = raw_person())
+    assert lazy == eager
+    assert not lazy != eager
+    assert Person(from_db = raw_person(), lazy = True) == Person(from_db = raw_person(), lazy = True)
+    assert eager == Person(from_db = raw_person(), lazy = True)
+    assert repr(Person(from_db = raw_person(), lazy = True)) == repr(eager)
+    assert Person(from_db = raw_person(), lazy = True).copy() == dict.copy(eager)
+
+def test_lazy_iteration_deserializes():
+    p = Person(from_db = raw_person(), lazy = True)
+    assert dict([(k, dict.__getitem__(p, k)) for k in p])['incr'] == 2
+    p = Person(from_db = raw_person(), lazy = True)
+    assert dict([(k, dict.__getitem__(p, k)) for k in p.keys()])['incr'] == 2
+    p = Person(from_db = raw_person(), lazy = True)
+    assert 2 in p.values()
+    assert not p._mg_pending
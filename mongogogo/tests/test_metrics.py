@@ -0,0 +1,100 @@
+"""
+
+tests for the timing of collection operations
+
+"""
+
+import py.test
+from mongogogo import ObjectNotFound
+from mongogogo.metrics import Metrics
+from conftest import Person, Persons
+
+class Clock(object):
+    now = 0
+    def __call__(self):
+        return self.now
+
+class HookedPersons(Persons):
+    clock = None
+
+    def before_put(self, obj, data):
+        self.clock.now += 2
+        return data
+
+def test_split_timings():
+    clock = Clock()
+    metrics = Metrics(clock = clock)
+
+    class Collection(object):
+        class collection(object):
+            full_name = "db.persons"
+
+    def serialize():
+        clock.now += 1
+        metrics.hook(hook) # hook time is not counted as serialize time
+        clock.now += 1
+
+    def hook():
+        clock.now += 5
+
+    def server():
+        clock.now += 10
+
+    with metrics.operation("put", Collection()) as op:
+        op.timed("serialize", serialize)
+        op.timed("server", server)
+        op.add_documents([{'a' : 1}])
+    assert op.serialize == 2
+    assert op.hooks == 5
+    assert op.server == 10
+    assert op.duration == 17
+    assert op.bytes == 12
+    assert metrics.current() is None
+    stats = metrics.snapshot()['db.persons']['put']
+    assert stats['count'] == 1
+    assert stats['documents'] == 1
+    assert stats['total'] == 17
+
+def test_disabled(db):
+    persons = Persons(db.persons)
+    p = persons.put(Person(firstname = "Foo"))
+    assert persons.get(p._id).firstname == "Foo"
+    assert persons.metrics is None
+
+def test_collection_operations(db):
+    ops = []
+    metrics = Metrics(listeners = [ops.append])
+    persons = Persons(db.persons, metrics = metrics)
+    p = persons.put(Person(firstname = "Foo"))
+    p = persons.get(p._id)
+    p.age = 30
+    persons.put(p)
+    persons.put_many([Person(firstname = "Bar%s" %i) for i in range(3)])
+    assert len(persons.get_many([p._id])) == 1
+    assert len(list(persons.find())) == 4
+    persons.remove(p)
+    with py.test.raises(ObjectNotFound):
+        persons.get(p._id)
+
+    stats = metrics.snapshot()[db.persons.full_name]
+    assert stats['put']['count'] == 2
+    assert stats['put_many']['documents'] == 3
+    assert stats['get']['count'] == 2
+    assert stats['get']['errors'] == 1
+    assert stats['get']['documents'] == 1
+    assert stats['get']['bytes'] > 0
+    assert stats['get_many']['documents'] == 1
+    assert stats['find']['count'] == 1
+    assert stats['iterate']['documents'] == 4
+    assert stats['remove']['count'] == 1
+    assert [op.name for op in ops][:3] == ["put", "get", "put"]
+
+def test_hook_time(db):
+    clock = Clock()
+    persons = HookedPersons(db.persons, metrics = Metrics(clock = clock))
+    persons.clock = clock
+    persons.put(Person(firstname = "Foo"))
+    stats = persons.metrics.snapshot()[db.persons.full_name]['put']
+    assert stats['hooks'] == 2
+    assert stats['serialize'] == 0
+    assert stats['total'] == 2
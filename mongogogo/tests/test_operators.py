@@ -0,0 +1,83 @@
+import py.test
+import datetime
+from mongogogo import Record, Collection, Schema, String, Integer, Float, Date, List, Dict
+from mongogogo import Invalid, ObjectNotFound, CollectionMissing
+
+class Talk(Schema):
+    title = String()
+    day = Date()
+
+class CounterSchema(Schema):
+    name = String()
+    visits = Integer(min = 0, max = 10)
+    score = Float()
+    tags = List(String())
+    days = List(Date())
+    talks = List(Talk())
+    extra = Dict()
+
+class Counter(Record):
+    schema = CounterSchema()
+
+class Counters(Collection):
+    data_class = Counter
+
+def pytest_funcarg__counter(request):
+    db = request.getfuncargvalue("db")
+    counters = Counters(db.persons)
+    return counters.put(Counter(name = u"c", visits = 0, score = 0.0, tags = [u"a"], talks = [{'title' : u"t"}]))
+
+def stored(counter):
+    return counter._collection.collection.find_one({'_id' : counter._id})
+
+def test_inc(counter):
+    counter.inc("visits")
+    counter.inc("visits", 2)
+    assert stored(counter)['visits'] == 3
+    assert counter.visits == 0 # not refreshed
+    counter.inc("visits", 1, refresh = True)
+    assert counter.visits == 4
+    assert counter._mg_raw['visits'] == 4
+    assert counter._mg_dirty == set()
+    counter.inc("score", 0.5)
+    py.test.raises(Invalid, counter.inc, "visits", 0.5)
+    py.test.raises(Invalid, counter.inc, "name", 1)
+    py.test.raises(Invalid, counter.inc, "visits", "1")
+
+def test_inc_range(counter):
+    counter.inc("visits", 10)
+    py.test.raises(Invalid, counter.inc, "visits", 1)
+    counter.inc("visits", -10)
+    py.test.raises(Invalid, counter.inc, "visits", -1)
+    assert stored(counter)['visits'] == 0
+
+def test_list_operators(counter):
+    counter.push("tags", 5)
+    counter.add_to_set("tags", u"a")
+    counter.add_to_set("tags", {'$each' : [u"b", u"c"]})
+    counter.push("days", datetime.date(2012, 1, 1))
+    counter.push("talks", {'title' : u"x", 'day' : datetime.date(2012, 1, 2)})
+    data = stored(counter)
+    assert data['tags'] == [u"a", u"5", u"b", u"c"]
+    assert data['days'] == [datetime.datetime(2012, 1, 1)]
+    assert data['talks'][1]['day'] == datetime.datetime(2012, 1, 2)
+    counter.pull("tags", u"5", refresh = True)
+    assert counter.tags == [u"a", u"b", u"c"]
+    assert counter.days == [datetime.date(2012, 1, 1)]
+    py.test.raises(Invalid, counter.push, "name", u"x")
+
+def test_collection_update(counter):
+    counters = counter._collection
+    counters.put(Counter(name = u"d", visits = 1))
+    assert counters.update({}, {'$inc' : {'visits' : 1}}, multi = True).modified_count == 2
+    counters.update({'name' : u"c"}, {'$set' : {'talks.0.day' : datetime.date(2012, 1, 3), 'extra.x' : 1}})
+    assert stored(counter)['talks'][0]['day'] == datetime.datetime(2012, 1, 3)
+    assert stored(counter)['extra'] == {'x' : 1}
+    assert counters.update(Counter.q.name == "d", {'$inc' : {'visits' : 9}}).modified_count == 0
+    py.test.raises(ValueError, counters.update, {}, {'$set' : {'unknown' : 1}})
+    py.test.raises(Invalid, counters.update, {}, {'$set' : {'visits' : 11}})
+
+def test_missing(counter):
+    counter._collection.remove(counter)
+    py.test.raises(ObjectNotFound, counter.inc, "visits")
+    py.test.raises(CollectionMissing, Counter(name = u"x").inc, "visits")
@@ -0,0 +1,66 @@
+import py.test
+from conftest import Person
+
+def fill(persons):
+    # ages repeat so the _id has to break ties
+    for i in range(10):
+        persons.put(Person(firstname = "Foo%s" %i, age = i // 2))
+
+def names(page):
+    return [p.firstname for p in page]
+
+def test_forward(persons):
+    fill(persons)
+    page = persons.paginate(sort = [('age', -1)], page_size = 4)
+    assert names(page) == ["Foo8", "Foo9", "Foo6", "Foo7"]
+    assert page.previous is None
+    page = persons.paginate(sort = [('age', -1)], after = page.next, page_size = 4)
+    assert names(page) == ["Foo4", "Foo5", "Foo2", "Foo3"]
+    assert page.previous is not None
+    page = persons.paginate(sort = [('age', -1)], after = page.next, page_size = 4)
+    assert names(page) == ["Foo0", "Foo1"]
+    assert page.next is None
+
+def test_backward(persons):
+    fill(persons)
+    first = persons.paginate(sort = [('age', 1)], page_size = 3)
+    second = persons.paginate(sort = [('age', 1)], after = first.next, page_size = 3)
+    assert names(second) == ["Foo3", "Foo4", "Foo5"]
+    back = persons.paginate(sort = [('age', 1)], before = second.previous, page_size = 3)
+    assert names(back) == names(first)
+    assert back.previous is None
+    assert back.next is not None
+
+def test_spec(persons):
+    fill(persons)
+    page = persons.paginate(Person.q.age >= 3, page_size = 3)
+    rest = persons.paginate(Person.q.age >= 3, after = page.next, page_size = 3)
+    assert sorted(names(page) + names(rest)) == ["Foo6", "Foo7", "Foo8", "Foo9"]
+    assert len(rest) == 1
+
+def test_nulls(persons):
+    fill(persons)
+    persons.collection.update_many({'age' : {'$lt' : 2}}, {'$set' : {'age' : None}})
+    for direction in (1, -1):
+        seen = []
+        page = persons.paginate(sort = [('age', direction)], page_size = 3)
+        pages = [page]
+        while page.next is not None:
+            page = persons.paginate(sort = [('age', direction)], after = page.next, page_size = 3)
+            pages.append(page)
+        for page in pages:
+            seen.extend(names(page))
+        assert sorted(seen) == sorted(["Foo%s" %i for i in range(10)])
+        # and back again
+        while page.previous is not None:
+            back = persons.paginate(sort = [('age', direction)], before = page.previous, page_size = 3)
+            pages.pop()
+            assert names(back) == names(pages[-1])
+            page = back
+
+def test_invalid_token(persons):
+    fill(persons)
+    page = persons.paginate(sort = [('age', 1)], page_size = 3)
+    py.test.raises(ValueError, persons.paginate, sort = [('age', -1)], after = page.next)
+    py.test.raises(ValueError, persons.paginate, after = "garbage")
+    py.test.raises(ValueError, persons.paginate, after = page.next, before = page.next)
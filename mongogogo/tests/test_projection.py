@@ -0,0 +1,71 @@
+"""
+
+tests for loading records with only some of their fields
+
+"""
+
+from mongogogo import *
+from mongogogo.projection import Projection, FieldProfile, get_projection
+from test_subdict import Barcamp, Barcamps
+import pytest
+
+def test_projection_spec():
+    p = Projection(Barcamp.schema, ["name", "location.name", "locations.name"])
+    assert p.spec == {'_id' : 1, 'name' : 1, 'location.name' : 1, 'locations.name' : 1}
+    assert p.fields == frozenset(["name", "location", "locations"])
+
+def test_projection_whole_field_wins():
+    p = Projection(Barcamp.schema, ["location.name", "location"])
+    assert p.spec == {'_id' : 1, 'location' : 1}
+
+def test_projection_unknown_field():
+    pytest.raises(ValueError, Projection, Barcamp.schema, ["foo"])
+    pytest.raises(ValueError, Projection, Barcamp.schema, ["location.foo"])
+    pytest.raises(ValueError, Projection, Barcamp.schema, ["name.foo"])
+
+def test_projection_is_cached():
+    assert get_projection(Barcamp.schema, ["name"]) is get_projection(Barcamp.schema, ["name"])
+
+def test_partial_record():
+    p = Projection(Barcamp.schema, ["name", "locations.name"])
+    raw = {'_id' : u'bc', 'name' : u'camp', 'locations' : [{'name' : u'here'}]}
+    barcamp = Barcamp(from_db = raw, projection = p)
+    assert barcamp.name == "camp"
+    assert barcamp.locations[0]['name'] == "here"
+    assert "location" not in barcamp
+    barcamps = Barcamps(None)
+    barcamps.partial_updates = False
+    pytest.raises(PartialRecord, barcamps.put, barcamp)
+
+def test_partial_lazy_record():
+    p = Projection(Barcamp.schema, ["name"])
+    barcamp = Barcamp(from_db = {'_id' : u'bc', 'name' : u'camp'}, projection = p, lazy = True)
+    assert barcamp._mg_pending == set(["name"])
+    assert barcamp.name == "camp"
+
+def test_profile():
+    profile = FieldProfile(runs = 1)
+    p = profile.projection(Barcamp.schema)
+    assert p.spec is None
+    barcamp = Barcamp(from_db = {'_id' : u'bc', 'name' : u'camp', 'location' : {}, 'locations' : []}, projection = p)
+    barcamp.name
+    p = profile.projection(Barcamp.schema)
+    assert p.spec == {'_id' : 1, 'name' : 1}
+    assert p.profile is profile
+
+def test_find_with_fields(db):
+    barcamps = Barcamps(db.barcamps)
+    Barcamp(dict(name = u"camp", location = {'name' : u"here"}), collection = barcamps).put()
+    barcamp = barcamps.find_one({'name' : u"camp"}, fields = ["location.name"])
+    assert barcamp.location['name'] == "here"
+    assert "name" not in barcamp
+
+def test_find_autoproject(db):
+    barcamps = Barcamps(db.barcamps)
+    Barcamp(dict(name = u"camp", location = {'name' : u"here"}), collection = barcamps).put()
+    for i in range(3):
+        barcamp = barcamps.find_one({'name' : u"camp"}, autoproject = "test_find_autoproject")
+        assert barcamp.name == "camp"
+    assert "location" not in barcamp
+    # fetched on demand
+    assert barcamp.location['name'] == "here"
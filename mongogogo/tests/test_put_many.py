@@ -0,0 +1,35 @@
+"""
+
+tests for storing many records at once
+
+"""
+
+from conftest import Person
+from mongogogo import Invalid
+
+def test_put_many(db, persons):
+    ps = [Person(firstname = "Foo%s" %i) for i in range(10)]
+    result = persons.put_many(ps, batch_size = 3)
+    assert result.ok
+    assert len(result.records) == 10
+    for p in ps:
+        assert p._id is not None
+        assert persons[p._id].firstname == p.firstname
+
+def test_put_many_upsert(db, persons):
+    p = Person(firstname = "Foo", _id = u"cs")
+    persons.put_many([p])
+    p.firstname = "Bar"
+    persons.put_many([p, Person(firstname = "Baz", _id = u"cs2")])
+    assert persons[u"cs"].firstname == "Bar"
+    assert persons[u"cs2"].firstname == "Baz"
+
+def test_put_many_invalid(db, persons):
+    ps = [Person(firstname = "Foo"), Person(), Person(firstname = "Bar")]
+    ps[1]['firstname'] = None
+    result = persons.put_many(ps)
+    assert not result.ok
+    assert result.errors.keys() == [1]
+    assert isinstance(result.errors[1], Invalid)
+    assert result.records == [ps[0], ps[2]]
+    assert ps[2]._id is not None
@@ -0,0 +1,87 @@
+import py.test
+import datetime
+from conftest import Person
+from mongogogo import Record, Schema, String, Integer, Float, Regexp, Date, List, Invalid
+from mongogogo.query import param, Expression
+
+class Tag(Schema):
+    name = String()
+    weight = Integer()
+
+class EventSchema(Schema):
+    title = String()
+    day = Date()
+    count = Integer()
+    rating = Float(min = 0, max = 5)
+    seats = Integer(min = 1, max = 100)
+    code = Regexp("[A-Z]+$", max_length = 4)
+    tags = List(Tag())
+    names = List(String())
+
+class Event(Record):
+    schema = EventSchema()
+
+def test_simple_conditions():
+    assert (Person.q.age > 30).to_spec() == {'age' : {'$gt' : 30}}
+    assert (Person.q.age == 30).to_spec() == {'age' : 30}
+    assert (Person.q.age != 30).to_spec() == {'age' : {'$ne' : 30}}
+    assert (Person.q.firstname.in_(["a", "b"])).to_spec() == {'firstname' : {'$in' : [u"a", u"b"]}}
+
+def test_operands_are_serialized():
+    spec = (Event.q.day >= datetime.date(2012, 1, 2)).to_spec()
+    assert spec == {'day' : {'$gte' : datetime.datetime(2012, 1, 2)}}
+    assert type(spec['day']['$gte']) == datetime.datetime
+    assert (Event.q.count < "5").to_spec() == {'count' : {'$lt' : 5}}
+
+def test_operands_are_not_validated():
+    assert (Event.q.seats > 0).to_spec() == {'seats' : {'$gt' : 0}}
+    assert (Event.q.seats < "1000").to_spec() == {'seats' : {'$lt' : 1000}}
+    assert (Event.q.rating.in_([-1, 10])).to_spec() == {'rating' : {'$in' : [-1.0, 10.0]}}
+    assert (Event.q.code == "abcdef").to_spec() == {'code' : u"abcdef"}
+    py.test.raises(Invalid, lambda: (Event.q.seats > "many").to_spec())
+
+def test_sub_fields():
+    assert (Event.q.tags.name == "python").to_spec() == {'tags.name' : u"python"}
+    assert (Event.q.names == "foo").to_spec() == {'names' : u"foo"}
+    assert (Event.q.names.size(2)).to_spec() == {'names' : {'$size' : 2}}
+    assert (Person.q.d.foo == 1).to_spec() == {'d.foo' : 1}
+    py.test.raises(AttributeError, lambda: Event.q.tags.unknown)
+    py.test.raises(AttributeError, lambda: Event.q.unknown)
+
+def test_combinations():
+    q = (Person.q.age > 30) & (Person.q.age < 40) & (Person.q.firstname == "Foo")
+    assert q.to_spec() == {'age' : {'$gt' : 30, '$lt' : 40}, 'firstname' : u"Foo"}
+    q = (Person.q.age == 30) & (Person.q.age > 20)
+    assert q.to_spec() == {'$and' : [{'age' : 30}, {'age' : {'$gt' : 20}}]}
+    q = (Person.q.age == 30) | (Person.q.firstname == "Foo")
+    assert q.to_spec() == {'$or' : [{'age' : 30}, {'firstname' : u"Foo"}]}
+    assert (~(Person.q.age == 30)).to_spec() == {'$nor' : [{'age' : 30}]}
+
+def test_params():
+    q = (Event.q.day >= param("since")) & (Event.q.title == param("title"))
+    assert q.to_spec(since = datetime.date(2012, 1, 1), title = "a") == \
+        {'day' : {'$gte' : datetime.datetime(2012, 1, 1)}, 'title' : u"a"}
+    assert q.to_spec(since = datetime.date(2013, 1, 1), title = "b") == \
+        {'day' : {'$gte' : datetime.datetime(2013, 1, 1)}, 'title' : u"b"}
+    py.test.raises(KeyError, q.to_spec, since = datetime.date(2013, 1, 1))
+
+def test_shapes_are_shared():
+    q1 = (Person.q.age > 30) & (Person.q.firstname == "a")
+    q2 = (Person.q.age > 40) & (Person.q.firstname == "b")
+    q1.to_spec()
+    assert q2.to_spec() == {'age' : {'$gt' : 40}, 'firstname' : u"b"}
+    assert q1._builder is q2._builder
+
+def test_q_on_instances():
+    p = Person(firstname = "Foo")
+    py.test.raises(AttributeError, lambda: p.q)
+    p['q'] = 1
+    assert p.q == 1
+    assert isinstance(Person.q.age > 1, Expression)
+
+def test_find(persons):
+    for age in (20, 30, 40):
+        persons.put(Person(firstname = "Foo", age = age))
+    result = list(persons.find((Person.q.age > 25) & (Person.q.age < 35)))
+    assert [p.age for p in result] == [30]
+    assert persons.find_one(Person.q.age == 40).age == 40
@@ -0,0 +1,90 @@
+import py.test
+from mongogogo import Record, Collection, Schema, String, List, Reference, Invalid
+
+class CountingCollection(Collection):
+    queries = 0
+
+    def get_many(self, ids, *args, **kwargs):
+        self.queries += 1
+        return super(CountingCollection, self).get_many(ids, *args, **kwargs)
+
+class UserSchema(Schema):
+    name = String()
+
+class User(Record):
+    schema = UserSchema()
+
+class Users(CountingCollection):
+    data_class = User
+
+class Location(Record):
+    schema = UserSchema()
+
+class Locations(CountingCollection):
+    data_class = Location
+
+targets = {}
+
+class EventSchema(Schema):
+    title = String()
+    speaker = Reference(lambda: targets['users'])
+
+class BarcampSchema(Schema):
+    name = String()
+    location = Reference()
+    owners = List(Reference(lambda: targets['users']))
+    events = List(EventSchema())
+
+class Barcamp(Record):
+    schema = BarcampSchema()
+
+class Barcamps(Collection):
+    data_class = Barcamp
+
+def pytest_funcarg__setup(request):
+    db = request.getfuncargvalue("db")
+    users = targets['users'] = Users(db.users)
+    locations = Locations(db.locations)
+    barcamps = Barcamps(db.barcamps)
+    request.addfinalizer(lambda: [db.users.remove(), db.locations.remove()])
+    us = [users.put(User(name = u"user%s" %i)) for i in range(4)]
+    ls = [locations.put(Location(name = u"location%s" %i)) for i in range(2)]
+    for i in range(6):
+        barcamps.put(Barcamp(name = u"camp%s" %i, location = ls[i % 2], owners = [us[i % 4], us[(i+1) % 4]],
+            events = [{'title' : u"talk", 'speaker' : us[3]}]))
+    return users, locations, barcamps
+
+def test_stored_as_id(setup):
+    users, locations, barcamps = setup
+    raw = barcamps.collection.find_one()
+    assert raw['location'] == locations.find_one({'name' : u"location0"})._id
+    assert barcamps.find_one({'name' : u"camp0"}).owners[0] == users.find_one({'name' : u"user0"})._id
+    py.test.raises(Invalid, BarcampSchema().serialize, {'name' : u"x", 'location' : Location(name = u"new")})
+
+def test_populate(setup):
+    users, locations, barcamps = setup
+    camps = list(barcamps.find().sort("name", 1))
+    barcamps.populate(camps, "location", "owners", "events.speaker", location = locations)
+    assert users.queries == 1
+    assert locations.queries == 1
+    assert camps[1].location.name == u"location1"
+    assert [u.name for u in camps[1].owners] == [u"user1", u"user2"]
+    assert camps[0].events[0]['speaker'].name == u"user3"
+    assert camps[0].owners[1] is camps[1].owners[0]
+    # populated records store the ids again and are not changed
+    assert camps[0]._mg_dirty == set()
+    camps[0].put()
+    assert barcamps.collection.find_one({'name' : u"camp0"})['location'] == camps[0].location._id
+
+def test_cursor_populate(setup):
+    users, locations, barcamps = setup
+    camps = list(barcamps.find().populate("owners", "location", location = locations))
+    assert users.queries == 1
+    assert locations.queries == 1
+    assert all([isinstance(c.location, Location) for c in camps])
+
+def test_unknown_paths(setup):
+    users, locations, barcamps = setup
+    py.test.raises(ValueError, barcamps.populate, [], "name")
+    py.test.raises(ValueError, barcamps.populate, [], "missing")
+    py.test.raises(ValueError, barcamps.populate, [], "location")
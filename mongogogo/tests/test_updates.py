@@ -0,0 +1,136 @@
+"""
+
+tests for saving only the changes of loaded records
+
+"""
+
+import datetime
+from conftest import Person, Persons
+from mongogogo import AttributeMapper
+from mongogogo.updates import diff, snapshot
+
+def test_diff_scalar():
+    sets, unsets = {}, {}
+    diff("a", 1, 2, sets, unsets)
+    diff("b", 1, 1, sets, unsets)
+    diff("c", diff.missing, 1, sets, unsets)
+    assert sets == {'a' : 2, 'c' : 1}
+    assert unsets == {}
+
+def test_diff_subdocument():
+    sets, unsets = {}, {}
+    diff("bio", {'name' : u'foo', 'url' : u'x', 'old' : 1}, {'name' : u'bar', 'url' : u'x'}, sets, unsets)
+    assert sets == {'bio.name' : u'bar'}
+    assert unsets == {'bio.old' : ""}
+
+def test_diff_types():
+    sets, unsets = {}, {}
+    diff("a", 1, 1.0, sets, unsets)
+    diff("d", {}, AttributeMapper(), sets, unsets)
+    diff("e", {'x' : 1}, AttributeMapper({'x' : 1}), sets, unsets)
+    assert sets == {'a' : 1.0}
+
+def test_diff_list():
+    sets, unsets = {}, {}
+    diff("l", [1, 2], [1, 2, 3], sets, unsets)
+    assert sets == {'l' : [1, 2, 3]}
+
+def test_snapshot():
+    doc = {'_id' : u'cs', 'e' : {'a' : {'b' : 1}}, 'l' : [{'x' : 1}]}
+    copied = snapshot(doc)
+    assert copied == doc
+    assert copied['e']['a'] is not doc['e']['a']
+    assert copied['l'][0] is not doc['l'][0]
+
+def test_nested_change_in_place():
+    p = Person(from_db = {'_id' : u'cs', 'firstname' : u'Foo', 'd' : {}, 'e' : {'a' : {'b' : 1}}})
+    p.e['a']['b'] = 2
+    assert p._mg_raw['e'] == {'a' : {'b' : 1}}
+    assert p._mg_dirty == set()
+
+def test_raw_document_is_not_copied():
+    doc = {'_id' : u'cs', 'firstname' : u'Foo', 'd' : {'l' : [1]}, 'e' : {'a' : {'b' : 1}}}
+    for lazy in (False, True):
+        p = Person(from_db = doc, lazy = lazy)
+        assert p._mg_raw is doc
+        assert p.e['a'] is not doc['e']['a']
+        assert p.d.l is not doc['d']['l']
+
+def test_before_put_gets_whole_document():
+    documents = []
+    class StampedPersons(Persons):
+        def before_put(self, obj, data):
+            documents.append(dict(data))
+            data['stamp'] = 1
+            return data
+    p = Person(from_db = {'_id' : u'cs', 'firstname' : u'Foo', 'lastname' : u'Bar', 'age' : 3, 'incr' : 1,
+        'creation' : datetime.datetime(2020, 1, 1), 'd' : {}, 'e' : {}}, lazy = True)
+    p.firstname = "Foo2"
+    obj, update, fields = StampedPersons(None)._prepare_changes(p)
+    assert documents[0]['_id'] == u'cs'
+    assert documents[0]['firstname'] == u'Foo2'
+    assert documents[0]['lastname'] == u'Bar'
+    assert update['$set']['firstname'] == u'Foo2'
+    assert update['$set']['stamp'] == 1
+    assert 'lastname' not in update['$set']
+
+def test_dirty_tracking():
+    p = Person(from_db = {'_id' : u'cs', 'firstname' : u'Foo', 'd' : {}, 'e' : {}})
+    assert p._mg_dirty == set()
+    p.firstname = "Bar"
+    p.update({'age' : 17})
+    assert p._mg_dirty == set(['firstname', 'age'])
+
+def test_save_changes_only(db, persons):
+    p = Person(firstname = "Foo", lastname = "Bar", _id = u"cs")
+    persons.save(p)
+    p = persons[u"cs"]
+    db.persons.update_one({'_id' : u'cs'}, {'$set' : {'lastname' : u'Changed'}})
+    p.firstname = "Foo2"
+    p.e['x'] = 1
+    persons.save(p)
+    raw = db.persons.find_one({'_id' : u'cs'})
+    assert raw['firstname'] == "Foo2"
+    assert raw['lastname'] == "Changed"
+    assert raw['e'] == {'x' : 1}
+    assert not p._mg_dirty
+
+def test_save_without_changes(db, persons):
+    p = Person(firstname = "Foo", _id = u"cs")
+    persons.save(p)
+    p = persons[u"cs"]
+    db.persons.update_one({'_id' : u'cs'}, {'$set' : {'firstname' : u'Changed'}})
+    persons.save(p)
+    assert persons[u"cs"].firstname == "Changed"
+
+def test_save_nested_change_in_place(db, persons):
+    p = Person(firstname = "Foo", e = {'a' : {'b' : 1}}, _id = u"cs")
+    persons.save(p)
+    p = persons[u"cs"]
+    raw = p._mg_raw
+    p.e['a']['b'] = 2
+    persons.save(p)
+    assert raw['e'] == {'a' : {'b' : 1}}
+    assert db.persons.find_one({'_id' : u'cs'})['e'] == {'a' : {'b' : 2}}
+    p.e['a']['b'] = 3
+    persons.save(p)
+    assert db.persons.find_one({'_id' : u'cs'})['e'] == {'a' : {'b' : 3}}
+
+def test_save_nested_change_in_place_lazy(db, persons):
+    persons.save(Person(firstname = "Foo", e = {'a' : {'b' : 1}}, _id = u"cs"))
+    p = Person(from_db = db.persons.find_one({'_id' : u'cs'}), collection = persons, lazy = True)
+    p.e['a']['b'] = 2
+    persons.save(p)
+    assert db.persons.find_one({'_id' : u'cs'})['e'] == {'a' : {'b' : 2}}
+
+def test_save_changes_after_whole_document(db, persons):
+    persons.save(Person(firstname = "Foo", e = {'x' : 1}, _id = u"cs"))
+    p = Person(from_db = db.persons.find_one({'_id' : u'cs'}), collection = persons)
+    p.e['x'] = 2
+    p.firstname = u"Bar"
+    persons.put_many([p])
+    assert p._mg_raw['e'] == {'x' : 2}
+    assert p._mg_dirty == set()
+    p.e['x'] = 1
+    persons.save(p)
+    assert db.persons.find_one({'_id' : u'cs'})['e'] == {'x' : 1}
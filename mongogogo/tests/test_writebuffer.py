@@ -0,0 +1,135 @@
+import py.test
+import time
+from pymongo import WriteConcern
+from conftest import Person, Persons
+from mongogogo import Record, Schema, String, Integer, Dict
+
+class CountingPersons(Persons):
+    writes = 0
+    put_hooks = 0
+
+    def _write_batch(self, docs, ordered = False, write_concern = None):
+        self.writes += 1
+        self.write_concern = write_concern
+        return super(CountingPersons, self)._write_batch(docs, ordered, write_concern = write_concern)
+
+    def after_put(self, obj):
+        self.put_hooks += 1
+
+def pytest_funcarg__counting(request):
+    db = request.getfuncargvalue("db")
+    return CountingPersons(db.persons)
+
+class ItemSchema(Schema):
+    name = String()
+    amount = Integer()
+    meta = Dict(dotted = True)
+
+class Item(Record):
+    # no nodes like the Incrementor of Person so an unchanged item serializes to what was loaded
+    schema = ItemSchema()
+
+class CountingItems(CountingPersons):
+    data_class = Item
+
+def test_coalesce(counting):
+    buf = counting.buffered(interval = None)
+    p = Person(firstname = "Foo")
+    for i in range(100):
+        p.age = i
+        counting.put(p)
+    assert p._id is not None
+    assert counting.collection.find_one() is None
+    assert len(buf) == 1
+    assert counting.put_hooks == 0
+    assert buf.close() == {}
+    assert counting.writes == 1
+    assert counting.put_hooks == 1
+    assert counting.collection.find_one()['age'] == 99
+    assert counting.write_buffer is None
+
+def test_max_size(counting):
+    buf = counting.buffered(max_size = 3, interval = None)
+    for i in range(7):
+        counting.put(Person(firstname = "Foo%s" %i))
+    assert counting.writes == 2
+    assert counting.collection.count_documents({}) == 6
+    buf.close()
+    assert counting.collection.count_documents({}) == 7
+
+def test_background_flush(counting):
+    buf = counting.buffered(interval = 0.01, write_concern = WriteConcern(w = 1))
+    counting.put(Person(firstname = "Foo"))
+    for i in range(100):
+        if not len(buf) and counting.writes:
+            break
+        time.sleep(0.01)
+    assert counting.collection.count_documents({}) == 1
+    assert counting.write_concern.document == {'w' : 1}
+    buf.close()
+
+def test_loaded_records(counting):
+    counting.put(Person(firstname = "Foo", age = 1))
+    p = counting.find_one({'firstname' : "Foo"})
+    buf = counting.buffered(interval = None)
+    p.age = 2
+    p.save()
+    buf.close()
+    assert counting.collection.find_one()['age'] == 2
+    assert p._mg_raw['age'] == 2
+    p.age = 1
+    p.save()
+    assert counting.collection.find_one()['age'] == 1
+
+def test_requeue(counting):
+    buf = counting.buffered(interval = None)
+    counting.put(Person(firstname = "Foo"))
+    def fail(*args, **kwargs):
+        raise IOError("down")
+    counting._write_batch = fail
+    py.test.raises(IOError, buf.flush)
+    assert len(buf) == 1
+    del counting._write_batch
+    buf.close()
+    assert counting.collection.count_documents({}) == 1
+
+def test_loaded_records_keep_concurrent_updates(counting):
+    counting.put(Person(firstname = "Foo", age = 1))
+    p = counting.find_one({'firstname' : "Foo"})
+    buf = counting.buffered(interval = None)
+    p.firstname = "Bar"
+    p.save()
+    counting.collection.update_one({'_id' : p._id}, {'$inc' : {'age' : 5}})
+    assert buf.close() == {}
+    doc = counting.collection.find_one()
+    assert doc['firstname'] == "Bar"
+    assert doc['age'] == 6
+    assert not p._mg_dirty
+    assert counting.put_hooks == 2
+
+def test_unchanged_loaded_records_are_not_written(db):
+    items = CountingItems(db.persons)
+    items.put(Item(name = u"Foo", amount = 1, meta = {}))
+    p = items.find_one({'name' : u"Foo"})
+    buf = items.buffered(interval = None)
+    p.save()
+    buf.close()
+    assert items.writes == 0
+    assert items.put_hooks == 2
+
+def test_loaded_records_with_the_same_id(counting):
+    counting.put(Person(firstname = "Foo", lastname = "Bar"))
+    a = counting.find_one({'firstname' : "Foo"})
+    b = counting.find_one({'firstname' : "Foo"})
+    buf = counting.buffered(interval = None)
+    a.firstname = "Changed"
+    a.save()
+    b.lastname = "Other"
+    b.save()
+    buf.close()
+    doc = counting.collection.find_one()
+    assert doc['firstname'] == "Changed"
+    assert doc['lastname'] == "Other"
+    assert counting.put_hooks == 3
+    assert not a._mg_dirty
+    assert not b._mg_dirty
@@ -0,0 +1,119 @@
+"""
+
+helpers for building MongoDB update documents
+
+"""
+
+import types
+from schema import Integer, Float, List, Invalid, snapshot
+
+__all__ = ["diff", "snapshot", "convert_update"]
+
+_missing = object()
+
+def _dottable(key):
+    """check whether ``key`` can be used as part of a dotted path"""
+    return isinstance(key, basestring) and "." not in key and not key.startswith("$")
+
+def diff(path, old, new, sets, unsets):
+    """compare the serialized value ``old`` from the database with the serialized value ``new`` and
+    add the necessary changes to the ``$set`` document ``sets`` and the ``$unset`` document ``unsets``.
+    Sub documents are compared key by key so only the changed parts are set.
+
+    :param path: the dotted path of the value in the document
+    :param old: the old value or ``diff.missing`` if it does not exist in the database
+    :param new: the new value or ``diff.missing`` if it should be removed
+    """
+    if new is _missing:
+        if old is not _missing:
+            unsets[path] = ""
+        return
+    if type(old) == types.DictType and isinstance(new, dict) and old and new \
+            and all([_dottable(key) for key in new]) and all([_dottable(key) for key in old]):
+        for key, value in new.items():
+            diff(path+"."+key, old.get(key, _missing), value, sets, unsets)
+        for key in old:
+            if key not in new:
+                unsets[path+"."+key] = ""
+        return
+    if old is _missing or old != new:
+        sets[path] = new
+    elif type(old) != type(new) and not isinstance(new, (dict, list)):
+        # equal scalars like 1, 1.0 and True are set anyway to store the new type
+        sets[path] = new
+
+diff.missing = _missing
+
+
+_value_ops = ("$set", "$setOnInsert", "$min", "$max") # the operand is a value of the field
+_element_ops = ("$push", "$addToSet") # the operand is an element of the list or a $each modifier
+
+def _number(node, op, value):
+    """check the operand of a numeric operator"""
+    if not isinstance(node, Integer):
+        raise Invalid(node, "%s can only be used with numbers" %op)
+    if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+        raise Invalid(node, "Value '%s' is not a number" %(value,))
+    if isinstance(value, float) and not isinstance(node, Float):
+        raise Invalid(node, "Value '%s' is not an integer" %value)
+    return value
+
+def _elements(node, op, value):
+    """serialize the operand of an operator adding elements to a list"""
+    if not isinstance(node, List):
+        raise Invalid(node, "%s can only be used with lists" %op)
+    serialize = node.subtype.compile().serialize
+    if isinstance(value, dict) and "$each" in value:
+        value = dict(value)
+        value["$each"] = [serialize(item) for item in value["$each"]]
+        return value
+    return serialize(value)
+
+def convert_update(ops, field_node):
+    """validate and serialize the operands of the update document ``ops`` with the schema nodes of
+    their fields. Values for ``$set`` are serialized with the node of the field, elements for ``$push``,
+    ``$addToSet``, ``$pull`` and ``$pullAll`` with the node of the list items. ``$inc`` and ``$mul`` need
+    a number for an ``Integer`` or ``Float`` field. Fields without a node are left alone.
+
+    :param ops: the update document, e.g. ``{'$inc' : {'visits' : 1}}``
+    :param field_node: a function returning the schema node for a dotted path or ``None`` if the field
+        has no node of it's own like the keys of a ``Dict``
+    :return: a tuple of the converted update document and a dictionary of ``(node, condition)`` tuples by
+        path which restrict an ``$inc`` to documents where the result stays within ``min`` and ``max``
+    """
+    update = {}
+    guards = {}
+    for op, fields in ops.items():
+        converted = update[op] = {}
+        for path, value in fields.items():
+            node = field_node(path)
+            if node is not None:
+                if op in _value_ops:
+                    value = node.compile().serialize(value)
+                elif op in ("$inc", "$mul"):
+                    value = _number(node, op, value)
+                    if op == "$inc" and value > 0 and node.max is not None:
+                        guards[path] = (node, {'$lte' : node.max - value})
+                    elif op == "$inc" and value < 0 and node.min is not None:
+                        guards[path] = (node, {'$gte' : node.min - value})
+                elif op in _element_ops:
+                    value = _elements(node, op, value)
+                elif op == "$pull" and isinstance(node, List) and not isinstance(value, dict):
+                    # dictionaries are conditions on the elements
+                    value = node.subtype.compile().serialize(value)
+                elif op == "$pullAll" and isinstance(node, List):
+                    serialize = node.subtype.compile().serialize
+                    value = [serialize(item) for item in value]
+            converted[path] = value
+    return update, guards
+
+def guarded(spec, guards):
+    """return the query ``spec`` restricted by the ``guards`` returned from ``convert_update()``"""
+    if not guards:
+        return spec
+    conditions = [{path : condition} for path, (node, condition) in sorted(guards.items())]
+    if spec:
+        conditions.insert(0, spec)
+    if len(conditions) == 1:
+        return conditions[0]
+    return {'$and' : conditions}
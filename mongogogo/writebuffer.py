@@ -0,0 +1,153 @@
+"""
+
+write-behind buffering of saves
+
+"""
+
+import threading
+from collections import OrderedDict
+from bson import ObjectId
+from pymongo import UpdateOne
+
+__all__ = ["WriteBuffer"]
+
+
+class WriteBuffer(object):
+    """buffers the saves of a collection and writes them with one ``bulk_write``. Saving a record which
+    is already waiting in the buffer only replaces the pending document, so a record which is saved many
+    times within the window is written once. If another record with the same ``_id`` is waiting, the
+    buffer is flushed first.
+
+    The buffer is flushed if it holds ``max_size`` records, every ``interval`` seconds by a background
+    thread and on ``flush()`` or ``close()``. Records are serialized and validated when they are saved
+    but the ``after_put`` hook only runs once they have been written.
+
+    New records are written as a whole. Records loaded from the database only get their changes set
+    like with ``put()`` so concurrent updates of other fields, e.g. with ``$inc``, are not overwritten
+    unless the collection has ``partial_updates`` switched off. Writes which fail are kept in ``errors``
+    by ``_id``. If the write itself fails, e.g. because the server is not reachable, the records are put back
+    into the buffer unless they have been saved again in the meantime.
+    """
+
+    def __init__(self, collection, max_size = 1000, interval = 1.0, write_concern = None, ordered = False):
+        """initialize the buffer
+
+        :param collection: the mongogogo ``Collection`` to write to
+        :param max_size: the number of pending records which triggers a flush
+        :param interval: the number of seconds between flushes or ``None`` for no background flushing
+        :param write_concern: the pymongo ``WriteConcern`` to use for the writes of this buffer
+        :param ordered: whether to write the documents of a flush in order
+        """
+        self.collection = collection
+        self.max_size = max_size
+        self.interval = interval
+        self.write_concern = write_concern
+        self.ordered = ordered
+        self.errors = {} # WriteFailed exceptions by _id
+        self.exception = None # the last exception raised by a flush in the background thread
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        if interval is not None:
+            self._thread = threading.Thread(target = self._run, name = "mongogogo write buffer")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, obj):
+        """serialize an object and add it to the buffer as ``(obj, request, fields)`` tuple. For records
+        loaded from the database the request is an ``UpdateOne`` with their changes or ``None`` if nothing
+        changed and ``fields`` are the changed fields as returned by ``Collection._changes()``. For all
+        other records it's the serialized document and ``fields`` is ``None``."""
+        collection = self.collection
+        if collection.partial_updates and obj._mg_raw is not None and obj._id is not None and not obj.schemaless:
+            obj, update, fields = collection._prepare_changes(obj)
+            request = UpdateOne({'_id' : obj._id}, update) if update else None
+        else:
+            obj, request = collection._prepare(obj)
+            if request.get('_id') is None:
+                request['_id'] = ObjectId()
+            obj._id = request['_id']
+            fields = None
+        while True:
+            with self._lock:
+                previous = self._pending.get(obj._id)
+                if previous is None or previous[0] is obj:
+                    self._pending.pop(obj._id, None)
+                    self._pending[obj._id] = (obj, request, fields)
+                    full = len(self._pending) >= self.max_size
+                    break
+            # another record with this id is waiting. Its changes are written first so none get lost.
+            self.flush()
+        if full:
+            self.flush()
+        return obj
+
+    def flush(self):
+        """write all pending records and run their ``after_put`` hooks
+
+        :return: a dictionary of the ``WriteFailed`` exceptions of this flush by ``_id``
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = OrderedDict()
+            if not pending:
+                return {}
+            batch = [entry for entry in pending.values() if entry[1] is not None]
+            try:
+                errors = {}
+                if batch:
+                    errors = self.collection._write_batch([request for obj, request, fields in batch],
+                        self.ordered, write_concern = self.write_concern)
+            except Exception:
+                self._requeue(pending)
+                raise
+            failed = {}
+            for position, (obj, request, fields) in enumerate(batch):
+                if position in errors:
+                    failed[obj._id] = errors[position]
+            for obj, request, fields in pending.values():
+                if obj._id in failed:
+                    continue
+                if fields is not None:
+                    self.collection._changes_stored(obj, fields)
+                    continue
+                self.collection._stored(obj, request)
+            self.errors.update(failed)
+            return failed
+
+    def _requeue(self, pending):
+        """put records back into the buffer which have not been saved again in the meantime"""
+        with self._lock:
+            for _id, entry in pending.items():
+                if _id not in self._pending:
+                    self._pending[_id] = entry
+
+    def _run(self):
+        """flush the buffer every ``interval`` seconds until the buffer is closed"""
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception, e:
+                self.exception = e
+
+    def close(self):
+        """stop the background thread, detach the buffer from the collection and write all pending records"""
+        if self.collection.write_buffer is self:
+            self.collection.write_buffer = None
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -21,6 +21,9 @@ setup(name='mongogogo',
         "python-dateutil",
         "pymongo>3",
       ],
+      extras_require={
+        "async": ["tornado", "futures", "motor"],
+      },
       entry_points="""
       """,
       )